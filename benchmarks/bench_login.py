@@ -0,0 +1,131 @@
+"""Login throughput of the name server over sockets by number of clients, for
+a single registry lock (1 shard) and for a sharded registry.
+
+Every client is a process of its own that logs in and out as its own user
+(/login + /logout round trips). As in bench_server, users are injected with
+plaintext credentials, so scrypt is not measured. The server is threaded, in
+one process or, with --workers, in several processes sharing the port; the
+shards are then those of the coordinator.
+
+Run from the repository root:
+    python -m benchmarks.bench_login
+    python -m benchmarks.bench_login --workers 4
+"""
+from multiprocessing import Process, Queue, Event, Barrier
+from threading import Thread
+from socket import SOMAXCONN
+import argparse
+import os
+import sys
+import time
+
+from benchmarks.bench_server import BenchClient, free_port
+from person import Person
+from shared_registry import SharedUserRegistry, start_coordinator
+import server as name_server
+import common.global_constants as GC
+
+
+def run_worker(worker: int, state, port: int, started: Queue, stop: Event):
+    """Worker process of run_server: serves clients on port until stop is set.
+    """
+    server = name_server.Server("localhost", port, SOMAXCONN, users=SharedUserRegistry(state, worker),
+                                reuse_port=True, rate_limits=False)
+    Thread(target=name_server.serve_threaded, args=(server,), daemon=True).start()
+    started.put(worker)
+    stop.wait()
+    server.credentials.close()
+    os._exit(0)
+
+
+def run_server(shards: int, workers: int, users: int, addr_queue: Queue, stop: Event):
+    """Child process: starts a threaded name server (workers processes of it)
+    with shards registry shards and users "user<i>" (password "pw") registered,
+    and serves until stop is set.
+    """
+    sys.stdout = open(os.devnull, "w")
+    if workers == 1:
+        name_server.USER_SHARDS = shards
+        # The benchmark measures capacity, so it must not be rate limited
+        server = name_server.Server("localhost", 0, SOMAXCONN, rate_limits=False)
+        for i in range(users):
+            server.users.register(f"user{i}", "pw", Person(None))
+            server.users.logout(f"user{i}")
+        Thread(target=name_server.serve_threaded, args=(server,), daemon=True).start()
+        addr_queue.put(server.listen_socket.getsockname())
+        stop.wait()
+        server.credentials.close()
+        os._exit(0)
+
+    manager, state = start_coordinator(shards, "")
+    for i in range(users):
+        state.register(f"user{i}", "pw", ("127.0.0.1", 1), -1)
+        state.logout(f"user{i}")
+    port = free_port()
+    started = Queue()
+    processes = [Process(target=run_worker, args=(worker, state, port, started, stop))
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        started.get()
+    addr_queue.put(("127.0.0.1", port))
+    stop.wait()
+    for process in processes:
+        process.join()
+    manager.shutdown()
+    os._exit(0)
+
+
+def run_client(addr: tuple, user: int, rounds: int, barrier: Barrier):
+    """Client process: logs in and out as user<user> rounds times, between
+    two waits on barrier.
+    """
+    client = BenchClient(addr)
+    barrier.wait()
+    for _ in range(rounds):
+        assert client.command(f"/login user{user} pw 127.0.0.1 {20000 + user}") == GC.LOGIN_SUCCESS
+        client.command("/logout")
+    barrier.wait()
+    client.close()
+
+
+def bench(shards: int, workers: int, clients: int, rounds: int):
+    """
+    Returns:
+        float: logins per second over all clients.
+    """
+    addr_queue, stop = Queue(), Event()
+    server = Process(target=run_server, args=(shards, workers, clients, addr_queue, stop))
+    server.start()
+    addr = tuple(addr_queue.get())
+
+    barrier = Barrier(clients + 1)
+    processes = [Process(target=run_client, args=(addr, user, rounds, barrier)) for user in range(clients)]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    start = time.perf_counter()
+    barrier.wait()
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    stop.set()
+    server.join()
+    return clients * rounds / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="server processes sharing the port")
+    parser.add_argument("--rounds", type=int, default=200, help="logins per client")
+    options = parser.parse_args()
+
+    print(f"{options.workers} server process(es), {os.cpu_count()} CPU(s)")
+    print(f"{'clients':>8} {'1 shard':>14} {f'{options.shards} shards':>14}  (logins/s)")
+    for clients in options.clients:
+        single = bench(1, options.workers, clients, options.rounds)
+        sharded = bench(options.shards, options.workers, clients, options.rounds)
+        print(f"{clients:>8} {single:>14.0f} {sharded:>14.0f}")
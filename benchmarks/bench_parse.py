@@ -0,0 +1,49 @@
+"""parse_command against the parser it replaced, which split the whole
+input and joined the words of /msg back together.
+
+Run from the repository root:
+    python -m benchmarks.bench_parse
+"""
+import argparse
+import timeit
+
+from common.command import parse_command, commands, cmds, text_cmds
+
+
+def split_parse(user_input: str):
+    """The previous parse_command (whitespace in message text collapsed).
+    """
+    if user_input:
+        user_input = user_input.split()
+        cmd = user_input[0]
+        args = user_input[1::]
+        argsn = len(args) if cmd not in text_cmds else 2
+        cmd = cmds.get((cmd, argsn), commands.ERROR)
+
+        if cmd == commands.ERROR:
+            return cmd, []
+        elif cmd in (commands.MSG, commands.SAY):
+            return cmd, [args[0], " ".join(args[1::])]
+        else:
+            return cmd, args
+
+
+INPUTS = {
+    "lookup": "/lookup alice",
+    "login": "/login alice secret 127.0.0.1 7701",
+    "msg_short": "/msg alice see you at noon",
+    "msg_1k_words": "/msg alice " + " ".join(["word"] * 1000),
+    "invalid": "/nope a b c",
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=100000)
+    options = parser.parse_args()
+
+    print(f"{'input':<14} {'split (us)':>12} {'table (us)':>12} {'speedup':>8}")
+    for name, user_input in INPUTS.items():
+        old = min(timeit.repeat(lambda: split_parse(user_input), number=options.number, repeat=3))
+        new = min(timeit.repeat(lambda: parse_command(user_input), number=options.number, repeat=3))
+        print(f"{name:<14} {old / options.number * 1e6:>12.3f} {new / options.number * 1e6:>12.3f} {old / new:>7.1f}x")
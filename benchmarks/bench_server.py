@@ -0,0 +1,327 @@
+"""Load and latency benchmarks of the name server and the peer path, with
+JSON output to compare commits.
+
+The server runs in a child process. Users are injected straight into its
+registry, with plaintext credentials (see credentials.verify_password), so
+these numbers measure the server rather than scrypt; users that are only
+needed online are not connected. Measured:
+    login_rate    /login + /logout round trips per second, from several clients
+    lookup        /lookup latency percentiles with 1k, 10k and 100k users online
+    peer_msg      Client.msg throughput between two peers
+    connection    server memory (RSS) per idle and per logged in connection
+
+Run from the repository root:
+    python -m benchmarks.bench_server --output before.json
+    python -m benchmarks.bench_server --baseline before.json
+"""
+from multiprocessing import Process, Queue, Event
+from threading import Thread, Barrier
+from socket import socket, AF_INET, SOCK_STREAM, SOMAXCONN
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from common.messenger import Messenger
+from client import Client
+from person import Person
+import server as name_server
+import common.global_constants as GC
+
+
+METRIC_UNITS = ("_ms", "_per_s", "_bytes")
+
+def run_server(mode: str, users: int, online: bool, addr_queue: Queue, stop: Event):
+    """Child process: starts a name server on a free port with users injected
+    users named "user<i>" (password "pw"), and serves until stop is set.
+    """
+    sys.stdout = open(os.devnull, "w")
+    server_class = name_server.AsyncServer if mode == "async" else name_server.Server
+    # The benchmarks measure capacity, so they must not be rate limited
+    server = server_class("localhost", 0, SOMAXCONN, rate_limits=False)
+    for i in range(users):
+        person = Person(None)
+        person.set_login(f"user{i}", ("127.0.0.1", 10000 + i % 50000))
+        server.users.register(person.username, "pw", person)
+        if not online:
+            server.users.logout(person.username)
+
+    if mode == "async":
+        Thread(target=asyncio.run, args=(server.serve_forever(SOMAXCONN),), daemon=True).start()
+    else:
+        Thread(target=name_server.serve_threaded, args=(server,), daemon=True).start()
+    addr_queue.put(server.listen_socket.getsockname())
+    stop.wait()
+    server.credentials.close()
+    os._exit(0)
+
+
+class ServerProcess:
+    def __init__(self, mode: str, users: int = 0, online: bool = False):
+        """A name server in a child process, for use in a with statement.
+
+        Args:
+            mode (str): "thread" or "async".
+            users (int): registered users to inject (user0 .. user<users-1>).
+            online (bool): Whether the injected users are online.
+        """
+        self.addr_queue = Queue()
+        self.stop = Event()
+        # Not a daemon, as the server starts worker processes itself
+        self.process = Process(target=run_server, args=(mode, users, online, self.addr_queue, self.stop))
+
+    def __enter__(self):
+        self.process.start()
+        self.addr = tuple(self.addr_queue.get())
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.process.join()
+
+    def rss(self):
+        """
+        Returns:
+            int: resident memory of the server in bytes. None if unknown (no /proc).
+        """
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+
+class BenchClient(Messenger):
+    def __init__(self, addr):
+        """A bare protocol client: no peer inbox, no background reader, no
+        printing. Every command waits for its reply.
+        """
+        Messenger.__init__(self)
+        self.socket = socket(AF_INET, SOCK_STREAM)
+        self.socket.connect(addr)
+        self.hello(self.socket)
+
+    def command(self, msg: str):
+        """
+        Returns:
+            str: the reply to msg.
+        """
+        self.send_msg(self.socket, msg)
+        return self.receive_msg(self.socket)
+
+    def lookup(self, nickname: str = ""):
+        """
+        Returns:
+            int: number of users in the (paginated) reply.
+        """
+        self.send_msg(self.socket, "/lookup " + nickname)
+        users = 0
+        while True:
+            header, *lines = self.receive_msg(self.socket).split("\n")
+            users += len(lines)
+            page, pages, _ = header[len(GC.LOOKUP_HEADER):].split()
+            if page == pages:
+                return users
+
+    def close(self):
+        self.socket.close()
+
+
+def percentiles(samples: list):
+    """
+    Returns:
+        dict: p50, p90, p99 and max of samples, in milliseconds.
+    """
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {"p50_ms": pick(0.50), "p90_ms": pick(0.90), "p99_ms": pick(0.99), "max_ms": samples[-1] * 1000}
+
+
+def bench_login_rate(mode: str, clients: int, rounds: int):
+    """Every client logs in and out as its own user, rounds times.
+
+    Returns:
+        dict: logins per second over all clients.
+    """
+    with ServerProcess(mode, clients) as server:
+        connections = [BenchClient(server.addr) for _ in range(clients)]
+        barrier = Barrier(clients + 1)
+
+        def worker(i: int, connection: BenchClient):
+            barrier.wait()
+            for _ in range(rounds):
+                connection.command(f"/login user{i} pw 127.0.0.1 {20000 + i}")
+                connection.command("/logout")
+
+        threads = [Thread(target=worker, args=(i, c)) for i, c in enumerate(connections)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        for connection in connections:
+            connection.close()
+    return {"clients": clients, "logins_per_s": clients * rounds / elapsed}
+
+
+def bench_lookup(mode: str, users: int, requests: int):
+    """Latency of /lookup of everyone and of one user, with users online.
+
+    Returns:
+        dict: percentiles of both.
+    """
+    with ServerProcess(mode, users, online=True) as server:
+        connection = BenchClient(server.addr)
+        assert connection.command("/register bench pw 127.0.0.1 1") == GC.REGISTER_SUCCESS
+        lookup_all, lookup_one = [], []
+        for i in range(requests):
+            start = time.perf_counter()
+            found = connection.lookup()
+            lookup_all.append(time.perf_counter() - start)
+            assert found == users + 1
+
+            start = time.perf_counter()
+            connection.lookup(f"user{i % users}")
+            lookup_one.append(time.perf_counter() - start)
+        connection.close()
+    return {"users": users, "all": percentiles(lookup_all), "one": percentiles(lookup_one)}
+
+
+def free_port():
+    with socket(AF_INET, SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_peer_msg(mode: str, messages: int, size: int):
+    """One Client sends messages to another with Client.msg (direct, pooled
+    peer connection), until the receiver has them all.
+
+    Returns:
+        dict: messages and bytes per second.
+    """
+    body = "x" * size
+    with ServerProcess(mode) as server, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        sender, receiver = Client(), Client()
+        for client, name in ((sender, "sender"), (receiver, "receiver")):
+            client.connect(server.addr)
+            client.register(name, "pw", ("127.0.0.1", free_port()))
+
+        start = time.perf_counter()
+        for _ in range(messages):
+            sender.msg("receiver", body)
+        received = 0
+        while received < messages:
+            taken, dropped = receiver.peer_messages.take("sender")
+            received += len(taken) + dropped
+            if received < messages:
+                time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        sender.close()
+        receiver.close()
+    return {"messages": messages, "bytes": size, "msgs_per_s": messages / elapsed,
+            "mb_per_s": messages * size / elapsed / 1e6}
+
+
+def bench_connection_memory(mode: str, connections: int):
+    """Server RSS growth per connection, idle (only /hello) and logged in.
+
+    Returns:
+        dict: bytes per connection. None if RSS cannot be read.
+    """
+    with ServerProcess(mode, connections) as server:
+        before = server.rss()
+        clients = [BenchClient(server.addr) for _ in range(connections)]
+        time.sleep(0.2)
+        idle = server.rss()
+        for i, client in enumerate(clients):
+            client.command(f"/login user{i} pw 127.0.0.1 {20000 + i % 40000}")
+        time.sleep(0.2)
+        logged_in = server.rss()
+        for client in clients:
+            client.close()
+    if before is None:
+        return {"connections": connections, "idle_bytes": None, "logged_in_bytes": None}
+    return {"connections": connections,
+            "idle_bytes": (idle - before) / connections,
+            "logged_in_bytes": (logged_in - before) / connections}
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results: dict, prefix: str = ""):
+    """
+    Returns:
+        dict: "a.b.c" -> number, for every number in results.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(baseline: dict, results: dict):
+    """Prints every metric of results next to the one in baseline (parameters,
+    such as the number of clients, are left out).
+    """
+    old, new = flatten(baseline["results"]), flatten(results["results"])
+    print(f"{'metric':<40} {baseline.get('commit') or 'baseline':>14} {results.get('commit') or 'current':>14} {'change':>8}")
+    for key, value in new.items():
+        if key.endswith(METRIC_UNITS) and old.get(key):
+            print(f"{key:<40} {old[key]:>14.3f} {value:>14.3f} {(value / old[key] - 1) * 100:>+7.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["thread", "async"], default="async")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients for login_rate")
+    parser.add_argument("--rounds", type=int, default=200, help="logins per client")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="online users for the /lookup benchmark")
+    parser.add_argument("--requests", type=int, default=50, help="lookups per size")
+    parser.add_argument("--messages", type=int, default=5000, help="messages for peer_msg")
+    parser.add_argument("--message-size", type=int, default=100)
+    parser.add_argument("--connections", type=int, default=500, help="connections for connection memory")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    options = parser.parse_args()
+
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "mode": options.mode,
+        "results": {
+            "login_rate": bench_login_rate(options.mode, options.clients, options.rounds),
+            "lookup": {str(users): bench_lookup(options.mode, users, options.requests) for users in options.users},
+            "peer_msg": bench_peer_msg(options.mode, options.messages, options.message_size),
+            "connection": bench_connection_memory(options.mode, options.connections),
+        },
+    }
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if options.baseline:
+        with open(options.baseline) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,74 @@
+from threading import Lock
+
+from person import Person
+
+
+class ChannelIndex:
+    def __init__(self):
+        """Members of every channel, and the channels of every member.
+
+        members() is called for every message said in a channel, joins and
+        leaves are rarer, so the tuple of members handed out is rebuilt
+        only after membership changed.
+        """
+        self.lock = Lock()
+        self.channels = {} # channel -> set of Person
+        self.snapshots = {} # channel -> tuple of Person, while up to date
+        self.joined = {} # Person -> set of channels
+
+    def join(self, channel: str, person: Person):
+        """
+        Returns:
+            bool: False if person already is a member of channel.
+        """
+        with self.lock:
+            members = self.channels.setdefault(channel, set())
+            if person in members:
+                return False
+            members.add(person)
+            self.snapshots.pop(channel, None)
+            self.joined.setdefault(person, set()).add(channel)
+            return True
+
+    def leave(self, channel: str, person: Person):
+        """
+        Returns:
+            bool: False if person was not a member of channel.
+        """
+        with self.lock:
+            members = self.channels.get(channel)
+            if not members or person not in members:
+                return False
+            members.remove(person)
+            self.snapshots.pop(channel, None)
+            if not members:
+                del self.channels[channel]
+            channels = self.joined[person]
+            channels.remove(channel)
+            if not channels:
+                del self.joined[person]
+            return True
+
+    def leave_all(self, person: Person):
+        """Removes person from every channel it is a member of.
+        """
+        with self.lock:
+            for channel in self.joined.pop(person, ()):
+                members = self.channels[channel]
+                members.remove(person)
+                self.snapshots.pop(channel, None)
+                if not members:
+                    del self.channels[channel]
+
+    def members(self, channel: str):
+        """
+        Returns:
+            tuple: Person of every member of channel (empty if there are none).
+        """
+        with self.lock:
+            snapshot = self.snapshots.get(channel)
+            if snapshot is None:
+                snapshot = tuple(self.channels.get(channel, ()))
+                if snapshot:
+                    self.snapshots[channel] = snapshot
+            return snapshot
@@ -1,14 +1,31 @@
-from socket import socket, SOCK_STREAM, AF_INET
+from socket import socket, SOCK_STREAM, AF_INET, SOMAXCONN, SHUT_RDWR
 from threading import Thread, Lock
 from typing import Tuple
+from queue import Queue
 from collections import namedtuple
 import sys
+import time
 
 from common.messenger import Messenger
+from common.framing import encode_frame
+from peer_cache import PeerCache
+from peer_inbox import PeerInbox
+from peer_pool import PeerPool
+from message_store import MessageStore
 import common.global_constants as GC
 
 
-MAX_USERS = 3
+PEER_BACKLOG = SOMAXCONN
+PEER_INBOX_SIZE = 256 # peer connections received from at once
+PEER_INBOX_IDLE = 120 # seconds; longer than PEER_POOL_IDLE, so senders close first
+PEER_CACHE_SIZE = 256
+PEER_CACHE_TTL = 60 # seconds
+PEER_POOL_SIZE = 32
+PEER_POOL_IDLE = 60 # seconds
+PEER_MESSAGES_PER_SENDER = 100 # unread messages kept per peer
+PEER_MESSAGE_BYTES = 1 << 16 # unread bytes kept per peer
+PEER_SENDERS = 1024
+HEARTBEAT_INTERVAL = 30 # seconds between /ping frames to the name server
 
 User_info = namedtuple("User_info", ["is_online", "IP", "port"])
 
@@ -27,66 +44,99 @@ class Client(Messenger):
         self.connected = False
         self.logged_in = False
 
-        self.peer_messages = {}
-        self.peer_messages_lock = Lock()
+        self.peer_messages = MessageStore(PEER_MESSAGES_PER_SENDER, PEER_MESSAGE_BYTES, PEER_SENDERS)
+        self.peer_inbox = None
 
+        self.peer_cache = PeerCache(PEER_CACHE_SIZE, PEER_CACHE_TTL)
+        self.peer_pool = PeerPool(PEER_POOL_SIZE, PEER_POOL_IDLE)
 
-    def receive_peer_msg(self, s: socket):
-        """Receives a message from a peer (The outer while-loop is
-        superfluous, but there as a robustness measure, if a connection
-        is made outside of the msg method).
+        # Replies from the name server; frames it pushes unasked are
+        # handled by read_name_server instead
+        self.replies = Queue()
 
-        Args:
-            s (socket): incoming connection to retreive message from.
+        # Usernames online, kept up to date by the name server after
+        # subscribe(); None if not subscribed
+        self.roster = None
+        self.roster_lock = Lock()
+
+
+    def read_name_server(self, name_server: socket, replies: Queue):
+        """Receives every frame from name_server until the connection is
+        lost. Relayed messages go to self.peer_messages (channel messages under
+        the channel name), replies to replies (self.replies of that connection).
         """
-        # peer username is forcily prepended to all its messages
-        private_messenger = Messenger()
-
-        # While loop terminates if connection to peer lost, or
-        # user logged out:
-        while self.logged_in: # Maybe race condition?
-            # TODO: Might get stuck at receive (no, cause the connection is closed down
-            # immediately from senders side.)
-            msg = private_messenger.receive_msg(s)
+        while True:
+            msg = self.receive_msg(name_server)
+            if msg.startswith(GC.DELIVER_COMMAND + " "):
+                _, sender, body = msg.split(" ", 2)
+                self.peer_messages.add(sender, body)
+                continue
+            elif msg.startswith(GC.CHANNEL_COMMAND + " "):
+                _, channel, sender, body = msg.split(" ", 3)
+                self.peer_messages.add(channel, f"{sender}: {body}")
+                continue
+            elif msg.startswith(GC.PRESENCE_COMMAND + " "):
+                self.update_roster(msg.split()[1:])
+                continue
+            elif msg == GC.PONG:
+                continue
+            replies.put(msg)
             if not msg:
-                # Lost connection to peer
+                # Lost connection to name server
                 break
-            msg_sender = msg[:msg.find(':')]
-            with self.peer_messages_lock:
-                if msg_sender in self.peer_messages:
-                    # Already logged messages from peer
-                    self.peer_messages[msg_sender].append(msg)
-                else:
-                    # First contact with peer
-                    self.peer_messages[msg_sender] = [msg]
-        s.close()
-
-    def receive_peer_connections(self):
-        """ While client logged in, it will wait and listen for peer connections.
-        It then opens a new thread, retreiving the message from the peer.
-        accept() is cancelled when logged out by a local connection.
-        Raises:
-            SystemExit: When it cannot open listening socket, or someone failed connection.
+
+    def heartbeat(self, name_server: socket):
+        """Sends /ping to name_server every HEARTBEAT_INTERVAL seconds while
+        connected to it, so the name server does not close the connection
+        as idle.
         """
-        assert(self.logged_in), ">> You are not logged in to name server"
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            if not self.connected or name_server is not self.name_server:
+                return
+            self.send_msg(name_server, "/ping")
 
-        try:
-            # Setting up listen socket
-            listen_socket = socket(AF_INET, SOCK_STREAM)
-            listen_socket.bind(self.my_addr)
-            listen_socket.listen(MAX_USERS)
-        except Exception as e:
-            sys.exit(e)
+    def receive_reply(self):
+        """Waits for the next reply from the name server.
+
+        Returns:
+            str: the reply. "" if the connection was lost.
+        """
+        return self.replies.get()
+
+    def update_roster(self, changes: list):
+        """Applies presence changes ("+username" or "-username") to self.roster.
+        """
+        with self.roster_lock:
+            if self.roster is None:
+                return
+            for change in changes:
+                if change[0] == "+":
+                    self.roster.add(change[1:])
+                else:
+                    self.roster.discard(change[1:])
+
+    def store_peer_msg(self, msg: str):
+        """Stores a message received from a peer. The peer username is
+        forcibly prepended to all its messages.
 
-        while self.logged_in: # Maybe race condition?
-            try:
-                conn, addr = listen_socket.accept()
-                thread = Thread(target=self.receive_peer_msg, args=(conn,))
-                thread.start()
-            except Exception as e:
-                sys.exit(e)
+        Args:
+            msg (str): message received by self.peer_inbox.
+        """
+        msg_sender, _, body = msg.partition(": ")
+        self.peer_messages.add(msg_sender, body)
 
-        listen_socket.close()
+    def open_peer_inbox(self):
+        """Starts listening for peer connections on self.my_addr. All peers
+        are received from on one thread (see PeerInbox).
+        """
+        try:
+            self.peer_inbox = PeerInbox(self.my_addr, self.store_peer_msg, PEER_BACKLOG,
+                                        PEER_INBOX_SIZE, PEER_INBOX_IDLE)
+            self.peer_inbox.start()
+        except OSError as e:
+            self.peer_inbox = None
+            print(">> Could not listen for peer connections: ", e)
 
 
     def connect(self, server_addr: Tuple[str, int]):
@@ -104,11 +154,47 @@ class Client(Messenger):
             self.name_server_addr = server_addr
             self.name_server.connect(server_addr)
             self.connected = True
+            # Use length prefixed framing if the name server supports it
+            self.hello(self.name_server)
+            self.replies = Queue()
+            Thread(target=self.read_name_server, args=(self.name_server, self.replies), daemon=True).start()
+            Thread(target=self.heartbeat, args=(self.name_server,), daemon=True).start()
             print(f">> Connected to name server {server_addr}")
         except Exception as e:
             print(">> Could not connect to socket: ", e)
 
 
+    def reconnect(self, server_addr: Tuple[str, int]):
+        """Closes the connection to the name server and connects to server_addr.
+        """
+        self.send_msg(self.name_server, "/close")
+        self.name_server.shutdown(SHUT_RDWR)
+        self.name_server.close()
+        self.connected = False
+        self.name_server = socket(AF_INET, SOCK_STREAM)
+        self.connect(server_addr)
+
+
+    def login_request(self, request: str):
+        """Sends a /login or /register and waits for the reply. If the name
+        server redirects to the (federated) name server serving the username,
+        reconnects to that one and sends request again, once.
+
+        Returns:
+            str: reply of the name server.
+        """
+        self.send_msg(self.name_server, request)
+        reply = self.receive_reply()
+        if reply.startswith(GC.REDIRECT_HEADER + " "):
+            _, _, host, port = reply.split()
+            self.reconnect((host, int(port)))
+            if not self.connected:
+                return ""
+            self.send_msg(self.name_server, request)
+            reply = self.receive_reply()
+        return reply
+
+
     def login(self, username: str, passw: str, my_addr: Tuple[str, int]):
         """Tries to login to self.name_server.
 
@@ -123,8 +209,7 @@ class Client(Messenger):
         """
         assert(not self.logged_in and self.connected), f">> Could not log in: Either already logged in or not connected"
 
-        self.send_msg(self.name_server, f"/login {username} {passw} {my_addr[0]} {my_addr[1]}")
-        if self.receive_msg(self.name_server) == GC.LOGIN_SUCCESS:
+        if self.login_request(f"/login {username} {passw} {my_addr[0]} {my_addr[1]}") == GC.LOGIN_SUCCESS:
             # Setting variables:
             self.username = username
             self.password = passw
@@ -132,8 +217,7 @@ class Client(Messenger):
             self.logged_in = True
 
             # Starting peer channel
-            thread = Thread(target=self.receive_peer_connections)
-            thread.start()
+            self.open_peer_inbox()
             print(">> Logged in to name server.")
         else:
             print(">> Could not log in to name server.")
@@ -153,8 +237,7 @@ class Client(Messenger):
         """
         assert(not self.logged_in and self.connected), f">> Could not register: Either already logged in or not connected"
 
-        self.send_msg(self.name_server, f"/register {username} {passw} {my_addr[0]} {my_addr[1]}")
-        if self.receive_msg(self.name_server) == GC.REGISTER_SUCCESS:
+        if self.login_request(f"/register {username} {passw} {my_addr[0]} {my_addr[1]}") == GC.REGISTER_SUCCESS:
             # Setting variables
             self.username = username
             self.password = passw
@@ -162,16 +245,14 @@ class Client(Messenger):
             self.logged_in = True
 
             # Starting peer channel
-            thread = Thread(target=self.receive_peer_connections)
-            thread.start()
+            self.open_peer_inbox()
             print(">> Succesfully registred and logged in to name server.")
         else:
             print(">> Could not register to name server.")
 
 
     def logout(self):
-        """Tries to logout of self.name_server. Shuts down peer channel by a local
-        connection.
+        """Tries to logout of self.name_server and shuts down the peer channel.
 
         Raises:
             AssertionError: When client not logged in to name server
@@ -179,18 +260,51 @@ class Client(Messenger):
         assert(self.logged_in), ">> You are not logged in"
 
         self.send_msg(self.name_server, "/logout")
-        if self.receive_msg(self.name_server) == GC.LOGOUT_SUCCESS:
+        if self.receive_reply() == GC.LOGOUT_SUCCESS:
             self.logged_in = False
-            # Also needs to communicate to peer channel, that it should no longer
-            # wait in accept
-            with socket(AF_INET, SOCK_STREAM) as s:
-                s.connect(self.my_addr)
+            with self.roster_lock:
+                self.roster = None
+            self.peer_cache.clear()
+            self.peer_pool.close()
+            if self.peer_inbox:
+                self.peer_inbox.stop()
 
             print(">> Succesfully logged out.")
         else:
             print(">> Could not log out of server.")
 
 
+    def lookup_users(self, nickname: str):
+        """Asks the name server for nickname, or for all online users if
+        nickname == "", and parses the reply pages.
+
+        Args:
+            nickname (str): User to lookup or ""
+
+        Returns:
+            dict: username -> User_info for every online user found.
+        """
+        users = {}
+        self.send_msg(self.name_server, "/lookup " + nickname)
+
+        while True:
+            msg = self.receive_reply()
+            if not msg.startswith(GC.LOOKUP_HEADER):
+                # Lost connection or unexpected reply
+                break
+            header, *lines = msg.split("\n")
+            page, pages, _ = header[len(GC.LOOKUP_HEADER):].split()
+            for line in lines:
+                username, ip, port = line.split()
+                users[username] = User_info(True, ip, int(port))
+                self.peer_cache.put(username, users[username])
+            if page == pages:
+                break
+        if nickname and not nickname in users:
+            self.peer_cache.invalidate(nickname)
+        return users
+
+
     def lookup(self, nickname: str, printer: bool):
         """If nickname == "" looks up all online users on the name server;
         if nickname represents a user, it looks up whether the specific
@@ -207,27 +321,44 @@ class Client(Messenger):
             namedtuple Userinfo: if printer == false
             None: If printer == true
         """
-        retVal = User_info(False, "", -1)
-
         assert(self.logged_in and self.connected), ">> Could not lookup: Either not logged in or connected"
 
-        self.send_msg(self.name_server, "/lookup " + nickname)
+        users = self.lookup_users(nickname)
+        if not printer:
+            return users.get(nickname, User_info(False, "", -1))
 
-        while True:
-            msg = self.receive_msg(self.name_server)
-            if msg == GC.LOOKUP_DONE or not msg:
-                break
-            if printer:
-                print(msg)
-            else:
-                # Decode information about nickname
-                if f"{nickname} is online" in msg:
-                    retVal = retVal._replace(is_online = True)
-                elif "IP" in msg:
-                    retVal = retVal._replace(IP = msg[msg.find(':')+2:])
-                elif "Port" in msg:
-                    retVal = retVal._replace(port = int(msg[msg.find(':')+1:]))
-        return retVal if not printer else None
+        if nickname and not users:
+            print(GC.LOOKUP_FAILED(nickname))
+            return None
+        if not nickname:
+            print(f">> {len(users)} user(s) online. The list follows:")
+        for username, info in users.items():
+            print(f">> {username} is online:")
+            print(f">> IP: {info.IP}")
+            print(f">> Port: {info.port}")
+        if not nickname:
+            print(GC.LOOKUP_DONE)
+        return None
+
+
+    def subscribe(self):
+        """Subscribes to presence changes on the name server (once), and
+        prints the users online as currently known.
+
+        Raises:
+            AssertionError: If client is not logged in
+        """
+        assert(self.logged_in), ">> Could not subscribe: You are not logged in to name server"
+
+        if self.roster is None:
+            with self.roster_lock:
+                self.roster = set()
+            self.send_msg(self.name_server, "/subscribe")
+            print(self.receive_reply())
+            return
+        with self.roster_lock:
+            online = sorted(self.roster)
+        print(f">> {len(online)} user(s) online: {' '.join(online)}")
 
 
     def show(self, nickname: str):
@@ -240,34 +371,49 @@ class Client(Messenger):
         Raises:
             AssertionError: If client is not logged in
         """
-        def expression(elm: list):
-            print(*elm, sep='\n')
-            elm.clear()
         assert(self.logged_in), ">> Could not show messages: You ar enot logged in to name server"
 
-        with self.peer_messages_lock:
-            if nickname:
-                # Print all messages from specific user
-                if not nickname in self.peer_messages:
-                    print(f">> No messages from {nickname} (or invalid nickname)")
-                elif nickname in self.peer_messages and not self.peer_messages[nickname]:
-                    print(f">> No new messages from {nickname}")
-                else:
-                    print(*self.peer_messages[nickname], sep='\n')
-                    self.peer_messages[nickname] = []
+        if nickname:
+            # Print all messages from specific user
+            if not self.peer_messages.known(nickname):
+                print(f">> No messages from {nickname} (or invalid nickname)")
+                return
+            messages, dropped = self.peer_messages.take(nickname)
+            if not (messages or dropped):
+                print(f">> No new messages from {nickname}")
             else:
-                # Print messages from all users
-                # Condition whether there are no new messages
-                msg_unread = bool([elm for elm in self.peer_messages.values() if elm])
-                if not msg_unread:
-                    print(">> No new messages from any user.")
-                else:
-                    print("Messages pending:")
-                    [expression(elm) for elm in self.peer_messages.values()]
+                self.print_peer_msgs(nickname, messages, dropped)
+        else:
+            # Print messages from all users
+            senders = self.peer_messages.unread_senders()
+            if not senders:
+                print(">> No new messages from any user.")
+            else:
+                print("Messages pending:")
+                for sender in senders:
+                    self.print_peer_msgs(sender, *self.peer_messages.take(sender))
+
+
+    def print_peer_msgs(self, sender: str, messages, dropped: int):
+        """Prints the messages taken from self.peer_messages for sender.
+
+        Args:
+            sender (str): nickname of the sender.
+            messages (deque): message bodies, oldest first.
+            dropped (int): number of messages dropped before these.
+        """
+        if dropped:
+            print(f">> {dropped} older message(s) from {sender} were dropped")
+        for body in messages:
+            print(f"{sender}: {body}")
 
 
     def msg(self, nickname: str, msg: str):
         """send msg to nickname; nickname must be logged in to the name server.
+        The address of nickname is taken from self.peer_cache when possible;
+        if it cannot be reached, the entry is dropped and looked up again.
+        The connection to nickname is kept open in self.peer_pool. If nickname
+        is offline or cannot be reached, msg is relayed by the name server.
 
         Args:
             nickname (str): User to send msg to
@@ -278,16 +424,82 @@ class Client(Messenger):
         """
         assert(self.logged_in), ">> Could not send message: You are not logged in to name server"
 
-        target_info = self.lookup(nickname, False)
+        target_info = self.peer_cache.get(nickname)
+        cached = target_info is not None
+        if not cached:
+            target_info = self.lookup(nickname, False)
+
         if not target_info.is_online:
-            # Target user not logged in
-            print(GC.LOOKUP_FAILED(nickname))
-        else:
-            # Target user is logged in:
-            # Connect to target listen_socket; send message; close connection
-            with socket(AF_INET, SOCK_STREAM) as s:
-                s.connect((target_info.IP, target_info.port))
-                self.send_msg(s, f"{self.username}: " + msg)
+            # Target user not logged in; the name server may hold msg for it
+            reply = self.relay(nickname, msg)
+            print(GC.LOOKUP_FAILED(nickname) if reply == GC.LOGGEDIN_INV_COMMAND else reply)
+            return
+        try:
+            # Target user is logged in
+            self.peer_pool.send((target_info.IP, target_info.port),
+                                encode_frame(f"{self.username}: " + msg))
+        except OSError as e:
+            self.peer_cache.invalidate(nickname)
+            if cached:
+                # Address may be stale; retry with a fresh lookup
+                self.msg(nickname, msg)
+                return
+            reply = self.relay(nickname, msg)
+            if reply == GC.LOGGEDIN_INV_COMMAND:
+                print(f">> Could not reach {nickname}: ", e)
+            elif reply != GC.RELAY_QUEUED:
+                print(reply)
+
+
+    def relay(self, nickname: str, msg: str):
+        """Asks the name server to deliver msg to nickname, for peers that
+        cannot be reached directly or are offline.
+
+        Returns:
+            str: reply of the name server; GC.LOGGEDIN_INV_COMMAND if it
+                 does not relay messages.
+        """
+        self.send_msg(self.name_server, f"/msg {nickname} {msg}")
+        return self.receive_reply()
+
+
+    def join(self, channel: str):
+        """Joins channel on the name server; messages said in it are shown
+        (see show) under the channel name.
+
+        Raises:
+            AssertionError: If client not logged in
+        """
+        assert(self.logged_in), ">> Could not join channel: You are not logged in to name server"
+
+        self.send_msg(self.name_server, f"/join {channel}")
+        print(self.receive_reply())
+
+
+    def leave(self, channel: str):
+        """Leaves channel on the name server.
+
+        Raises:
+            AssertionError: If client not logged in
+        """
+        assert(self.logged_in), ">> Could not leave channel: You are not logged in to name server"
+
+        self.send_msg(self.name_server, f"/leave {channel}")
+        print(self.receive_reply())
+
+
+    def say(self, channel: str, msg: str):
+        """Sends msg to every other member of channel, through the name server.
+
+        Raises:
+            AssertionError: If client not logged in
+        """
+        assert(self.logged_in), ">> Could not send message: You are not logged in to name server"
+
+        self.send_msg(self.name_server, f"/say {channel} {msg}")
+        reply = self.receive_reply()
+        if reply != GC.RELAY_QUEUED:
+            print(reply)
 
 
     def close(self):
@@ -301,6 +513,7 @@ class Client(Messenger):
                 self.logout()
             if self.connected:
                 self.send_msg(self.name_server, "/close")
+                self.name_server.shutdown(SHUT_RDWR)
                 self.name_server.close()
                 self.connected = False
                 print(">> closing program")
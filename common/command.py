@@ -10,6 +10,13 @@ class commands(Enum):
     SHOW = 6
     ERROR = 7
     REGISTER = 8
+    HELLO = 9
+    JOIN = 10
+    LEAVE = 11
+    SAY = 12
+    SUBSCRIBE = 13
+    NODE_LOOKUP = 14
+    PING = 15
 
 cmds = {
     ("/connect", 2) : commands.CONNECT,
@@ -21,12 +28,40 @@ cmds = {
     ("/lookup", 1) : commands.LOOKUP, # number of args can be x <= 1
     ("/msg", 2) : commands.MSG,
     ("/show", 1) : commands.SHOW,
-    ("/show", 0) : commands.SHOW # number of args can be x <= 1
+    ("/show", 0) : commands.SHOW, # number of args can be x <= 1
+    ("/hello", 1) : commands.HELLO,
+    ("/join", 1) : commands.JOIN,
+    ("/leave", 1) : commands.LEAVE,
+    ("/say", 2) : commands.SAY,
+    ("/subscribe", 0) : commands.SUBSCRIBE,
+    ("/nodelookup", 0) : commands.NODE_LOOKUP,
+    ("/nodelookup", 1) : commands.NODE_LOOKUP, # number of args can be x <= 1
+    ("/ping", 0) : commands.PING
 }
 
+# Commands whose last argument is free text (and may contain spaces)
+text_cmds = {"/msg", "/say"}
+
+
+def compile_commands(cmds: dict):
+    """Groups cmds by verb, so a command is found with a single dict lookup.
+
+    Returns:
+        dict: verb -> (number of args -> commands, most args, whether the
+              last arg is free text)
+    """
+    table = {}
+    for (verb, argsn), cmd in cmds.items():
+        table.setdefault(verb, {})[argsn] = cmd
+    return {verb: (arities, max(arities), verb in text_cmds) for verb, arities in table.items()}
+
+command_table = compile_commands(cmds)
+
 
 def parse_command(user_input : str):
     """Parse a string command into a commands enum, and a list of arguments.
+    The input is split at most as many times as the command has arguments,
+    so the free text of /msg and /say is kept as it was typed.
 
     Args:
         user_input (str): The string to parse a command from
@@ -35,15 +70,17 @@ def parse_command(user_input : str):
         (commands, list): (given command, list of arguments to command)
     """
     if user_input:
-        user_input = user_input.split()
-        cmd = user_input[0]
-        args = user_input[1::]
-        argsn = len(args) if cmd != "/msg" else 2
-        cmd = cmds.get((cmd, argsn), commands.ERROR)
-
-        if cmd == commands.ERROR:
-            return cmd, []
-        elif cmd == commands.MSG:
-            return cmd, [args[0], " ".join(args[1::])]
-        else:
-            return cmd, args
\ No newline at end of file
+        verb, *rest = user_input.split(None, 1) or [""]
+        entry = command_table.get(verb)
+        if entry is None:
+            return commands.ERROR, []
+        arities, most, text = entry
+
+        args = rest[0].split(None, most - 1 if text else most) if rest else []
+        if text:
+            if not args:
+                return commands.ERROR, []
+            # Like the arguments, the text may be empty
+            return arities[most], [args[0], args[1] if len(args) > 1 else ""]
+        cmd = arities.get(len(args), commands.ERROR)
+        return cmd, args if cmd is not commands.ERROR else []
@@ -0,0 +1,266 @@
+from socket import socket
+import struct
+import zlib
+import common.global_constants as GC
+
+
+END_MARKER_BYTE = GC.END_MARKER.encode(GC.ENCODING)
+LENGTH_HEADER = struct.Struct("!I")
+COMPRESSED = 1 << 31 # flag in LENGTH_HEADER of a compressed payload (lengths are < MAX_FRAME_SIZE)
+COMPRESS_MIN = 256 # bytes of payload below which frames are not compressed
+COMPRESS_LEVEL = 6
+DEFLATE_RAW = -15 # wbits of raw deflate, without zlib header and checksum
+
+
+class FrameDecoder:
+    def __init__(self):
+        """Splits a byte stream into END_MARKER terminated frames.
+
+        Received bytes are appended to one bytearray; only bytes that have not
+        been searched before are scanned for END_MARKER, and every frame is
+        decoded exactly once, when it is complete. This keeps multi-byte
+        characters split across recv() calls intact.
+        """
+        self.buffer = bytearray()
+        self.scanned = 0 # bytes of buffer known not to contain END_MARKER
+        self.received = 0 # bytes fed so far
+
+    def feed(self, data: bytes):
+        """Appends data to the buffer and returns the frames it completed.
+
+        Args:
+            data (bytes): bytes received from the socket.
+
+        Returns:
+            list: decoded frames (str), in order. Empty if none completed.
+        """
+        self.buffer += data
+        self.received += len(data)
+        frames = []
+        start = 0
+        with memoryview(self.buffer) as view:
+            while True:
+                mark_idx = self.buffer.find(END_MARKER_BYTE, self.scanned)
+                if mark_idx < 0:
+                    self.scanned = len(self.buffer)
+                    break
+                frames.append(str(view[start:mark_idx], GC.ENCODING, "replace"))
+                start = mark_idx + 1
+                self.scanned = start
+        if start:
+            # Drop consumed frames; only the unfinished tail is kept
+            del self.buffer[:start]
+            self.scanned -= start
+        return frames
+
+    def receive(self, s: socket):
+        """Receives once from s.
+
+        Returns:
+            list: frames completed by the received bytes. None on end of file.
+        """
+        data = s.recv(GC.BUFFSIZE)
+        if not data:
+            return None
+        return self.feed(data)
+
+    def pending(self):
+        """
+        Returns:
+            bytes: buffered bytes not yet part of a complete frame.
+        """
+        return bytes(self.buffer)
+
+
+class LengthPrefixDecoder:
+    flags = 0 # header bits that are not part of the length
+
+    def __init__(self, size: int = GC.BUFFSIZE):
+        """Splits a byte stream into frames that start with a 4 byte
+        big-endian payload length (LENGTH_HEADER).
+
+        Bytes are received with recv_into() straight into a preallocated
+        buffer, which only grows when a single frame does not fit. The
+        payload is never searched, so it may contain any byte.
+
+        Args:
+            size (int): initial buffer size.
+        """
+        self.size = size
+        self.buffer = bytearray(size)
+        self.start = 0 # first byte not yet consumed
+        self.end = 0 # end of received bytes
+        self.received = 0 # bytes fed so far
+
+    def needed(self):
+        """
+        Returns:
+            int: size of the frame being received (header included), or of
+                 the header alone if it has not been received yet.
+
+        Raises:
+            ValueError: If the announced frame exceeds GC.MAX_FRAME_SIZE.
+        """
+        if self.end - self.start < LENGTH_HEADER.size:
+            return LENGTH_HEADER.size
+        (length,) = LENGTH_HEADER.unpack_from(self.buffer, self.start)
+        length &= ~self.flags
+        if length > GC.MAX_FRAME_SIZE:
+            raise ValueError(f"frame of {length} bytes exceeds maximum frame size")
+        return LENGTH_HEADER.size + length
+
+    def reserve(self):
+        """Makes room after self.end for at least the rest of the current frame.
+        """
+        needed = self.needed()
+        if self.start + needed <= len(self.buffer) and self.end < len(self.buffer):
+            return
+        # Move unconsumed bytes to the front, and grow if the frame is larger
+        # than the whole buffer
+        unconsumed = self.end - self.start
+        self.buffer[:unconsumed] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, unconsumed
+        if needed > len(self.buffer):
+            self.buffer.extend(bytes(needed - len(self.buffer)))
+
+    def frames(self):
+        """
+        Returns:
+            list: decoded frames (str) completely contained in the buffer.
+        """
+        frames = []
+        with memoryview(self.buffer) as view:
+            while True:
+                needed = self.needed()
+                if self.end - self.start < needed:
+                    break
+                frames.append(self.decode(view[self.start:self.start + needed]))
+                self.start += needed
+        if self.start == self.end:
+            self.start = self.end = 0
+            # Give back memory taken by an oversized frame
+            del self.buffer[self.size:]
+        return frames
+
+    def decode(self, frame: memoryview):
+        """
+        Args:
+            frame (memoryview): a complete frame, header included.
+
+        Returns:
+            str: the decoded payload.
+        """
+        return str(frame[LENGTH_HEADER.size:], GC.ENCODING, "replace")
+
+    def feed(self, data: bytes):
+        """Copies data into the buffer and returns the frames it completed.
+
+        Args:
+            data (bytes): bytes received from the socket.
+
+        Returns:
+            list: decoded frames (str), in order. Empty if none completed.
+        """
+        frames = []
+        self.received += len(data)
+        view = memoryview(data)
+        while len(view):
+            self.reserve()
+            n = min(len(view), len(self.buffer) - self.end)
+            self.buffer[self.end:self.end + n] = view[:n]
+            self.end += n
+            view = view[n:]
+            frames.extend(self.frames())
+        return frames
+
+    def pending(self):
+        """
+        Returns:
+            bytes: buffered bytes not yet part of a complete frame.
+        """
+        return bytes(self.buffer[self.start:self.end])
+
+    def receive(self, s: socket):
+        """Receives once from s directly into the buffer.
+
+        Returns:
+            list: frames completed by the received bytes. None on end of file.
+        """
+        self.reserve()
+        with memoryview(self.buffer) as view:
+            n = s.recv_into(view[self.end:])
+        if not n:
+            return None
+        self.end += n
+        self.received += n
+        return self.frames()
+
+
+class CompressedDecoder(LengthPrefixDecoder):
+    """A LengthPrefixDecoder for frames whose payload may be compressed (see
+    encode_compressed_frame).
+    """
+    flags = COMPRESSED
+
+    def decode(self, frame: memoryview):
+        """
+        Raises:
+            ValueError: If the payload does not inflate to at most GC.MAX_FRAME_SIZE bytes.
+        """
+        (header,) = LENGTH_HEADER.unpack_from(frame)
+        if not header & COMPRESSED:
+            return super().decode(frame)
+        inflater = zlib.decompressobj(DEFLATE_RAW, zdict=GC.COMPRESSION_DICT)
+        try:
+            payload = inflater.decompress(frame[LENGTH_HEADER.size:], GC.MAX_FRAME_SIZE)
+        except zlib.error as e:
+            raise ValueError(f"bad compressed frame: {e}")
+        if inflater.unconsumed_tail:
+            raise ValueError("compressed frame exceeds maximum frame size")
+        return str(payload, GC.ENCODING, "replace")
+
+
+def encode_frame(msg: str):
+    """Encodes msg as an END_MARKER terminated frame.
+
+    Returns:
+        bytes: the frame to send.
+    """
+    return bytes(msg + GC.END_MARKER, GC.ENCODING)
+
+
+def encode_length_frame(msg: str):
+    """Encodes msg as a length prefixed frame.
+
+    Returns:
+        bytes: the frame to send.
+    """
+    payload = bytes(msg, GC.ENCODING)
+    return LENGTH_HEADER.pack(len(payload)) + payload
+
+
+def encode_compressed_frame(msg: str):
+    """Encodes msg as a length prefixed frame, with the payload compressed
+    (raw deflate with GC.COMPRESSION_DICT) if it is at least COMPRESS_MIN
+    bytes and compression makes it smaller. Every frame is compressed on its
+    own, so frames can be decoded in any connection's order and a frame sent
+    to many connections is compressed once.
+
+    Returns:
+        bytes: the frame to send.
+    """
+    payload = bytes(msg, GC.ENCODING)
+    if len(payload) >= COMPRESS_MIN:
+        deflater = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, DEFLATE_RAW, zdict=GC.COMPRESSION_DICT)
+        packed = deflater.compress(payload) + deflater.flush()
+        if len(packed) < len(payload):
+            return LENGTH_HEADER.pack(len(packed) | COMPRESSED) + packed
+    return LENGTH_HEADER.pack(len(payload)) + payload
+
+
+# framing name -> (decoder class, encoder)
+FRAMINGS = {
+    GC.FRAMING_NUL: (FrameDecoder, encode_frame),
+    GC.FRAMING_LENGTH: (LengthPrefixDecoder, encode_length_frame),
+    GC.FRAMING_ZLIB: (CompressedDecoder, encode_compressed_frame),
+}
@@ -14,4 +14,45 @@ LOGOUT_FAILURE = ">> logout failure"
 LOGIN_INV_COMMAND = ">> Invalid command. Current valid commands: login, register, close"
 LOGGEDIN_INV_COMMAND = ">> Invalid command. Current valid commands: msg, show, lookup, logout"
 LOOKUP_DONE = ">> No more users online"
-LOOKUP_FAILED = lambda x: f">> {x} is not online (or username invalid)"
\ No newline at end of file
+LOOKUP_PAGE_SIZE = 1000 # users per /lookup reply frame
+LOOKUP_HEADER = ">> lookup"
+LOOKUP_PAGE = lambda page, pages, total: f"{LOOKUP_HEADER} {page} {pages} {total}"
+LOOKUP_FAILED = lambda x: f">> {x} is not online (or username invalid)"
+RELAY_QUEUED = ">> msg relayed"
+RELAY_FULL = lambda x: f">> {x} has too many pending messages"
+RELAY_STORED = lambda x: f">> {x} is offline; msg will be delivered on login"
+RELAY_REMOTE = lambda x: f">> {x} is served by another server process or name server; msg not relayed"
+JOIN_SUCCESS = lambda x: f">> joined {x}"
+JOIN_FAILURE = lambda x: f">> already a member of {x}"
+LEAVE_SUCCESS = lambda x: f">> left {x}"
+CHANNEL_NOT_MEMBER = lambda x: f">> not a member of {x}"
+PRESENCE_SUBSCRIBED = ">> subscribed to presence"
+PONG = ">> pong" # reply to /ping
+RATE_LIMITED = ">> too many requests; try again later"
+# Reply to a /login or /register of a username served by another (federated) name server
+REDIRECT_HEADER = ">> redirect"
+REDIRECT = lambda host, port: f"{REDIRECT_HEADER} {host} {port}"
+# Lookup of the users of one name server, by the other federated name servers
+NODE_LOOKUP_COMMAND = "/nodelookup"
+
+# Frames the name server pushes unasked start with a command, replies with ">>"
+DELIVER_COMMAND = "/deliver"
+DELIVER = lambda sender, msg: f"{DELIVER_COMMAND} {sender} {msg}"
+CHANNEL_COMMAND = "/channel"
+CHANNEL_DELIVER = lambda channel, sender, msg: f"{CHANNEL_COMMAND} {channel} {sender} {msg}"
+# "+username" for every user that came online, "-username" for every user that went offline
+PRESENCE_COMMAND = "/presence"
+PRESENCE = lambda changes: f"{PRESENCE_COMMAND} {' '.join(changes)}"
+MAX_FRAME_SIZE = 1 << 24
+FRAMING_NUL = "nul"
+FRAMING_LENGTH = "lp"
+HELLO_REPLY = lambda features: f">> hello {' '.join(features)}"
+FRAMING_ZLIB = "lpz" # length prefixed, large payloads compressed
+# Preset dictionary of compressed frames: protocol strings that recur in the
+# frames worth compressing (lookup listings, relayed and pushed messages),
+# the most frequent last. Both ends must use the same bytes, so changing it
+# needs a new framing name.
+COMPRESSION_DICT = " ".join([
+    LOOKUP_DONE, RELAY_QUEUED, PRESENCE_COMMAND, CHANNEL_COMMAND, DELIVER_COMMAND,
+    LOOKUP_HEADER, "\n127.0.0.1 5", "\n192.168.", "\n10.0.",
+]).encode(ENCODING)
@@ -0,0 +1,128 @@
+from logging.handlers import QueueHandler, QueueListener
+from contextvars import ContextVar
+from queue import Queue, Full
+from threading import Lock
+import json
+import logging
+import sys
+import time
+
+
+LOG_QUEUE_SIZE = 10000 # records waiting for the writer; more are dropped
+SAMPLE_INTERVAL = 10.0 # seconds
+SAMPLE_BURST = 5 # records per message and interval, at WARNING and above
+
+# (address, Person) of the connection being served by the current thread or task
+connection = ContextVar("connection", default=None)
+
+
+def set_connection(addr, person):
+    """Tags the records logged from here on (in this thread or asyncio task)
+    with addr and, once logged in, the username of person.
+    """
+    host, port = addr[:2]
+    connection.set((f"{host}:{port}", person))
+
+
+class ContextFilter(logging.Filter):
+    """Adds conn and user (see set_connection) to records.
+    """
+    def filter(self, record: logging.LogRecord):
+        ctx = connection.get()
+        if ctx:
+            record.conn = ctx[0]
+            record.user = getattr(ctx[1], "username", None)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, interval: float = SAMPLE_INTERVAL, burst: int = SAMPLE_BURST):
+        """Lets at most burst records of every message (the format string,
+        not the formatted text) at WARNING and above through per interval.
+        The first record let through after some were dropped tells how many.
+        """
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.lock = Lock()
+        self.windows = {} # (logger, msg) -> [window start, records, dropped]
+
+    def filter(self, record: logging.LogRecord):
+        if record.levelno < logging.WARNING:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.msg)
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                dropped = window[2] if window else 0
+                window = self.windows[key] = [now, 0, 0]
+                if dropped:
+                    record.suppressed = dropped
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """A QueueHandler that drops records when the queue is full, instead of
+    waiting for the writer.
+    """
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line. Tracebacks are part of
+    msg, as QueueHandler formats them before queueing.
+    """
+    FIELDS = ("conn", "user", "suppressed")
+
+    def format(self, record: logging.LogRecord):
+        entry = {
+            "time": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry)
+
+
+def setup_logging(level: str = "INFO", stream=sys.stderr):
+    """Sends all log records, as JSON lines, through a bounded queue to a
+    background thread that writes them to stream. Logging a record then
+    only formats its message and queues it, so it never waits for stream.
+
+    Args:
+        level (str): lowest level logged (e.g. "DEBUG", "INFO").
+
+    Returns:
+        QueueListener: the writer; stop() flushes and stops it.
+    """
+    queue = Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(queue)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter())
+
+    writer = logging.StreamHandler(stream)
+    writer.setFormatter(JsonFormatter())
+    listener = QueueListener(queue, writer)
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    listener.start()
+    return listener
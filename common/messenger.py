@@ -1,37 +1,80 @@
 from socket import socket
+from collections import deque
+from threading import Lock
+from weakref import WeakKeyDictionary
+import logging
 import common.global_constants as GC
+from common.framing import FRAMINGS
+
+
+log = logging.getLogger(__name__)
+
+
+class Stream:
+    def __init__(self, framing: str = GC.FRAMING_NUL):
+        """Framing state of one socket: how frames are encoded, its receive
+        buffer and the frames decoded from it that have not been handed out yet.
+
+        Args:
+            framing (str): GC.FRAMING_NUL, GC.FRAMING_LENGTH or GC.FRAMING_ZLIB.
+        """
+        self.frames = deque()
+        self.decoder = None
+        self.set_framing(framing)
+        # Frames may be sent from several threads (e.g. relayed messages)
+        self.send_lock = Lock()
+
+    def set_framing(self, framing: str):
+        """Switches framing. Bytes already received but not yet decoded are
+        decoded with the new framing.
+        """
+        pending = self.decoder.pending() if self.decoder else b""
+        decoder_class, self.encode = FRAMINGS[framing]
+        self.framing = framing
+        self.decoder = decoder_class()
+        self.frames.extend(self.decoder.feed(pending))
+
 
 class Messenger:
     def __init__(self):
-        self.messages = []
+        # One Stream per socket, so several connections (e.g. server threads)
+        # never mix up each others bytes. Dropped with the socket.
+        self.streams = WeakKeyDictionary()
+
+        # Traffic counters (see common.metrics); only counted when set
+        self.frames_in = self.bytes_in = None
+        self.frames_out = self.bytes_out = None
+
+    def stream(self, s: socket):
+        """
+        Returns:
+            Stream: receive state of s (created on first use).
+        """
+        stream = self.streams.get(s)
+        if stream is None:
+            stream = self.streams[s] = Stream()
+        return stream
 
     def receive_msg(self, s: socket):
-        """Waits for and retrieves message form s.
+        """Waits for and retrieves message form s. A single recv() may
+        complete several messages; the rest are kept for the next calls.
 
         Returns:
             str: decoded message retrieved. "" if no message or error
         """
         try:
-            while (True):
-                if len(self.messages) > 0 and GC.END_MARKER in self.messages[0]:
-                    # messages already contains a whole element
-                    break
-                msg = s.recv(1024).decode("utf-8")
-                if not msg: # End of file recieved
-                    break
-                self.messages.append(msg)
-                if GC.END_MARKER in msg:
-                    break
-                elif len(self.messages) > 1:
-                    last_pair = self.messages[-2] + self.messages[-1]
-                    if GC.END_MARKER in last_pair:
-                        break
-            msg = "".join(self.messages)
-            mark_idx = msg.find(GC.END_MARKER)
-            self.messages = [msg[mark_idx + 1:]]
-            return msg[:mark_idx]
+            stream = self.stream(s)
+            while not stream.frames:
+                decoder = stream.decoder
+                received = decoder.received
+                frames = decoder.receive(s)
+                if frames is None: # End of file recieved
+                    return ""
+                stream.frames.extend(frames)
+                self.count_received(len(frames), decoder.received - received)
+            return stream.frames.popleft()
         except Exception as e:
-            print(">> could not recieve message: ", e)
+            log.warning("could not receive message: %s", e)
             return ""
 
     def send_msg(self, s: socket, msg: str):
@@ -43,6 +86,91 @@ class Messenger:
             msg (str): msg to encode and send
         """
         try:
-            s.sendall(bytes(msg + GC.END_MARKER, GC.ENCODING))
+            stream = self.stream(s)
+            data = stream.encode(msg)
+            with stream.send_lock:
+                s.sendall(data)
+            self.count_sent(1, len(data))
         except Exception as e:
-            print(">> Could not send message: ", e)
+            log.warning("could not send message: %s", e)
+
+    def send_msgs(self, s: socket, msgs: list):
+        """Sends several messages with a single sendall().
+
+        Args:
+            msgs (list): msgs (str) to encode and send, in order.
+        """
+        try:
+            stream = self.stream(s)
+            data = b"".join(stream.encode(msg) for msg in msgs)
+            with stream.send_lock:
+                s.sendall(data)
+            self.count_sent(len(msgs), len(data))
+        except Exception as e:
+            log.warning("could not send message: %s", e)
+
+    def send_data(self, s: socket, data: bytes, frames: int = 1):
+        """Sends already encoded frames (see Stream.encode) with a single sendall().
+
+        Args:
+            frames (int): number of frames in data.
+        """
+        try:
+            with self.stream(s).send_lock:
+                s.sendall(data)
+            self.count_sent(frames, len(data))
+        except Exception as e:
+            log.warning("could not send message: %s", e)
+
+    def count_received(self, frames: int, nbytes: int):
+        if self.frames_in:
+            self.frames_in.inc(frames)
+            self.bytes_in.inc(nbytes)
+
+    def count_sent(self, frames: int, nbytes: int):
+        if self.frames_out:
+            self.frames_out.inc(frames)
+            self.bytes_out.inc(nbytes)
+
+    def hello(self, s: socket, framing: str = GC.FRAMING_ZLIB):
+        """Asks the peer at the other end of s for framing. Must be sent before
+        any other message on s. The peer answers with the framing it chose
+        (GC.FRAMING_LENGTH when it does not compress); a peer that does not
+        know /hello answers with an error, and s keeps END_MARKER framing.
+
+        Args:
+            framing (str): the framing asked for.
+
+        Returns:
+            bool: Whether length prefixed framing is used from now on.
+        """
+        self.send_msg(s, f"/hello {framing}")
+        reply = self.receive_msg(s)
+        prefix = GC.HELLO_REPLY([])
+        chosen = reply[len(prefix):] if reply.startswith(prefix) else GC.FRAMING_NUL
+        if chosen in FRAMINGS and chosen != GC.FRAMING_NUL:
+            self.stream(s).set_framing(chosen)
+            return True
+        return False
+
+    def negotiate(self, args: list):
+        """Chooses the framing to answer a /hello with.
+
+        Args:
+            args (list): Arguments of the /hello command.
+
+        Returns:
+            str: the framing both sides will use.
+        """
+        return args[0] if args and args[0] in FRAMINGS else GC.FRAMING_NUL
+
+    def answer_hello(self, s: socket, args: list):
+        """Answers a /hello on s (in the old framing), then switches s to
+        the negotiated framing.
+
+        Args:
+            args (list): Arguments of the /hello command.
+        """
+        framing = self.negotiate(args)
+        self.send_msg(s, GC.HELLO_REPLY([framing]))
+        self.stream(s).set_framing(framing)
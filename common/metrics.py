@@ -0,0 +1,182 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+from typing import Tuple
+import bisect
+import time
+
+
+# Upper bounds (seconds) of the buckets of latency histograms
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self):
+        """A number that only goes up.
+        """
+        self.lock = Lock()
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: str):
+        """
+        Returns:
+            list: Prometheus text lines of this metric.
+        """
+        return [f"{name}{labels} {self.value}"]
+
+
+class Gauge(Counter):
+    """A number that goes up and down.
+    """
+    def dec(self, amount: float = 1):
+        with self.lock:
+            self.value -= amount
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        """Counts observed values per bucket; observe() does a binary search
+        and one increment, cumulative counts are only computed when rendered.
+
+        Args:
+            buckets (tuple): sorted upper bounds of the buckets.
+        """
+        self.lock = Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name: str, labels: str):
+        """
+        Returns:
+            list: Prometheus text lines of this metric.
+        """
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        inner = labels[1:-1] + "," if labels else ""
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{inner}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {total}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class TimedLock:
+    def __init__(self, waits: Histogram, acquires: Counter):
+        """A Lock (for use in with statements) that records how long acquiring
+        it had to wait. Uncontended acquires are only counted, so they stay
+        almost as cheap as with a plain Lock.
+
+        Args:
+            waits (Histogram): seconds waited by contended acquires.
+            acquires (Counter): all acquires.
+        """
+        self.lock = Lock()
+        self.waits = waits
+        self.acquires = acquires
+
+    def __enter__(self):
+        if not self.lock.acquire(blocking=False):
+            start = time.perf_counter()
+            self.lock.acquire()
+            self.waits.observe(time.perf_counter() - start)
+        self.acquires.inc()
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+class Metrics:
+    def __init__(self):
+        """Named metrics, rendered in the Prometheus text format.
+        """
+        self.lock = Lock()
+        self.families = {} # name -> (type, help, {labels: metric})
+
+    def metric(self, kind: str, name: str, help: str, factory, labels: dict):
+        """Returns the metric name with labels, created with factory on first use.
+        """
+        key = ",".join(f'{label}="{value}"' for label, value in sorted(labels.items()))
+        with self.lock:
+            family = self.families.setdefault(name, (kind, help, {}))
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = factory()
+            return metric
+
+    def counter(self, name: str, help: str, **labels):
+        """
+        Returns:
+            Counter: the counter name with labels.
+        """
+        return self.metric("counter", name, help, Counter, labels)
+
+    def gauge(self, name: str, help: str, **labels):
+        """
+        Returns:
+            Gauge: the gauge name with labels.
+        """
+        return self.metric("gauge", name, help, Gauge, labels)
+
+    def histogram(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS, **labels):
+        """
+        Returns:
+            Histogram: the histogram name with labels.
+        """
+        return self.metric("histogram", name, help, lambda: Histogram(buckets), labels)
+
+    def render(self):
+        """
+        Returns:
+            str: every metric in the Prometheus text exposition format.
+        """
+        with self.lock:
+            families = [(name, kind, help, list(metrics.items()))
+                        for name, (kind, help, metrics) in sorted(self.families.items())]
+        lines = []
+        for name, kind, help, metrics in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in metrics:
+                lines.extend(metric.samples(name, f"{{{key}}}" if key else ""))
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics: Metrics, addr: Tuple[str, int]):
+    """Serves metrics.render() at http://addr/metrics on a background thread.
+
+    Returns:
+        ThreadingHTTPServer: the server (shutdown() stops it).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(addr, Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,219 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+from multiprocessing import get_context
+from threading import Lock
+import hashlib
+import hmac
+import logging
+import os
+
+import common.global_constants as GC
+
+
+# scrypt cost parameters of new credentials
+SCRYPT_N = 1 << 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+
+log = logging.getLogger(__name__)
+
+
+def hash_password(passw: str):
+    """Derives a salted scrypt credential from passw (run in a worker process).
+
+    Returns:
+        str: "scrypt$n$r$p$salt$hash", salt and hash in hex.
+    """
+    salt = os.urandom(SALT_SIZE)
+    digest = hashlib.scrypt(passw.encode(GC.ENCODING), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(passw: str, credential: str):
+    """Checks passw against a credential made by hash_password (run in a worker
+    process). Credentials that are not scrypt credentials are plaintext
+    passwords registered before passwords were hashed.
+
+    Returns:
+        bool: Whether passw is correct.
+    """
+    if not credential.startswith("scrypt$"):
+        return hmac.compare_digest(passw.encode(GC.ENCODING), credential.encode(GC.ENCODING))
+    _, n, r, p, salt, digest = credential.split("$")
+    computed = hashlib.scrypt(passw.encode(GC.ENCODING), salt=bytes.fromhex(salt),
+                              n=int(n), r=int(r), p=int(p))
+    return hmac.compare_digest(computed, bytes.fromhex(digest))
+
+
+def completed(result):
+    """
+    Returns:
+        Future: a future already holding result.
+    """
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class CredentialService:
+    def __init__(self, workers: int, cache_size: int):
+        """Hashes and verifies passwords in a pool of worker processes, so the
+        (deliberately slow) key derivation neither holds the GIL nor any
+        registry lock. Successful verifications are cached, keyed by a keyed
+        digest of the password that is only valid in this process.
+
+        The workers are started by a fork server rather than forked from the
+        name server, so they do not hold (and keep open) its client sockets.
+        If one of them dies, the jobs it had fail and the pool is replaced.
+
+        Args:
+            workers (int): worker processes; also bounds the jobs in flight
+                           to 4 per worker, later jobs are queued here.
+            cache_size (int): maximum number of cached verifications.
+        """
+        self.workers = workers
+        self.pool = self.new_pool()
+        self.pool_lock = Lock()
+        self.closed = False
+        self.max_running = 4 * workers
+        self.running = 0 # jobs in the pool
+        self.waiting = deque() # (Future, fn, args) of jobs not in the pool yet
+        self.jobs_lock = Lock()
+
+        self.cache_key = os.urandom(32)
+        self.cache_size = cache_size
+        self.cache = OrderedDict() # username -> (credential, password digest)
+        self.cache_lock = Lock()
+
+    def new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("forkserver"))
+
+    def replace_pool(self, broken: ProcessPoolExecutor):
+        """Replaces broken, a pool one of whose worker processes died (which
+        fails all its jobs, now and later), unless that was done already.
+
+        Returns:
+            ProcessPoolExecutor: the pool to submit to.
+        """
+        with self.pool_lock:
+            if self.pool is broken and not self.closed:
+                log.warning("a credential worker process died; starting new workers")
+                self.pool = self.new_pool()
+                broken.shutdown(wait=False)
+            return self.pool
+
+    def submit(self, fn, *args):
+        """Runs fn(*args) in a worker process. Never waits, so it may be
+        called on an event loop: beyond max_running jobs in flight, the job
+        is queued until one of them is done.
+
+        Returns:
+            Future: result of fn.
+        """
+        future = Future()
+        with self.jobs_lock:
+            if self.running == self.max_running:
+                self.waiting.append((future, fn, args))
+                return future
+            self.running += 1
+        self.start(future, fn, args)
+        return future
+
+    def start(self, future: Future, fn, args: tuple):
+        """Submits a job to the pool; its outcome is passed on to future.
+        """
+        while True:
+            pool = self.pool
+            try:
+                try:
+                    job = pool.submit(fn, *args)
+                except BrokenProcessPool:
+                    pool = self.replace_pool(pool)
+                    job = pool.submit(fn, *args)
+            except RuntimeError as e: # pool shut down, or broken again
+                future.set_exception(e)
+                queued = self.next_job()
+                if queued is None:
+                    return
+                future, fn, args = queued
+                continue
+            job.add_done_callback(lambda job: self.finished(future, job, pool))
+            return
+
+    def next_job(self):
+        """Takes the next queued job, now that one in flight is done.
+
+        Returns:
+            tuple: (Future, fn, args) of the job. None if none is queued.
+        """
+        with self.jobs_lock:
+            if self.waiting:
+                return self.waiting.popleft()
+            self.running -= 1
+            return None
+
+    def finished(self, future: Future, job: Future, pool: ProcessPoolExecutor):
+        """Passes the outcome of job (submitted to pool) on to future, and
+        starts the next queued job.
+        """
+        if isinstance(job.exception(), BrokenProcessPool):
+            self.replace_pool(pool)
+        queued = self.next_job()
+        if job.exception() is not None:
+            future.set_exception(job.exception())
+        else:
+            future.set_result(job.result())
+        if queued:
+            self.start(*queued)
+
+    def hash(self, passw: str):
+        """
+        Returns:
+            Future: resolves to a new credential for passw.
+        """
+        return self.submit(hash_password, passw)
+
+    def verify(self, username: str, passw: str, credential: str):
+        """Checks passw against the stored credential of username.
+
+        Args:
+            credential (str): stored credential; None if username is unknown.
+
+        Returns:
+            Future: resolves to credential if passw is correct, else None.
+        """
+        if credential is None:
+            return completed(None)
+
+        digest = hmac.new(self.cache_key, passw.encode(GC.ENCODING), hashlib.sha256).digest()
+        with self.cache_lock:
+            cached = self.cache.get(username)
+            if cached and cached[0] == credential:
+                self.cache.move_to_end(username)
+                return completed(credential if hmac.compare_digest(cached[1], digest) else None)
+
+        result = Future()
+        def done(job: Future):
+            if job.exception() is not None:
+                result.set_exception(job.exception())
+            elif job.result():
+                self.remember(username, credential, digest)
+                result.set_result(credential)
+            else:
+                result.set_result(None)
+        self.submit(verify_password, passw, credential).add_done_callback(done)
+        return result
+
+    def remember(self, username: str, credential: str, digest: bytes):
+        with self.cache_lock:
+            self.cache[username] = (credential, digest)
+            self.cache.move_to_end(username)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def close(self):
+        with self.pool_lock:
+            self.closed = True
+        self.pool.shutdown()
@@ -0,0 +1,225 @@
+from socket import socket, create_connection, getaddrinfo, gaierror
+from bisect import bisect
+from threading import Lock
+import hashlib
+import logging
+
+from common.messenger import Messenger
+from peer_cache import PeerCache
+import common.global_constants as GC
+
+
+VIRTUAL_NODES = 64 # points of every node on the hash ring
+LINK_TIMEOUT = 2.0 # seconds to wait for another node
+LINK_IDLE = 8 # idle connections kept open per node
+
+log = logging.getLogger(__name__)
+
+
+def parse_node(text: str):
+    """
+    Args:
+        text (str): "host:port".
+
+    Returns:
+        (str, int): (host, port)
+    """
+    host, _, port = text.rpartition(":")
+    return host, int(port)
+
+
+def resolve(host: str):
+    """
+    Returns:
+        set: IP addresses of host (empty if it could not be resolved).
+    """
+    try:
+        return {info[4][0] for info in getaddrinfo(host, None)}
+    except gaierror as e:
+        log.warning("could not resolve node %s: %s", host, e)
+        return set()
+
+
+def ring_hash(key: str):
+    """
+    Returns:
+        int: position of key on the hash ring (64 bits).
+    """
+    return int.from_bytes(hashlib.sha1(key.encode(GC.ENCODING)).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes: list, virtual_nodes: int = VIRTUAL_NODES):
+        """Assigns usernames to nodes by consistent hashing: every node is put
+        on the ring at virtual_nodes points, and a username belongs to the node
+        of the first point after its hash. Adding or removing a node only moves
+        the usernames of the points it takes or leaves.
+
+        Args:
+            nodes (list): (host, port) of every node.
+        """
+        points = sorted((ring_hash(f"{host}:{port}#{i}"), (host, port))
+                        for host, port in nodes for i in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def owner(self, username: str):
+        """
+        Returns:
+            (str, int): (host, port) of the node username belongs to.
+        """
+        return self.nodes[bisect(self.hashes, ring_hash(username)) % len(self.hashes)]
+
+
+class NodeLink(Messenger):
+    def __init__(self, addr: tuple, idle: int = LINK_IDLE):
+        """Connections to another node, to send it /nodelookup requests. A
+        connection is used by one request at a time; up to idle of them are
+        kept open for the next requests.
+
+        Args:
+            addr (str, int): (host, port) of the node.
+        """
+        Messenger.__init__(self)
+        self.addr = addr
+        self.max_idle = idle
+        self.idle = [] # socket
+        self.lock = Lock()
+
+    def connect(self):
+        s = create_connection(self.addr, LINK_TIMEOUT)
+        self.hello(s)
+        return s
+
+    def request(self, s: socket, msg: str):
+        """Sends msg on s and receives the lookup reply pages.
+
+        Returns:
+            list: "username IP port" line of every user in the reply.
+
+        Raises:
+            ConnectionError: If no lookup reply was received.
+        """
+        self.send_msg(s, msg)
+        lines = []
+        while True:
+            reply = self.receive_msg(s)
+            if not reply.startswith(GC.LOOKUP_HEADER):
+                raise ConnectionError(f"no lookup reply from {self.addr[0]}:{self.addr[1]}")
+            header, *page = reply.split("\n")
+            number, pages, _ = header[len(GC.LOOKUP_HEADER):].split()
+            lines.extend(page)
+            if number == pages:
+                return lines
+
+    def query(self, msg: str):
+        """Sends msg (a /nodelookup) to the node. An idle connection that
+        turns out to be closed is replaced by a new one, once.
+
+        Returns:
+            list: "username IP port" line of every user in the reply.
+
+        Raises:
+            OSError: If the node could not be reached.
+        """
+        with self.lock:
+            s = self.idle.pop() if self.idle else None
+        try:
+            if s is None:
+                s = self.connect()
+                lines = self.request(s, msg)
+            else:
+                try:
+                    lines = self.request(s, msg)
+                except OSError:
+                    s.close()
+                    s = self.connect()
+                    lines = self.request(s, msg)
+        except OSError:
+            if s is not None:
+                s.close()
+            raise
+
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(s)
+                s = None
+        if s is not None:
+            s.close()
+        return lines
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for s in idle:
+            s.close()
+
+
+class Federation:
+    def __init__(self, node: tuple, nodes: list, cache_size: int, cache_ttl: float):
+        """The name servers (nodes) a federated name server is one of. Every
+        username belongs to one node (see HashRing), which holds its
+        registration and serves its logins; the others forward /lookup to it
+        and cache the answer.
+
+        Args:
+            node (str, int): (host, port) of this node; one of nodes.
+            nodes (list): (host, port) of every node.
+            cache_size (int): maximum number of cached lookups.
+            cache_ttl (float): seconds a lookup answer is used.
+        """
+        self.node = node
+        self.ring = HashRing(nodes)
+        self.links = {peer: NodeLink(peer) for peer in nodes if peer != node}
+        # Only these may ask for the users of this node (/nodelookup)
+        self.peer_ips = set().union(*(resolve(host) for host, _ in self.links))
+        self.cache = PeerCache(cache_size, cache_ttl) # username -> lookup line, "" if offline
+
+    def owner(self, username: str):
+        return self.ring.owner(username)
+
+    def is_local(self, username: str):
+        return self.ring.owner(username) == self.node
+
+    def is_peer(self, ip: str):
+        """
+        Returns:
+            bool: Whether a connection from ip may come from another node.
+        """
+        return ip in self.peer_ips
+
+    def lookup(self, username: str):
+        """Looks up username, that belongs to another node.
+
+        Returns:
+            str: "username IP port" line of username. "" if not online or
+                 its node could not be reached.
+        """
+        line = self.cache.get(username)
+        if line is None:
+            try:
+                lines = self.links[self.owner(username)].query(f"{GC.NODE_LOOKUP_COMMAND} {username}")
+            except OSError as e:
+                log.warning("could not forward lookup of %s: %s", username, e)
+                return ""
+            line = lines[0] if lines else ""
+            self.cache.put(username, line)
+        return line
+
+    def lookup_all(self):
+        """
+        Returns:
+            list: "username IP port" line of every user online on the other
+                  nodes that could be reached.
+        """
+        lines = []
+        for peer, link in self.links.items():
+            try:
+                lines.extend(link.query(GC.NODE_LOOKUP_COMMAND))
+            except OSError as e:
+                log.warning("could not reach node %s:%d: %s", peer[0], peer[1], e)
+        return lines
+
+    def close(self):
+        for link in self.links.values():
+            link.close()
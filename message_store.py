@@ -0,0 +1,112 @@
+from collections import deque, OrderedDict
+from threading import Lock
+import common.global_constants as GC
+
+
+class SenderBuffer:
+    def __init__(self, capacity: int):
+        """Ring buffer of the unread message bodies from one sender.
+
+        Args:
+            capacity (int): maximum number of messages kept.
+        """
+        self.messages = deque(maxlen=capacity)
+        self.sizes = deque(maxlen=capacity) # encoded size of each message
+        self.nbytes = 0
+        self.dropped = 0 # messages evicted unread since last read
+
+
+class MessageStore:
+    def __init__(self, capacity: int, max_bytes: int, max_senders: int):
+        """Bounded store of messages received from peers. Every sender with
+        unread messages gets a ring buffer, so the oldest unread messages are
+        dropped when a sender exceeds its limits. Sender names come from the
+        peers themselves, so a new sender beyond max_senders evicts the buffer
+        of the sender that wrote least recently instead of being rejected.
+
+        Args:
+            capacity (int): maximum unread messages per sender.
+            max_bytes (int): maximum unread bytes per sender.
+            max_senders (int): maximum number of senders with unread
+                               messages, and of senders remembered by known().
+        """
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.max_senders = max_senders
+        self.buffers = OrderedDict() # sender -> SenderBuffer, least recently written first
+        self.seen = OrderedDict() # sender -> None, least recently written first
+        self.lock = Lock()
+
+        self.dropped = 0 # messages evicted by newer ones (or with their sender)
+        self.overflowed = 0 # messages rejected as too large
+
+    def add(self, sender: str, body: str):
+        """Stores body as an unread message from sender.
+
+        Returns:
+            bool: False if the message was rejected.
+        """
+        size = len(body.encode(GC.ENCODING))
+        with self.lock:
+            if size > self.max_bytes:
+                self.overflowed += 1
+                return False
+            buffer = self.buffers.get(sender)
+            if buffer is None:
+                if len(self.buffers) >= self.max_senders:
+                    _, oldest = self.buffers.popitem(last=False)
+                    self.dropped += len(oldest.messages)
+                buffer = self.buffers[sender] = SenderBuffer(self.capacity)
+            else:
+                self.buffers.move_to_end(sender)
+            self.seen[sender] = None
+            self.seen.move_to_end(sender)
+            if len(self.seen) > self.max_senders:
+                self.seen.popitem(last=False)
+
+            evicted = 0
+            if len(buffer.messages) == self.capacity:
+                # Appending evicts the oldest message
+                buffer.nbytes -= buffer.sizes[0]
+                evicted += 1
+            buffer.messages.append(body)
+            buffer.sizes.append(size)
+            buffer.nbytes += size
+            while buffer.nbytes > self.max_bytes:
+                buffer.messages.popleft()
+                buffer.nbytes -= buffer.sizes.popleft()
+                evicted += 1
+            buffer.dropped += evicted
+            self.dropped += evicted
+            return True
+
+    def known(self, sender: str):
+        """
+        Returns:
+            bool: Whether sender is one of the max_senders senders that sent a
+                  (stored) message most recently.
+        """
+        with self.lock:
+            return sender in self.seen
+
+    def take(self, sender: str):
+        """Hands out the unread messages from sender and marks them read.
+        The ring buffer itself is handed out (and dropped from the store), so
+        nothing is copied.
+
+        Returns:
+            (deque, int): (unread message bodies, number of unread messages dropped)
+        """
+        with self.lock:
+            buffer = self.buffers.pop(sender, None)
+        if buffer is None:
+            return deque(), 0
+        return buffer.messages, buffer.dropped
+
+    def unread_senders(self):
+        """
+        Returns:
+            list: senders that have unread (or dropped) messages.
+        """
+        with self.lock:
+            return list(self.buffers)
@@ -0,0 +1,188 @@
+from collections import deque
+from itertools import chain
+from threading import Lock
+import os
+
+from common.framing import LengthPrefixDecoder, encode_length_frame
+import common.global_constants as GC
+
+
+class OfflineQueue:
+    def __init__(self, path: str):
+        """Frames waiting for one offline user: the oldest in a segment file,
+        the newest in memory.
+
+        Args:
+            path (str): segment file of the user.
+        """
+        self.path = path
+        self.lock = Lock()
+        self.frames = deque()
+        self.nbytes = 0 # bytes of self.frames
+        self.spilled = os.path.getsize(path) if os.path.exists(path) else 0
+        self.closed = False # taken for delivery
+
+
+class OfflineStore:
+    def __init__(self, directory: str, memory_threshold: int, max_bytes: int, batch_size: int):
+        """Holds relayed frames for registered users that are offline, until
+        they log in. A user's frames are kept in memory until they exceed
+        memory_threshold bytes, and are then appended to the user's segment
+        file (as length prefixed frames).
+
+        Args:
+            directory (str): directory of the segment files; segments found
+                             there are delivered too, as are segments whose
+                             delivery was cut short (see take).
+            memory_threshold (int): bytes kept in memory per user.
+            max_bytes (int): bytes kept per user; further frames are rejected.
+            batch_size (int): frames per batch handed out by take().
+        """
+        self.directory = directory
+        self.memory_threshold = memory_threshold
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.queues = {} # username -> OfflineQueue
+        self.lock = Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".seg.deliver"):
+                # Interrupted delivery; its frames come before those stored since
+                path = os.path.join(directory, name)
+                self.prepend(path[:-len(".deliver")], self.read_segment(path))
+                os.remove(path)
+        for name in os.listdir(directory):
+            if name.endswith(".seg"):
+                username = bytes.fromhex(name[:-len(".seg")]).decode(GC.ENCODING)
+                self.queues[username] = OfflineQueue(os.path.join(directory, name))
+
+    def segment_path(self, username: str):
+        """
+        Returns:
+            str: segment file of username (hex encoded, as usernames may
+                 contain any non-whitespace character).
+        """
+        return os.path.join(self.directory, username.encode(GC.ENCODING).hex() + ".seg")
+
+    def store(self, username: str, frame: str):
+        """Holds frame for username.
+
+        Returns:
+            bool: False if username already has max_bytes waiting.
+        """
+        size = len(frame.encode(GC.ENCODING))
+        while True:
+            with self.lock:
+                queue = self.queues.get(username)
+                if queue is None:
+                    queue = self.queues[username] = OfflineQueue(self.segment_path(username))
+            with queue.lock:
+                if queue.closed:
+                    # Taken for delivery meanwhile; start a new queue
+                    continue
+                if queue.nbytes + queue.spilled + size > self.max_bytes:
+                    return False
+                queue.frames.append(frame)
+                queue.nbytes += size
+                if queue.nbytes > self.memory_threshold:
+                    self.spill(queue)
+                return True
+
+    def spill(self, queue: OfflineQueue):
+        """Moves the frames of queue from memory to its segment file.
+        Must be called with queue.lock held.
+        """
+        data = b"".join(encode_length_frame(frame) for frame in queue.frames)
+        with open(queue.path, "ab") as f:
+            f.write(data)
+        queue.spilled += len(data)
+        queue.frames.clear()
+        queue.nbytes = 0
+
+    def read_segment(self, path: str):
+        """Streams a segment file, so it is never read into memory at once.
+
+        Yields:
+            str: the frames of the file, oldest first.
+        """
+        decoder = LengthPrefixDecoder()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(GC.BUFFSIZE * 64), b""):
+                yield from decoder.feed(chunk)
+
+    def prepend(self, path: str, frames):
+        """Writes frames to the segment file at path, before the frames it holds.
+
+        Returns:
+            int: size of the segment file.
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as out:
+            for frame in frames:
+                out.write(encode_length_frame(frame))
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(GC.BUFFSIZE * 64), b""):
+                        out.write(chunk)
+            size = out.tell()
+        os.replace(tmp_path, path)
+        return size
+
+    def requeue(self, username: str, frames):
+        """Holds frames (taken, but not delivered) for username again, before
+        any frame stored since they were taken. They are written to the
+        segment file, which comes before the frames held in memory.
+        """
+        while True:
+            with self.lock:
+                queue = self.queues.get(username)
+                if queue is None:
+                    queue = self.queues[username] = OfflineQueue(self.segment_path(username))
+            with queue.lock:
+                if queue.closed:
+                    continue
+                queue.spilled = self.prepend(queue.path, frames)
+                return
+
+    def take(self, username: str):
+        """Hands out all frames held for username, oldest first, and forgets
+        them as they are delivered. A batch counts as delivered when the next
+        one is asked for; if the generator is closed instead (e.g. the user
+        disconnected), that batch and the rest are held again (see requeue).
+        The segment file is streamed, so it is never read into memory at once.
+
+        Yields:
+            list: batches of at most batch_size frames.
+        """
+        with self.lock:
+            queue = self.queues.pop(username, None)
+        if queue is None:
+            return
+        with queue.lock:
+            queue.closed = True
+            if queue.spilled:
+                # A new queue of username must not append to this segment
+                delivering_path = queue.path + ".deliver"
+                os.replace(queue.path, delivering_path)
+
+        frames = chain(self.read_segment(delivering_path) if queue.spilled else (), queue.frames)
+        batch = []
+        try:
+            for frame in frames:
+                batch.append(frame)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+                batch = []
+        except GeneratorExit:
+            # The last batch handed out was not delivered
+            self.requeue(username, chain(batch, frames))
+            if queue.spilled:
+                os.remove(delivering_path)
+            raise
+        # A segment whose delivery failed otherwise is held again on restart
+        if queue.spilled:
+            os.remove(delivering_path)
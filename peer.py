@@ -33,11 +33,41 @@ def show_wrapper(args: list, client: Client):
 def msg_wrapper(args: list, client: Client):
     client.msg(args[0], args[1])
 
+def join_wrapper(args: list, client: Client):
+    client.join(args[0])
+
+def leave_wrapper(args: list, client: Client):
+    client.leave(args[0])
+
+def say_wrapper(args: list, client: Client):
+    client.say(args[0], args[1])
+
+def subscribe_wrapper(args: list, client: Client):
+    # Arguments are included to match the wrapper pattern
+    client.subscribe()
+
 def error_wrapper(args: list, client: Client):
     # Arguments are included to match the wrapper pattern
     print(">> Invalid command")
 
 
+# command -> wrapper(args, client); /close is handled by peer_app
+SWITCHER = {
+    commands.CONNECT: connect_wrapper,
+    commands.LOGIN: login_wrapper,
+    commands.REGISTER: register_wrapper,
+    commands.LOGOUT: logout_wrapper,
+    commands.LOOKUP: lookup_wrapper,
+    commands.SHOW: show_wrapper,
+    commands.MSG: msg_wrapper,
+    commands.JOIN: join_wrapper,
+    commands.LEAVE: leave_wrapper,
+    commands.SAY: say_wrapper,
+    commands.SUBSCRIBE: subscribe_wrapper,
+    commands.ERROR: error_wrapper
+}
+
+
 def peer_app():
     """Handles the peer application side through the command-line.
     """
@@ -50,21 +80,11 @@ def peer_app():
             continue
         cmd, args = parse_command(user_input)
 
-        switcher = {
-            commands.CONNECT: connect_wrapper,
-            commands.LOGIN: login_wrapper,
-            commands.REGISTER: register_wrapper,
-            commands.LOGOUT: logout_wrapper,
-            commands.LOOKUP: lookup_wrapper,
-            commands.SHOW: show_wrapper,
-            commands.MSG: msg_wrapper,
-            commands.ERROR: error_wrapper
-        }
         try:
             if cmd == commands.CLOSE:
                 running = not client.close()
             else:
-                switcher[cmd](args, client)
+                SWITCHER[cmd](args, client)
         except ValueError as e:
             print(">> port was not a decimal value: ", e)
         except KeyError as e:
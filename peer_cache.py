@@ -0,0 +1,54 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class PeerCache:
+    def __init__(self, capacity: int, ttl: float):
+        """Least recently used cache of peer addresses (User_info by nickname),
+        so messages to a known peer need no /lookup on the name server.
+
+        Args:
+            capacity (int): maximum number of cached peers.
+            ttl (float): seconds an entry may be used after it was looked up.
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict() # nickname -> (expiry time, User_info)
+        self.lock = Lock()
+
+    def get(self, nickname: str):
+        """
+        Returns:
+            User_info: cached info of nickname. None if unknown or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(nickname)
+            if entry is None:
+                return None
+            expiry, info = entry
+            if expiry < time.monotonic():
+                del self.entries[nickname]
+                return None
+            self.entries.move_to_end(nickname)
+            return info
+
+    def put(self, nickname: str, info):
+        """Caches info for nickname, evicting the least recently used
+        entry if the cache is full.
+        """
+        with self.lock:
+            self.entries[nickname] = (time.monotonic() + self.ttl, info)
+            self.entries.move_to_end(nickname)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, nickname: str):
+        """Forgets nickname, e.g. after its address could not be reached.
+        """
+        with self.lock:
+            self.entries.pop(nickname, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,142 @@
+from socket import socket, socketpair, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from collections import OrderedDict
+from threading import Thread
+from typing import Callable, Tuple
+import logging
+import selectors
+import time
+
+from common.framing import FrameDecoder
+import common.global_constants as GC
+
+
+log = logging.getLogger(__name__)
+
+
+class PeerInbox:
+    def __init__(self, addr: Tuple[str, int], on_message: Callable[[str], None], backlog: int,
+                 max_connections: int, idle_timeout: float):
+        """Listens on addr for peer connections, and receives from all of them
+        on a single thread with a selector. Peers keep their connections open
+        (see PeerPool), so connections idle for idle_timeout seconds are
+        closed, and beyond max_connections the least recently active one is
+        closed to make room; its peer reconnects with its next message.
+
+        Args:
+            addr (str, int): (IP-address, port) to listen on.
+            on_message (Callable): called with every message received.
+            backlog (int): listen backlog.
+            max_connections (int): maximum peer connections open.
+            idle_timeout (float): seconds a peer connection may be silent.
+
+        Raises:
+            OSError: When it cannot open the listening socket.
+        """
+        self.on_message = on_message
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.connections = OrderedDict() # socket -> time of last frame, least recently active first
+        self.listen_socket = socket(AF_INET, SOCK_STREAM)
+        try:
+            self.listen_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            self.listen_socket.bind(addr)
+            self.listen_socket.listen(backlog)
+            self.listen_socket.setblocking(False)
+        except OSError:
+            self.listen_socket.close()
+            raise
+
+        # stop() writes to wakeup_send to interrupt select()
+        self.wakeup_recv, self.wakeup_send = socketpair()
+        self.wakeup_recv.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listen_socket, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Starts receiving on a background thread.
+        """
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops receiving and closes all peer connections and the listening socket.
+        """
+        self.running = False
+        self.wakeup_send.send(b"\0")
+        if self.thread:
+            self.thread.join()
+
+    def accept(self):
+        try:
+            conn, _ = self.listen_socket.accept()
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # E.g. out of file descriptors, or the peer gave up already
+            log.warning("could not accept peer connection: %s", e)
+            if self.connections:
+                self.drop(next(iter(self.connections)))
+            return
+        if len(self.connections) >= self.max_connections:
+            self.drop(next(iter(self.connections)))
+        conn.setblocking(False)
+        # Every peer connection has its own frame buffer
+        self.selector.register(conn, selectors.EVENT_READ, FrameDecoder())
+        self.connections[conn] = time.monotonic()
+
+    def drop(self, conn: socket):
+        self.selector.unregister(conn)
+        del self.connections[conn]
+        conn.close()
+
+    def expire(self):
+        """Closes the connections idle for idle_timeout seconds.
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        while self.connections:
+            conn, last_active = next(iter(self.connections.items()))
+            if last_active > deadline:
+                break
+            self.drop(conn)
+
+    def receive(self, conn: socket, decoder: FrameDecoder):
+        """Receives what is available on conn, and hands out completed messages.
+        """
+        try:
+            data = conn.recv(GC.BUFFSIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            # Peer closed the connection
+            self.drop(conn)
+            return
+        self.connections[conn] = time.monotonic()
+        self.connections.move_to_end(conn)
+        for msg in decoder.feed(data):
+            if msg:
+                self.on_message(msg)
+
+    def run(self):
+        """Multiplexes the listening socket and all peer connections until stop().
+        """
+        while self.running:
+            for key, _ in self.selector.select(self.idle_timeout / 2):
+                if key.fileobj is self.listen_socket:
+                    self.accept()
+                elif key.fileobj is self.wakeup_recv:
+                    self.wakeup_recv.recv(GC.BUFFSIZE)
+                else:
+                    self.receive(key.fileobj, key.data)
+            self.expire()
+
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+        self.wakeup_send.close()
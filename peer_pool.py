@@ -0,0 +1,113 @@
+from socket import socket, AF_INET, SOCK_STREAM, MSG_PEEK
+from collections import OrderedDict
+from select import select
+from threading import Lock
+from typing import Tuple
+import time
+
+
+class PeerPool:
+    def __init__(self, capacity: int, idle_timeout: float):
+        """Bounded pool of open connections to peers, keyed by peer address,
+        so consecutive messages to a peer reuse one TCP connection.
+
+        Args:
+            capacity (int): maximum number of connections kept open.
+            idle_timeout (float): seconds an unused connection is kept open.
+        """
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.connections = OrderedDict() # addr -> (socket, time of last use)
+        self.lock = Lock()
+
+    def healthy(self, s: socket):
+        """A pooled connection is only written to, so if it has become
+        readable the peer has closed it (or is misbehaving).
+
+        Returns:
+            bool: Whether s can be reused.
+        """
+        try:
+            readable, _, _ = select([s], [], [], 0)
+            return not readable or bool(s.recv(1, MSG_PEEK))
+        except (OSError, ValueError):
+            return False
+
+    def evict_idle(self):
+        """Closes connections that have not been used for idle_timeout seconds.
+        Must be called with self.lock held.
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        while self.connections:
+            addr, (s, last_used) = next(iter(self.connections.items()))
+            if last_used > deadline:
+                break
+            del self.connections[addr]
+            s.close()
+
+    def take(self, addr: Tuple[str, int]):
+        """Removes the pooled connection to addr from the pool, so only
+        the caller uses it.
+
+        Returns:
+            socket: healthy connection to addr. None if there is none.
+        """
+        with self.lock:
+            self.evict_idle()
+            entry = self.connections.pop(addr, None)
+        if entry is None:
+            return None
+        if not self.healthy(entry[0]):
+            entry[0].close()
+            return None
+        return entry[0]
+
+    def give_back(self, addr: Tuple[str, int], s: socket):
+        """Returns s to the pool as the most recently used connection,
+        closing the least recently used one if the pool is full.
+        """
+        with self.lock:
+            old = self.connections.pop(addr, None)
+            if old:
+                old[0].close()
+            self.connections[addr] = (s, time.monotonic())
+            while len(self.connections) > self.capacity:
+                _, (lru, _) = self.connections.popitem(last=False)
+                lru.close()
+
+    def send(self, addr: Tuple[str, int], data: bytes):
+        """Sends data to the peer at addr on a pooled connection if there is
+        one, else (or if sending on it fails) on a new connection.
+
+        Args:
+            addr (str, int): (IP-address, port) of the peer.
+            data (bytes): encoded frame(s) to send.
+
+        Raises:
+            OSError: If the peer cannot be reached on a new connection.
+        """
+        s = self.take(addr)
+        if s is not None:
+            try:
+                s.sendall(data)
+                self.give_back(addr, s)
+                return
+            except OSError:
+                s.close()
+
+        s = socket(AF_INET, SOCK_STREAM)
+        try:
+            s.connect(addr)
+            s.sendall(data)
+        except OSError:
+            s.close()
+            raise
+        self.give_back(addr, s)
+
+    def close(self):
+        """Closes all pooled connections.
+        """
+        with self.lock:
+            for s, _ in self.connections.values():
+                s.close()
+            self.connections.clear()
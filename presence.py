@@ -0,0 +1,66 @@
+from threading import Lock
+
+from person import Person
+
+
+class PresenceHub:
+    def __init__(self):
+        """Presence changes (logins and logouts) not yet sent to subscribers.
+
+        Changes are coalesced: only the last state of every username since
+        the previous take() is kept, so a user that logs in and out many times
+        between two flushes costs a single delta.
+        """
+        self.lock = Lock()
+        self.pending = {} # username -> online (bool)
+        self.subscribers = set() # Person
+        self.joining = [] # Person subscribed since the last take()
+
+    def changed(self, username: str, online: bool):
+        """Records that username logged in (online) or out.
+        """
+        with self.lock:
+            if self.subscribers or self.joining:
+                self.pending[username] = online
+
+    def subscribe(self, person: Person):
+        """
+        Returns:
+            bool: False if person already is a subscriber.
+        """
+        with self.lock:
+            if person in self.subscribers or person in self.joining:
+                return False
+            self.joining.append(person)
+            return True
+
+    def unsubscribe(self, person: Person):
+        with self.lock:
+            self.subscribers.discard(person)
+            if person in self.joining:
+                self.joining.remove(person)
+
+    def resync(self):
+        """Makes every subscriber get the full roster again with the next take(),
+        e.g. after changes were lost.
+        """
+        with self.lock:
+            self.joining.extend(self.subscribers)
+            self.subscribers.clear()
+            self.pending.clear()
+
+    def take(self):
+        """Hands out and forgets the pending changes. Subscribers that joined
+        since the last take() are not sent these changes; they need a full
+        roster, taken after this call, instead.
+
+        Returns:
+            (dict, tuple, list): (username -> online, subscribers to send the
+                                  changes to, new subscribers)
+        """
+        with self.lock:
+            changes, self.pending = self.pending, {}
+            subscribers = tuple(self.subscribers) if changes else ()
+            joining, self.joining = self.joining, []
+            self.subscribers.update(joining)
+            return changes, subscribers, joining
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float = None):
+        """Allows rate events per second on average, and up to burst at once.
+        Tokens are refilled when taken rather than by a timer, so a bucket
+        costs nothing while unused. Not thread safe.
+
+        Args:
+            rate (float): tokens added per second.
+            burst (float): most tokens held (the bucket starts full).
+            now (float): time.monotonic(), unless given.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic() if now is None else now
+
+    def take(self, now: float = None):
+        """
+        Returns:
+            bool: Whether a token was taken (the event is allowed).
+        """
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class KeyedBuckets:
+    def __init__(self, rate: float, burst: float, capacity: int):
+        """A TokenBucket per key (e.g. username), shared by all threads. The
+        least recently used buckets are dropped beyond capacity keys.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self.buckets = OrderedDict() # key -> TokenBucket
+        self.lock = Lock()
+
+    def take(self, key, now: float = None):
+        """
+        Returns:
+            bool: Whether a token of key's bucket was taken.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+                if len(self.buckets) > self.capacity:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            return bucket.take(now)
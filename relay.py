@@ -0,0 +1,58 @@
+from collections import deque
+from threading import Lock
+from typing import Callable
+
+
+class RelayQueue:
+    def __init__(self, capacity: int, deliver: Callable[[list], None]):
+        """Bounded queue of frames relayed to one logged in user over its
+        connection to the name server. Frames are queued encoded for the
+        connection, so a frame broadcast to many users is encoded only once.
+
+        The sender that finds the queue idle delivers, on its own thread,
+        everything queued until the queue is empty again, a batch at a time.
+        Senders arriving meanwhile only queue their frame, so a slow recipient
+        holds up at most one sender.
+
+        Args:
+            capacity (int): maximum frames waiting for delivery.
+            deliver (Callable): sends a list of encoded frames (bytes) to the recipient.
+        """
+        self.capacity = capacity
+        self.deliver = deliver
+        self.frames = deque()
+        self.lock = Lock()
+        self.delivering = False
+
+        self.relayed = 0
+        self.rejected = 0
+
+    def push(self, frame: bytes):
+        """Queues frame for delivery (and delivers if no one else is).
+
+        Returns:
+            bool: False if the queue is full and frame was dropped.
+        """
+        with self.lock:
+            if len(self.frames) >= self.capacity:
+                self.rejected += 1
+                return False
+            self.frames.append(frame)
+            self.relayed += 1
+            if self.delivering:
+                return True
+            self.delivering = True
+
+        while True:
+            with self.lock:
+                if not self.frames:
+                    self.delivering = False
+                    return True
+                batch = list(self.frames)
+                self.frames.clear()
+            try:
+                self.deliver(batch)
+            except Exception:
+                with self.lock:
+                    self.delivering = False
+                raise
@@ -1,27 +1,106 @@
-from socket import socket, AF_INET, SOCK_STREAM
-from threading import Thread, Lock
+from socket import socket, AF_INET, SOCK_STREAM, SOMAXCONN, SOL_SOCKET, SO_REUSEPORT, SHUT_RDWR
+from multiprocessing import Process
+from multiprocessing.connection import wait
+from threading import Thread
+from contextlib import closing
+from errno import EBADF, EINVAL, EMFILE, ENFILE
+import argparse
+import asyncio
+import logging
+import os
+import signal
 import sys
+import time
 
 from common.command import parse_command, commands
 from common.messenger import Messenger
 from person import Person
+from user_registry import UserRegistry
+from user_log import UserLog
+from shared_registry import SharedUserRegistry, start_coordinator
+from credentials import CredentialService, completed
+from relay import RelayQueue
+from offline_store import OfflineStore
+from channels import ChannelIndex
+from presence import PresenceHub
+from federation import Federation, parse_node
+from timer_wheel import TimerWheel
+from rate_limit import TokenBucket, KeyedBuckets
+from write_queue import WriteQueue
+from common.metrics import Metrics, TimedLock, serve_metrics
+from common.log import setup_logging, set_connection
 import common.global_constants as GC
 
 
 # Global constants
 PORT = 7700
 IP_ADDR = "localhost"
-MAX_USERS = 2
+LISTEN_BACKLOG = SOMAXCONN # connections waiting to be accepted, per process
+USER_SHARDS = 16
+REGISTRY_PATH = "registered_users.log"
+HASH_WORKERS = os.cpu_count() or 1
+CREDENTIAL_CACHE_SIZE = 100000
+RELAY_QUEUE_SIZE = 256 # relayed frames waiting per recipient
+OFFLINE_DIR = "offline_messages"
+OFFLINE_MEMORY = 1 << 16 # bytes held in memory per offline user
+OFFLINE_MAX_BYTES = 1 << 24 # bytes held per offline user
+OFFLINE_BATCH = 256 # frames per batch when delivering on login
+PRESENCE_WINDOW = 0.2 # seconds presence changes are coalesced over
+METRICS_ADDR = "localhost"
+FEDERATION_CACHE_SIZE = 100000 # lookups of users of other name servers cached
+FEDERATION_CACHE_TTL = 2 # seconds
+IDLE_TIMEOUT = 90 # seconds without a frame (clients /ping every 30) before a connection is closed
+REAPER_TICK = 1.0 # seconds; resolution of IDLE_TIMEOUT
+# command -> (frames per second, burst) per connection; other commands get FRAME_LIMIT
+COMMAND_LIMITS = {
+    commands.LOGIN: (1, 5),
+    commands.REGISTER: (1, 5),
+    commands.LOOKUP: (5, 20),
+    commands.NODE_LOOKUP: (1000, 2000), # from other name servers, over few connections
+}
+FRAME_LIMIT = (100, 200)
+LOGIN_LIMIT = (0.2, 10) # /login and /register attempts per username, over all connections
+LOGIN_LIMIT_USERS = 100000 # usernames whose attempts are kept track of
+ACCEPT_LIMIT = (500, 1000) # connections accepted per second
+ACCEPT_BACKOFF = 0.1 # seconds accepting pauses when out of file descriptors or threads
+WRITE_HIGH = 1 << 20 # bytes queued for a connection before it counts as slow
+WRITE_LOW = 1 << 18 # bytes queued below which its handler may reply again
+SLOW_CLIENT_POLICY = "disconnect" # or "drop": what happens to relayed frames for slow clients
+
+log = logging.getLogger(__name__)
 
 
 class Server(Messenger):
-    def __init__(self, addr: str, port: int, max_users: int):
+    def __init__(self, addr: str, port: int, max_users: int, registry_path: str = "", relay: bool = False,
+                 offline_dir: str = "", users=None, reuse_port: bool = False, federation: Federation = None,
+                 idle_timeout: float = IDLE_TIMEOUT, rate_limits: bool = True,
+                 slow_clients: str = SLOW_CLIENT_POLICY, compression: bool = True):
         """Sets up TCP socket and start listening on addr and port.
 
         Args:
             addr (str): IPv4-address.
             port (int): port number.
-            max_users (int): maximum ongoing connections.
+            max_users (int): listen backlog; connections waiting to be accepted.
+            registry_path (str): file registered users are kept in. If "",
+                                 they are only kept in memory.
+            relay (bool): Whether clients may /msg each other through the server.
+            offline_dir (str): directory to hold relayed messages for offline
+                               users in. If "", messages to offline users are refused.
+            users (SharedUserRegistry): registry shared with other server
+                                        processes; registry_path is not used then.
+            reuse_port (bool): Whether other processes may listen on port too
+                               (SO_REUSEPORT); the kernel spreads connections over them.
+            federation (Federation): the name servers this one shares the
+                                     usernames with. None if it serves all of them.
+            idle_timeout (float): seconds a connection may send nothing before
+                                  it is closed. 0 keeps idle connections open.
+            rate_limits (bool): Whether to enforce COMMAND_LIMITS, FRAME_LIMIT,
+                                LOGIN_LIMIT and ACCEPT_LIMIT.
+            slow_clients (str): "disconnect" clients with more than WRITE_HIGH
+                                bytes waiting to be sent when a frame is relayed
+                                to them, or "drop" the frame.
+            compression (bool): Whether clients may ask for GC.FRAMING_ZLIB
+                                (large frames compressed).
         
         Raises:
             SystemExit: If connection could not be initiated
@@ -29,18 +108,545 @@ class Server(Messenger):
         Messenger.__init__(self)
         try:
             self.listen_socket = socket(AF_INET, SOCK_STREAM)
+            if reuse_port:
+                self.listen_socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
             self.listen_socket.bind((addr, port))
             self.listen_socket.listen(max_users)
 
-            self.active_users = {}
-            self.active_users_lock = Lock()
+            self.init_metrics()
+            if users is None:
+                users = UserRegistry(USER_SHARDS, UserLog(registry_path) if registry_path else None,
+                                     lambda: TimedLock(self.lock_waits, self.lock_acquires))
+            self.users = users
+            self.credentials = CredentialService(HASH_WORKERS, CREDENTIAL_CACHE_SIZE)
+            self.channels = ChannelIndex()
+            self.presence = PresenceHub()
+            self.users.on_change = self.presence.changed
+            self.relay = relay
+            self.federation = federation
+            self.idle_timeout = idle_timeout
+            self.sessions = TimerWheel(REAPER_TICK) # Person of every open connection
+            self.rate_limits = rate_limits
+            self.slow_clients = slow_clients
+            self.compression = compression
+            self.login_buckets = KeyedBuckets(*LOGIN_LIMIT, LOGIN_LIMIT_USERS)
+            self.accept_bucket = TokenBucket(*ACCEPT_LIMIT)
+            self.offline = None
+            if relay and offline_dir:
+                self.offline = OfflineStore(offline_dir, OFFLINE_MEMORY, OFFLINE_MAX_BYTES, OFFLINE_BATCH)
 
-            self.registered_users = {}
-            self.registered_users_lock = Lock()
+            # command -> handler(person, args) of logged in clients
+            self.session_handlers = {
+                commands.LOOKUP: self.lookup_command,
+                commands.LOGOUT: self.logout_command,
+                commands.JOIN: self.join_command,
+                commands.LEAVE: self.leave_command,
+                commands.SAY: self.say_command,
+                commands.SUBSCRIBE: self.subscribe_command,
+                commands.CLOSE: self.close_command,
+                commands.PING: self.ping_command,
+            }
+            if relay:
+                self.session_handlers[commands.MSG] = self.msg_command
         except Exception as e:
             sys.exit(f"[Exception] Could not initiate server: {e}")
 
 
+    def init_metrics(self):
+        """Creates self.metrics, and the metrics updated on the hot paths.
+        """
+        self.metrics = Metrics()
+        m = self.metrics
+        self.connections_total = m.counter("chat_connections_total", "Connections accepted")
+        self.connections_open = m.gauge("chat_connections_open", "Connections currently open")
+        self.frames_in = m.counter("chat_frames_received_total", "Frames received from clients")
+        self.bytes_in = m.counter("chat_bytes_received_total", "Bytes received from clients")
+        self.frames_out = m.counter("chat_frames_sent_total", "Frames sent to clients")
+        self.bytes_out = m.counter("chat_bytes_sent_total", "Bytes sent to clients")
+        self.logins = {(cmd, outcome): m.counter("chat_logins_total", "Logins and registers by outcome",
+                                                 command=cmd.name.lower(), outcome=outcome)
+                       for cmd in (commands.LOGIN, commands.REGISTER) for outcome in ("success", "failure")}
+        self.command_seconds = {cmd: m.histogram("chat_command_seconds",
+                                                 "Time from receiving a command to having sent its replies",
+                                                 command=cmd.name.lower())
+                                for cmd in commands}
+        self.lock_waits = m.histogram("chat_lock_wait_seconds", "Time waited for contended locks",
+                                      lock="user_shard")
+        self.lock_acquires = m.counter("chat_lock_acquires_total", "Lock acquires", lock="user_shard")
+        self.sessions_reaped = m.counter("chat_sessions_reaped_total", "Connections closed for being idle")
+        self.slow_client_events = {action: m.counter("chat_slow_clients_total",
+                                                     "Relayed frames finding the client's queue past WRITE_HIGH",
+                                                     action=action)
+                                   for action in ("drop", "disconnect")}
+        self.rate_limited = {scope: m.counter("chat_rate_limited_total", "Frames and connections refused by rate limits",
+                                              scope=scope)
+                             for scope in ("connection", "username", "accept")}
+
+
+    def command_done(self, cmd: commands, start: float):
+        """Records the latency of cmd, received at time.perf_counter() start.
+        """
+        self.command_seconds[cmd].observe(time.perf_counter() - start)
+
+
+    def authenticate(self, cmd: commands, args: list):
+        """Starts the password work of a /login (verifying) or /register
+        (hashing) in self.credentials, without holding any registry lock.
+
+        Args:
+            cmd (commands): Parsed command.
+            args (list): Arguments to cmd.
+
+        Returns:
+            Future: resolves to the credential to pass to login_command
+                    (None if the password is wrong or the username is taken).
+            None: If cmd needs no credential.
+        """
+        if cmd in (commands.LOGIN, commands.REGISTER) and not self.is_local(args[0]):
+            # Redirected by login_command
+            return None
+        if cmd == commands.LOGIN:
+            return self.credentials.verify(args[0], args[1], self.users.credential(args[0]))
+        elif cmd == commands.REGISTER:
+            if self.users.is_registered(args[0]):
+                # Don't hash for a username that is taken anyway
+                return completed(None)
+            return self.credentials.hash(args[1])
+        return None
+
+
+    def is_local(self, username: str):
+        """
+        Returns:
+            bool: Whether username is served by this name server (and not by
+                  another one of the federation).
+        """
+        return self.federation is None or self.federation.is_local(username)
+
+
+    def from_node(self, person: Person):
+        """
+        Returns:
+            bool: Whether person's connection comes from another name server
+                  of the federation, which may /nodelookup this one.
+        """
+        return self.federation is not None and self.federation.is_peer(person.addr[0])
+
+
+    def prepare_login(self, person: Person, args: list):
+        """Sets up person to be logged in with the arguments of a /login or /register.
+        """
+        person.set_login(args[0], (args[2], args[3]))
+        person.relay = RelayQueue(RELAY_QUEUE_SIZE, lambda frames: self.deliver(person, frames))
+
+
+    def login_command(self, person: Person, cmd: commands, args: list, credential: str = None):
+        """Executes a command received from a client that is not logged in.
+        Does no I/O, so it is shared by the threaded and the asyncio server.
+
+        Args:
+            person (Person): The client issuing the command.
+            cmd (commands): Parsed command.
+            args (list): Arguments to cmd.
+            credential (str): result of authenticate(cmd, args).
+
+        Returns:
+            (str, bool): (reply to send, whether person is now logged in)
+        """
+        if cmd in (commands.LOGIN, commands.REGISTER) and not self.is_local(args[0]):
+            return GC.REDIRECT(*self.federation.owner(args[0])), False
+
+        if cmd == commands.LOGIN:
+            self.prepare_login(person, args)
+            if credential and self.users.login(args[0], credential, person):
+                self.logins[(cmd, "success")].inc()
+                return GC.LOGIN_SUCCESS, True
+            self.logins[(cmd, "failure")].inc()
+            return GC.LOGIN_FAILURE, False
+
+        elif cmd == commands.REGISTER:
+            self.prepare_login(person, args)
+            if credential and self.users.register(args[0], credential, person):
+                self.logins[(cmd, "success")].inc()
+                return GC.REGISTER_SUCCESS, True
+            # User already in register
+            self.logins[(cmd, "failure")].inc()
+            return GC.REGISTER_FAILURE, False
+
+        # Invalid command
+        return GC.LOGIN_INV_COMMAND, False
+
+
+    def session_command(self, person: Person, cmd: commands, args: list):
+        """Executes a command received from a logged in client, with its
+        handler in self.session_handlers. Replies are returned rather than
+        sent, so it is shared by the threaded and the asyncio server (only
+        relayed messages are sent right away, see deliver).
+
+        Args:
+            person (Person): The client issuing the command.
+            cmd (commands): Parsed command.
+            args (list): Arguments to cmd.
+
+        Returns:
+            (list, bool, bool): (replies to send, whether person is still logged in,
+                                 whether the connection should be kept open)
+        """
+        return self.session_handlers.get(cmd, self.invalid_command)(person, args)
+
+
+    def lookup_command(self, person: Person, args: list):
+        return self.lookup_replies(args[0] if args else ""), True, True
+
+
+    def logout_command(self, person: Person, args: list):
+        self.channels.leave_all(person)
+        self.presence.unsubscribe(person)
+        if self.users.logout(person.username):
+            return [GC.LOGOUT_SUCCESS], False, True
+        log.error("could not remove user from the active users")
+        return [GC.LOGOUT_FAILURE], True, True
+
+
+    def msg_command(self, person: Person, args: list):
+        if not self.is_local(args[0]):
+            return [GC.RELAY_REMOTE(args[0])], True, True
+        recipient = self.users.get_active(args[0])
+        frame = GC.DELIVER(person.username, args[1])
+        if recipient is None:
+            return [self.store_offline(args[0], frame)], True, True
+        if recipient.connection is None:
+            return [GC.RELAY_REMOTE(args[0])], True, True
+        if recipient.relay.push(self.encode_for(recipient, frame)):
+            return [GC.RELAY_QUEUED], True, True
+        return [GC.RELAY_FULL(args[0])], True, True
+
+
+    def join_command(self, person: Person, args: list):
+        if self.channels.join(args[0], person):
+            return [GC.JOIN_SUCCESS(args[0])], True, True
+        return [GC.JOIN_FAILURE(args[0])], True, True
+
+
+    def leave_command(self, person: Person, args: list):
+        if self.channels.leave(args[0], person):
+            return [GC.LEAVE_SUCCESS(args[0])], True, True
+        return [GC.CHANNEL_NOT_MEMBER(args[0])], True, True
+
+
+    def say_command(self, person: Person, args: list):
+        members = self.channels.members(args[0])
+        if person not in members:
+            return [GC.CHANNEL_NOT_MEMBER(args[0])], True, True
+        self.broadcast(person, members, GC.CHANNEL_DELIVER(args[0], person.username, args[1]))
+        return [GC.RELAY_QUEUED], True, True
+
+
+    def subscribe_command(self, person: Person, args: list):
+        # The roster follows with the next flush_presence
+        self.presence.subscribe(person)
+        return [GC.PRESENCE_SUBSCRIBED], True, True
+
+
+    def close_command(self, person: Person, args: list):
+        self.drop_user(person)
+        return [], False, False
+
+
+    def ping_command(self, person: Person, args: list):
+        return [GC.PONG], True, True
+
+
+    def invalid_command(self, person: Person, args: list):
+        return [GC.LOGGEDIN_INV_COMMAND], True, True
+
+
+    def lookup_replies(self, nickname: str, forward: bool = True):
+        """Builds the reply to a /lookup. Every reply frame is a
+        GC.LOOKUP_PAGE header line followed by one "username IP port" line per
+        online user, at most GC.LOOKUP_PAGE_SIZE users per frame. Only the
+        snapshot of users is taken under the registry locks.
+
+        Args:
+            nickname (str): User to lookup, or "" for all online users.
+            forward (bool): Whether to ask the other name servers of the
+                            federation for the users they serve.
+
+        Returns:
+            list: reply frames (always at least one).
+        """
+        if forward and nickname and not self.is_local(nickname):
+            line = self.federation.lookup(nickname)
+            lines = [line] if line else []
+        else:
+            if nickname:
+                user = self.users.get_active(nickname)
+                users = [user] if user else []
+            else:
+                users = self.users.active()
+            lines = [f"{user.username} {user.listen_addr[0]} {user.listen_addr[1]}" for user in users]
+            if forward and self.federation and not nickname:
+                lines.extend(self.federation.lookup_all())
+
+        total = len(lines)
+        pages = max(1, -(-total // GC.LOOKUP_PAGE_SIZE))
+        replies = []
+        for page in range(pages):
+            page_lines = lines[page * GC.LOOKUP_PAGE_SIZE:(page + 1) * GC.LOOKUP_PAGE_SIZE]
+            replies.append("\n".join([GC.LOOKUP_PAGE(page + 1, pages, total)] + page_lines))
+        return replies
+
+
+    def encode_for(self, person: Person, frame: str):
+        """
+        Returns:
+            bytes: frame encoded with the framing of person's connection.
+        """
+        return self.stream(person.connection).encode(frame)
+
+
+    def broadcast(self, sender: Person, members: tuple, frame: str):
+        """Relays frame to every one of members but sender. frame is
+        encoded once per framing in use (not once per member), and the same
+        bytes are queued for every member using that framing.
+
+        Args:
+            sender (Person): None for frames from the server itself.
+            members (tuple): Person of every recipient (e.g. of a channel).
+        """
+        encoded = {} # framing -> bytes
+        for member in members:
+            if member is sender:
+                continue
+            stream = self.stream(member.connection)
+            data = encoded.get(stream.framing)
+            if data is None:
+                data = encoded[stream.framing] = stream.encode(frame)
+            # A member whose queue is full misses frame
+            member.relay.push(data)
+
+
+    def deliver(self, person: Person, frames: list, block: bool = False):
+        """Queues relayed frames (encoded, see encode_for) on person's
+        connection. If person is too far behind, see slow_client.
+
+        Args:
+            block (bool): Whether to wait for person to catch up instead.
+
+        Returns:
+            bool: Whether the frames were queued.
+        """
+        if person.out.push(frames, block):
+            self.count_sent(len(frames), sum(map(len, frames)))
+            return True
+        if not (block or person.out.closed):
+            # Refused for being past WRITE_HIGH, not for being disconnected
+            self.slow_client(person)
+        return False
+
+
+    def slow_client(self, person: Person):
+        """Handles a relayed frame for a client that does not read fast
+        enough, as self.slow_clients says: the frame is dropped, or the
+        client disconnected as well.
+        """
+        self.slow_client_events[self.slow_clients].inc()
+        if self.slow_clients == "disconnect":
+            log.warning("disconnecting %s: more than %d bytes not read", person.username, WRITE_HIGH)
+            self.disconnect(person)
+
+
+    def reply(self, person: Person, msgs: list):
+        """Queues msgs (replies) on person's connection, encoded for it. Waits
+        while person has more than WRITE_HIGH bytes waiting (used threaded).
+        """
+        stream = self.stream(person.connection)
+        self.deliver(person, [stream.encode(msg) for msg in msgs], True)
+
+
+    def store_offline(self, username: str, frame: str):
+        """Holds a relayed frame for username, if it is a registered user.
+
+        Returns:
+            str: reply to the sender.
+        """
+        if not (self.offline and self.users.is_registered(username)):
+            return GC.LOOKUP_FAILED(username)
+        if not self.offline.store(username, frame):
+            return GC.RELAY_FULL(username)
+
+        recipient = self.users.get_active(username)
+        if recipient:
+            # Logged in after we looked
+            self.deliver_backlog_soon(recipient)
+        return GC.RELAY_STORED(username)
+
+
+    def deliver_backlog(self, person: Person):
+        """Delivers the frames held for person while it was offline. If
+        person's connection is lost meanwhile, the rest is held again.
+        """
+        if self.offline:
+            with closing(self.offline.take(person.username)) as batches:
+                for batch in batches:
+                    if not self.deliver(person, [self.encode_for(person, frame) for frame in batch], True):
+                        break
+
+
+    def deliver_backlog_soon(self, person: Person):
+        """Starts deliver_backlog for person on a thread of its own, so it
+        waits for person to read instead of the caller (used threaded).
+        """
+        Thread(target=self.deliver_backlog, args=(person,), daemon=True).start()
+
+
+    def drop_user(self, person: Person):
+        """Removes person from the active users (and its channels and
+        subscriptions) after the connection was lost.
+        """
+        self.channels.leave_all(person)
+        self.presence.unsubscribe(person)
+        self.users.logout(person.username)
+
+
+    def drop_if_logged_in(self, person: Person):
+        """Calls drop_user if person is the active user of its username
+        (and not just someone who tried to log in with it).
+        """
+        username = getattr(person, "username", None)
+        if username is not None and self.users.get_active(username) is person:
+            self.drop_user(person)
+
+
+    def presence_frames(self, changes: list):
+        """
+        Args:
+            changes (list): "+username" / "-username" entries.
+
+        Returns:
+            list: GC.PRESENCE frames of at most GC.LOOKUP_PAGE_SIZE entries each.
+        """
+        return [GC.PRESENCE(changes[i:i + GC.LOOKUP_PAGE_SIZE])
+                for i in range(0, len(changes), GC.LOOKUP_PAGE_SIZE)]
+
+
+    def flush_presence(self):
+        """Sends the presence changes coalesced since the last flush to the
+        subscribers, and the full roster (as changes) to new subscribers.
+        """
+        if not self.users.sync():
+            self.presence.resync()
+        changes, subscribers, joining = self.presence.take()
+        if changes:
+            entries = [("+" if online else "-") + username for username, online in changes.items()]
+            for frame in self.presence_frames(entries):
+                self.broadcast(None, subscribers, frame)
+        if joining:
+            # Taken after take(), so later changes reach them in the next flush
+            entries = ["+" + user.username for user in self.users.active()]
+            for frame in self.presence_frames(entries):
+                self.broadcast(None, joining, frame)
+
+
+    def presence_loop(self):
+        """Flushes presence changes every PRESENCE_WINDOW seconds (used threaded).
+        """
+        while True:
+            time.sleep(PRESENCE_WINDOW)
+            self.flush_presence()
+
+
+    def negotiate(self, args: list):
+        """Chooses the framing to answer a /hello with: compressed framing is
+        downgraded to plain length prefixed framing without compression.
+        """
+        framing = Messenger.negotiate(self, args)
+        if framing == GC.FRAMING_ZLIB and not self.compression:
+            return GC.FRAMING_LENGTH
+        return framing
+
+
+    def admit(self, person: Person, cmd: commands, args: list):
+        """Takes a token for cmd from the bucket of person's connection and,
+        for /login and /register, of the username. Checked on every frame, so
+        buckets are refilled when used rather than by a timer, and those of a
+        connection need no lock (it is served by one thread or task).
+
+        Returns:
+            bool: Whether cmd may be executed.
+        """
+        if not self.rate_limits:
+            return True
+        now = time.monotonic()
+        bucket = person.limits.get(cmd)
+        if bucket is None:
+            bucket = person.limits[cmd] = TokenBucket(*COMMAND_LIMITS.get(cmd, FRAME_LIMIT), now)
+        if not bucket.take(now):
+            self.rate_limited["connection"].inc()
+            return False
+        if cmd in (commands.LOGIN, commands.REGISTER) and not self.login_buckets.take(args[0], now):
+            self.rate_limited["username"].inc()
+            return False
+        return True
+
+
+    def admit_connection(self):
+        """
+        Returns:
+            bool: Whether a connection just accepted may be served (ACCEPT_LIMIT).
+        """
+        if not self.rate_limits or self.accept_bucket.take():
+            return True
+        self.rate_limited["accept"].inc()
+        return False
+
+
+    def track(self, person: Person):
+        """Starts watching the connection of person for being idle. Every
+        frame received sets person.last_seen; only the timer wheel is looked
+        at per tick, not every connection.
+        """
+        person.last_seen = time.monotonic()
+        person.limits = {} # command -> TokenBucket, see admit
+        if self.idle_timeout:
+            self.sessions.schedule(person, self.idle_timeout)
+
+
+    def reap_idle(self):
+        """Closes the connections that sent nothing for self.idle_timeout
+        seconds. A connection that did is given a new timer for the time it
+        has left; the handler of a closed one drops its user, as for any lost
+        connection.
+        """
+        now = time.monotonic()
+        for person in self.sessions.advance(now):
+            idle = now - person.last_seen
+            if idle < self.idle_timeout:
+                self.sessions.schedule(person, self.idle_timeout - idle)
+                continue
+            log.info("closing idle connection of %s after %.0f s",
+                     getattr(person, "username", "a client not logged in"), idle)
+            self.sessions_reaped.inc()
+            self.disconnect(person)
+
+
+    def disconnect(self, person: Person):
+        """Makes the handler of person's connection receive end of file.
+        """
+        try:
+            person.connection.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+
+
+    def reaper_loop(self):
+        """Reaps idle connections every REAPER_TICK seconds (used threaded).
+        """
+        while True:
+            time.sleep(REAPER_TICK)
+            self.reap_idle()
+
+
     def login(self, person: Person):
         """Handles login and register for a client. Should work threaded
 
@@ -55,142 +661,504 @@ class Server(Messenger):
             if not msg:
                 # Server lost connection to client
                 return False
+            start = time.perf_counter()
+            person.last_seen = time.monotonic()
             cmd, args = parse_command(msg)
+            if cmd == commands.CLOSE:
+                return False
+            elif not self.admit(person, cmd, args):
+                self.reply(person, [GC.RATE_LIMITED])
+                continue
+            elif cmd == commands.PING:
+                self.reply(person, [GC.PONG])
+                self.command_done(cmd, start)
+                continue
+            elif cmd == commands.HELLO:
+                # Answered in the old framing
+                framing = self.negotiate(args)
+                self.reply(person, [GC.HELLO_REPLY([framing])])
+                self.stream(person.connection).set_framing(framing)
+                self.command_done(cmd, start)
+                continue
+            elif cmd == commands.NODE_LOOKUP and self.from_node(person):
+                self.reply(person, self.lookup_replies(args[0] if args else "", False))
+                self.command_done(cmd, start)
+                continue
+
+            job = self.authenticate(cmd, args)
+            try:
+                credential = job.result() if job else None
+            except Exception as e: # e.g. a worker process of self.credentials died
+                log.warning("could not check the password: %s", e)
+                credential = None
+            reply, logged_in = self.login_command(person, cmd, args, credential)
+            self.reply(person, [reply])
+            self.command_done(cmd, start)
+            if logged_in:
+                self.deliver_backlog(person)
+                return True
+
+
+    def handle_connection(self, person: Person, addr: tuple):
+        """Handles connection for a client (used threaded for each user)
+
+        Args:
+            addr (tuple): address of the client.
+        """
+        set_connection(addr, person)
+        person.addr = addr
+        log.info("connected")
+        # Every frame to person goes through person.out from here on
+        person.out = WriteQueue(person.connection, WRITE_HIGH, WRITE_LOW)
+        self.track(person)
+        try:
+            ongoing_connection = True
+            while ongoing_connection and self.login(person):
+                log.info("logged in")
+
+                running = True
+                while running:
+                    msg = self.receive_msg(person.connection)
+                    if not msg:
+                        # Server lost connection to client
+                        ongoing_connection = False
+                        self.drop_user(person)
+                        break
+                    start = time.perf_counter()
+                    person.last_seen = time.monotonic()
+                    cmd, args = parse_command(msg)
+                    if not self.admit(person, cmd, args):
+                        self.reply(person, [GC.RATE_LIMITED])
+                        continue
+
+                    replies, running, ongoing_connection = self.session_command(person, cmd, args)
+                    if replies:
+                        self.reply(person, replies)
+                    self.command_done(cmd, start)
+        except Exception as e:
+            log.exception("connection failed: %s", e)
+            self.drop_if_logged_in(person)
+        finally:
+            # Client is done using the server
+            log.info("closing connection")
+            self.sessions.cancel(person)
+            person.out.close()
+            person.connection.close()
+            self.connections_open.dec()
+
+
+class AsyncServer(Server):
+    """Serves every client as a coroutine on a single asyncio event loop,
+    instead of one thread per connection. Speaks the same protocol as Server.
+    """
+    async def receive_msg_async(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Waits for and retrieves a message from reader. The framing state
+        of the connection is kept under its writer.
+
+        Returns:
+            str: decoded message retrieved. "" if no message or error
+        """
+        try:
+            stream = self.stream(writer)
+            while not stream.frames:
+                data = await reader.read(GC.BUFFSIZE)
+                if not data: # End of file recieved
+                    return ""
+                frames = stream.decoder.feed(data)
+                stream.frames.extend(frames)
+                self.count_received(len(frames), len(data))
+            return stream.frames.popleft()
+        except Exception as e:
+            log.warning("could not receive message: %s", e)
+            return ""
+
+
+    def deliver(self, person: Person, frames: list, block: bool = False):
+        """Writes relayed frames (encoded) to person's StreamWriter. The
+        writer buffers them, so this never waits for the recipient (block is
+        not used); if more than WRITE_HIGH bytes are buffered already, see
+        slow_client.
+
+        Returns:
+            bool: Whether the frames were written.
+        """
+        if person.connection.is_closing():
+            return False
+        if person.connection.transport.get_write_buffer_size() > WRITE_HIGH:
+            self.slow_client(person)
+            return False
+        data = b"".join(frames)
+        person.connection.write(data)
+        self.count_sent(len(frames), len(data))
+        return True
+
+
+    async def deliver_backlog_async(self, person: Person):
+        """Coroutine version of Server.deliver_backlog, that waits for each
+        batch to be written before reading the next.
+        """
+        if self.offline:
+            with closing(self.offline.take(person.username)) as batches:
+                for batch in batches:
+                    if not self.deliver(person, [self.encode_for(person, frame) for frame in batch]):
+                        break
+                    try:
+                        await person.connection.drain()
+                    except ConnectionError:
+                        break
+
+
+    def deliver_backlog_soon(self, person: Person):
+        """Starts deliver_backlog_async for person as a task of its own, so it
+        waits for person to read instead of the caller.
+        """
+        # Referenced from person, so the task is not garbage collected while it runs
+        person.backlog = asyncio.get_running_loop().create_task(self.deliver_backlog_async(person))
 
-            if cmd == commands.LOGIN:
-                username = args[0]
-                passw = args[1]
-
-                self.registered_users_lock.acquire()
-                self.active_users_lock.acquire()
-                if username in self.registered_users and self.registered_users[username] == passw and not username in self.active_users:
-                    # User is valid
-                    person.set_login(username, passw, (args[2], args[3]))
-                    self.active_users[username] = person
-                    self.send_msg(person.connection, GC.LOGIN_SUCCESS)
-
-                    self.active_users_lock.release()
-                    self.registered_users_lock.release()
-                    return True
-                # User not valid
-                self.send_msg(person.connection, GC.LOGIN_FAILURE)
-
-                self.active_users_lock.release()
-                self.registered_users_lock.release()
-                #return False
-
-            elif cmd == commands.REGISTER:
-                username = args[0]
-                passw = args[1]
-
-                self.registered_users_lock.acquire()
-                if not (username in self.registered_users):
-                    # User not already registred
-                    person.set_login(username, passw, (args[2], args[3]))
-
-                    self.registered_users[username] = passw
-                    self.active_users_lock.acquire()
-                    self.active_users[username] = person
-                    self.active_users_lock.release()
-                    self.registered_users_lock.release()
-
-                    self.send_msg(person.connection, GC.REGISTER_SUCCESS)
-                    return True
-                # User already in register
-                self.send_msg(person.connection, GC.REGISTER_FAILURE)
-                self.registered_users_lock.release()
-                #return False
-
-            elif cmd == commands.CLOSE:
+
+    async def send_msg_async(self, writer: asyncio.StreamWriter, msg: str):
+        """Sends msg as utf-8 encoded bytes to writer.
+
+        Args:
+            msg (str): msg to encode and send
+        """
+        await self.send_msgs_async(writer, [msg])
+
+
+    async def send_msgs_async(self, writer: asyncio.StreamWriter, msgs: list):
+        """Writes msgs to writer together, then waits for the client while
+        more than WRITE_HIGH bytes are buffered (once, not per msg).
+        """
+        try:
+            stream = self.stream(writer)
+            data = b"".join(stream.encode(msg) for msg in msgs)
+            writer.write(data)
+            self.count_sent(len(msgs), len(data))
+            await writer.drain()
+        except Exception as e:
+            log.warning("could not send message: %s", e)
+
+
+    async def login_async(self, person: Person, reader: asyncio.StreamReader):
+        """Coroutine version of Server.login.
+
+        Returns:
+            bool: True if logged in, else False
+        """
+        while True:
+            msg = await self.receive_msg_async(reader, person.connection)
+            if not msg:
+                # Server lost connection to client
+                return False
+            start = time.perf_counter()
+            person.last_seen = time.monotonic()
+            cmd, args = parse_command(msg)
+            if cmd == commands.CLOSE:
                 return False
+            elif not self.admit(person, cmd, args):
+                await self.send_msg_async(person.connection, GC.RATE_LIMITED)
+                continue
+            elif cmd == commands.PING:
+                await self.send_msg_async(person.connection, GC.PONG)
+                self.command_done(cmd, start)
+                continue
+            elif cmd == commands.HELLO:
+                framing = self.negotiate(args)
+                await self.send_msg_async(person.connection, GC.HELLO_REPLY([framing]))
+                self.stream(person.connection).set_framing(framing)
+                self.command_done(cmd, start)
+                continue
+            elif cmd == commands.NODE_LOOKUP and self.from_node(person):
+                await self.send_msgs_async(person.connection, self.lookup_replies(args[0] if args else "", False))
+                self.command_done(cmd, start)
+                continue
 
+            job = self.authenticate(cmd, args)
+            try:
+                credential = await asyncio.wrap_future(job) if job else None
+            except Exception as e: # e.g. a worker process of self.credentials died
+                log.warning("could not check the password: %s", e)
+                credential = None
+            if cmd == commands.REGISTER:
+                # Waits for the registration to be on disk (UserLog.append); not on the event loop
+                reply, logged_in = await asyncio.to_thread(self.login_command, person, cmd, args, credential)
             else:
-                # Invalid command
-                self.send_msg(person.connection, GC.LOGIN_INV_COMMAND)
+                reply, logged_in = self.login_command(person, cmd, args, credential)
+            await self.send_msg_async(person.connection, reply)
+            self.command_done(cmd, start)
+            if logged_in:
+                await self.deliver_backlog_async(person)
+                return True
 
 
-    def handle_connection(self, person: Person):
-        """Handles connection for a client (used threaded for each user)
+    async def handle_connection_async(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Coroutine version of Server.handle_connection. person.connection
+        holds the StreamWriter of the client.
         """
-        ongoing_connection = True
-        while ongoing_connection and self.login(person):
-            print(f"User {person.connection.getpeername()} logged in")
-
-            running = True
-            while running:
-                msg = self.receive_msg(person.connection)
-                if not msg:
-                    # Server lost connection to client
-                    ongoing_connection = False
-                    with self.active_users_lock:
-                        self.active_users.pop(person.username)
-                    break
-                cmd, args = parse_command(msg)
-
-                if cmd == commands.LOOKUP:
-                    if not len(args):
-                        # lookup all active users
-                        self.active_users_lock.acquire()
-                        self.send_msg(person.connection, f">> {len(self.active_users)} user(s) online. The list follows:")
-                        for user in self.active_users.values():
-                            msg = f">> {user.username} is online:\n"
-                            msg = msg + f">> IP: {user.listen_addr[0]}\n"
-                            msg = msg + f">> Port: {user.listen_addr[1]}"
-                            self.send_msg(person.connection, msg)
-                        self.active_users_lock.release()
+        if not self.admit_connection():
+            writer.transport.abort()
+            return
+        person = Person(writer)
+        # drain() waits for the client while more than WRITE_HIGH bytes are buffered
+        writer.transport.set_write_buffer_limits(WRITE_HIGH, WRITE_LOW)
+        person.addr = writer.get_extra_info("peername")
+        set_connection(person.addr, person)
+        log.info("connected")
+        self.connections_total.inc()
+        self.connections_open.inc()
+        self.track(person)
+
+        try:
+            ongoing_connection = True
+            while ongoing_connection and await self.login_async(person, reader):
+                log.info("logged in")
+
+                running = True
+                while running:
+                    msg = await self.receive_msg_async(reader, writer)
+                    if not msg:
+                        # Server lost connection to client
+                        ongoing_connection = False
+                        self.drop_user(person)
+                        break
+                    start = time.perf_counter()
+                    person.last_seen = time.monotonic()
+                    cmd, args = parse_command(msg)
+                    if not self.admit(person, cmd, args):
+                        await self.send_msg_async(writer, GC.RATE_LIMITED)
+                        continue
+
+                    if cmd == commands.LOOKUP and self.federation:
+                        # Forwarded lookups wait for other name servers; not on the event loop
+                        replies, running, ongoing_connection = await asyncio.to_thread(
+                            self.session_command, person, cmd, args)
                     else:
-                        # Lookup user in args[0] (also check whether user found)
-                        self.active_users_lock.acquire()
-                        user = self.active_users.get(args[0])
-                        self.active_users_lock.release()
-
-                        if user:
-                            self.send_msg(person.connection, f">> {user.username} is online:")
-                            self.send_msg(person.connection, f">> IP: {user.listen_addr[0]}")
-                            self.send_msg(person.connection, f">> Port: {user.listen_addr[1]}")
-                        else:
-                            self.send_msg(person.connection, GC.LOOKUP_FAILED(args[0]))
-                    self.send_msg(person.connection, GC.LOOKUP_DONE)
-
-                elif cmd == commands.LOGOUT:
-                    try:
-                        self.active_users_lock.acquire()
-                        self.active_users.pop(person.username)
-                        self.send_msg(person.connection, GC.LOGOUT_SUCCESS)
-                        running = False
-                    except KeyError as e:
-                        print("[EXCEPTION] Could not remove user: ", e)
-                        self.send_msg(person.connection, GC.LOGOUT_FAILURE)
-                    finally:
-                        self.active_users_lock.release()
-
-                elif cmd == commands.CLOSE:
-                    running = False
-                    ongoing_connection = False
-
-                else:
-                    # Invalid command
-                    self.send_msg(person.connection, GC.LOGGEDIN_INV_COMMAND)
-
-        # Client is done using the server
-        print(f"Closing down user {person.connection.getpeername()}")
-        person.connection.close()
+                        replies, running, ongoing_connection = self.session_command(person, cmd, args)
+                    if replies:
+                        await self.send_msgs_async(writer, replies)
+                    self.command_done(cmd, start)
+        except Exception as e:
+            log.exception("connection failed: %s", e)
+            self.drop_if_logged_in(person)
+        finally:
+            # Client is done using the server
+            log.info("closing connection")
+            self.sessions.cancel(person)
+            writer.close()
+            self.connections_open.dec()
 
-if __name__ == "__main__":
-    print("server turned on.")
-    server = Server(IP_ADDR, PORT, MAX_USERS)
-    print("Server listening for connections.")
+
+    async def serve_forever(self, backlog: int = LISTEN_BACKLOG):
+        """Accepts and serves clients on the listen socket until cancelled.
+
+        Args:
+            backlog (int): listen backlog; must be large to accept many
+                           clients in bursts.
+        """
+        server = await asyncio.start_server(self.handle_connection_async,
+                                            sock=self.listen_socket,
+                                            backlog=backlog)
+        presence = asyncio.create_task(self.presence_loop_async())
+        reaper = asyncio.create_task(self.reaper_loop_async())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            presence.cancel()
+            reaper.cancel()
+
+
+    async def presence_loop_async(self):
+        """Coroutine version of Server.presence_loop.
+        """
+        while True:
+            await asyncio.sleep(PRESENCE_WINDOW)
+            self.flush_presence()
+
+
+    async def reaper_loop_async(self):
+        """Coroutine version of Server.reaper_loop.
+        """
+        while True:
+            await asyncio.sleep(REAPER_TICK)
+            self.reap_idle()
+
+
+    def disconnect(self, person: Person):
+        """Aborts person's connection (without waiting for unsent data), so
+        its handler receives end of file.
+        """
+        person.connection.transport.abort()
+
+
+def make_federation(options: argparse.Namespace):
+    """
+    Returns:
+        Federation: of the name servers in options.nodes. None if not federated.
+
+    Raises:
+        SystemExit: If this name server is not one of options.nodes.
+    """
+    if not options.nodes:
+        return None
+    nodes = [parse_node(node) for node in options.nodes.split(",")]
+    node = (IP_ADDR, options.port)
+    if node not in nodes:
+        sys.exit(f"{IP_ADDR}:{options.port} is not one of --nodes")
+    return Federation(node, nodes, FEDERATION_CACHE_SIZE, FEDERATION_CACHE_TTL)
+
+
+def run_worker(worker: int, state, options: argparse.Namespace):
+    """Serves clients as one of the processes of serve_workers.
+
+    Args:
+        worker (int): number of this worker.
+        state: proxy of the shared RegistryState.
+        options (Namespace): command line options.
+    """
+    # Stopped by serve_workers with SIGTERM, not by the handler inherited from it
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    setup_logging(options.log_level)
+    # Offline messages are kept in files of a single process, so not with workers
+    server = Server(IP_ADDR, options.port, LISTEN_BACKLOG, relay=options.relay,
+                    users=SharedUserRegistry(state, worker), reuse_port=True,
+                    federation=make_federation(options), idle_timeout=options.idle_timeout,
+                    rate_limits=not options.no_rate_limits, slow_clients=options.slow_clients,
+                    compression=not options.no_compression)
+    if options.metrics_port:
+        serve_metrics(server.metrics, (METRICS_ADDR, options.metrics_port + worker))
+    log.info("worker %d listening for connections on %s:%d", worker, IP_ADDR, options.port)
+    serve_threaded(server)
+
+
+def serve_workers(options: argparse.Namespace):
+    """Serves clients with options.workers processes that all listen on options.port
+    (SO_REUSEPORT), so the server is not bound to one core by the GIL.
+    Registered and active users are kept by a coordinator process (see
+    shared_registry), so logins and /lookup are consistent over all workers.
+    Relayed messages, channels and presence subscribers are per worker.
+    Workers are threaded: every registry operation is a round trip to the
+    coordinator, which would hold up all clients of an event loop.
+    Ends on SIGTERM or ^C, stopping the workers and the coordinator.
+    """
+    manager, state = start_coordinator(USER_SHARDS, options.registry)
+    # Ends the loop below like ^C does, so the workers are stopped and do not
+    # keep serving on the port
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    workers = [Process(target=run_worker, args=(worker, state, options))
+               for worker in range(options.workers)]
+    for worker in workers:
+        worker.start()
+    running = dict(enumerate(workers))
+    try:
+        while running:
+            exited = wait([worker.sentinel for worker in running.values()])
+            for number, worker in list(running.items()):
+                if worker.sentinel in exited:
+                    del running[number]
+                    # Users of an exited worker are not logged in anymore
+                    dropped = state.drop_worker(number)
+                    log.info("worker %d exited; %d user(s) logged out", number, dropped)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+        state.close()
+        manager.shutdown()
+
+
+def serve_threaded(server: Server):
+    """Accepts clients and serves each in its own thread, until the listen
+    socket is shut down or closed.
+    """
+    Thread(target=server.presence_loop, daemon=True).start()
+    Thread(target=server.reaper_loop, daemon=True).start()
     running = True
     while running:
         try:
             conn, addr = server.listen_socket.accept()
-            person = Person(conn)
-            print(f"User {addr} connected to server.")
-            thread = Thread(target=server.handle_connection, args=(person,))
-            thread.start()
+        except OSError as e:
+            if e.errno in (EBADF, EINVAL):
+                # The listen socket was shut down or closed
+                log.info("stopped accepting connections: %s", e)
+                break
+            # E.g. out of file descriptors, or the client gave up already
+            log.warning("could not accept connection: %s", e)
+            if e.errno in (EMFILE, ENFILE):
+                # Until connections are closed, accept() would fail at once again
+                time.sleep(ACCEPT_BACKOFF)
+            continue
         except SystemExit as e:
-            print(e)
+            log.error("stopped accepting connections: %s", e)
             break
-        except Exception as e:
-            print("[EXCEPTION] ", e)
-            break
\ No newline at end of file
+        if not server.admit_connection():
+            conn.close()
+            continue
+        person = Person(conn)
+        server.connections_total.inc()
+        server.connections_open.inc()
+        try:
+            Thread(target=server.handle_connection, args=(person, addr)).start()
+        except RuntimeError as e: # too many threads
+            log.warning("could not serve connection: %s", e)
+            conn.close()
+            server.connections_open.dec()
+            time.sleep(ACCEPT_BACKOFF)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="simple_chat name server")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                        help="thread: one thread per client; async: all clients on one event loop")
+    parser.add_argument("--registry", default=REGISTRY_PATH,
+                        help="file registered users are kept in (\"\" keeps them in memory only)")
+    parser.add_argument("--relay", action="store_true",
+                        help="let clients /msg each other through the server")
+    parser.add_argument("--offline-dir", default=OFFLINE_DIR,
+                        help="with --relay, hold messages for offline users here (\"\" refuses them)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help=f"serve Prometheus metrics at http://{METRICS_ADDR}:<port>/metrics (0: off)")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server processes sharing the port (metrics of worker i on --metrics-port + i); "
+                             "thread mode only, as registry calls to the shared coordinator block")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="seconds a client may send nothing before it is disconnected (0: never)")
+    parser.add_argument("--no-rate-limits", action="store_true",
+                        help="do not limit the frames of a connection, logins per username and connections accepted")
+    parser.add_argument("--slow-clients", choices=["disconnect", "drop"], default=SLOW_CLIENT_POLICY,
+                        help=f"what to do when a frame is relayed to a client with more than {WRITE_HIGH} "
+                             "bytes not read: disconnect it, or drop the frame")
+    parser.add_argument("--no-compression", action="store_true",
+                        help="never compress frames, even for clients asking for it")
+    parser.add_argument("--nodes", default="",
+                        help="host:port,... of every federated name server, this one included; "
+                             "usernames are spread over them")
+    options = parser.parse_args()
+    if options.workers > 1 and options.mode == "async":
+        parser.error("--workers needs --mode thread")
+
+    setup_logging(options.log_level)
+    log.info("server turned on (%s mode)", options.mode)
+    if options.workers > 1:
+        serve_workers(options)
+        sys.exit(0)
+    server_class = AsyncServer if options.mode == "async" else Server
+    server = server_class(IP_ADDR, options.port, LISTEN_BACKLOG, options.registry, options.relay,
+                          options.offline_dir, federation=make_federation(options),
+                          idle_timeout=options.idle_timeout, rate_limits=not options.no_rate_limits,
+                          slow_clients=options.slow_clients, compression=not options.no_compression)
+    if options.metrics_port:
+        serve_metrics(server.metrics, (METRICS_ADDR, options.metrics_port))
+    log.info("listening for connections on %s:%d", IP_ADDR, options.port)
+    if options.mode == "async":
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+    else:
+        serve_threaded(server)
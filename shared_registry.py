@@ -0,0 +1,214 @@
+from multiprocessing.managers import BaseManager
+from collections import deque
+from itertools import islice
+from threading import Lock
+
+from person import Person
+from user_registry import UserRegistry
+from user_log import UserLog
+
+
+PRESENCE_HISTORY = 100000 # changes kept for workers to catch up on
+
+
+def stand_in(username: str, listen_addr: tuple):
+    """
+    Returns:
+        Person: a user without a connection (served by another process).
+    """
+    person = Person(None)
+    person.set_login(username, tuple(listen_addr))
+    return person
+
+
+class RegistryState:
+    def __init__(self, shards: int, registry_path: str):
+        """The registered and active users of all workers of a multi-process
+        server. Lives in the coordinator process (see start_coordinator);
+        workers call it through a proxy (see SharedUserRegistry). Active users
+        are kept as stand-ins with the worker that serves them.
+
+        Args:
+            shards (int): shards of the UserRegistry.
+            registry_path (str): file registered users are kept in. If "",
+                                 they are only kept in memory.
+        """
+        self.registry = UserRegistry(shards, UserLog(registry_path) if registry_path else None)
+        self.registry.on_change = self.record
+        self.changes = deque(maxlen=PRESENCE_HISTORY) # (seqno, username, online)
+        self.seqno = 0
+        self.changes_lock = Lock()
+
+    def record(self, username: str, online: bool):
+        with self.changes_lock:
+            self.seqno += 1
+            self.changes.append((self.seqno, username, online))
+
+    def credential(self, username: str):
+        return self.registry.credential(username)
+
+    def is_registered(self, username: str):
+        return self.registry.is_registered(username)
+
+    def register(self, username: str, credential: str, listen_addr: tuple, worker: int):
+        person = stand_in(username, listen_addr)
+        person.worker = worker
+        return self.registry.register(username, credential, person)
+
+    def login(self, username: str, credential: str, listen_addr: tuple, worker: int):
+        person = stand_in(username, listen_addr)
+        person.worker = worker
+        return self.registry.login(username, credential, person)
+
+    def logout(self, username: str):
+        return self.registry.logout(username)
+
+    def get_active(self, username: str):
+        """
+        Returns:
+            tuple: listen address of username. None if not logged in.
+        """
+        person = self.registry.get_active(username)
+        return person.listen_addr if person else None
+
+    def active(self):
+        """
+        Returns:
+            list: (username, listen address) of every logged in user.
+        """
+        return [(person.username, person.listen_addr) for person in self.registry.active()]
+
+    def changes_since(self, seqno: int):
+        """
+        Returns:
+            (int, list): (last seqno, (username, online) of every change after
+                          seqno). The list is None if some of them were dropped.
+        """
+        with self.changes_lock:
+            if not self.changes or seqno >= self.seqno:
+                return self.seqno, []
+            first = self.changes[0][0]
+            if seqno + 1 < first:
+                return self.seqno, None
+            return self.seqno, [(username, online) for _, username, online
+                                in islice(self.changes, seqno + 1 - first, None)]
+
+    def drop_worker(self, worker: int):
+        """Logs out every user of worker (e.g. after it exited).
+
+        Returns:
+            int: number of users logged out.
+        """
+        dropped = [person.username for person in self.registry.active() if person.worker == worker]
+        for username in dropped:
+            self.registry.logout(username)
+        return len(dropped)
+
+    def close(self):
+        self.registry.close()
+
+
+class RegistryManager(BaseManager):
+    pass
+
+RegistryManager.register("RegistryState", RegistryState)
+
+
+def start_coordinator(shards: int, registry_path: str):
+    """Starts the coordinator process, holding a RegistryState.
+
+    Returns:
+        (RegistryManager, proxy): (the manager; shutdown() stops it, the
+                                   RegistryState proxy to hand to workers)
+    """
+    manager = RegistryManager()
+    manager.start()
+    return manager, manager.RegistryState(shards, registry_path)
+
+
+class SharedUserRegistry:
+    def __init__(self, state, worker: int):
+        """The UserRegistry of one worker of a multi-process server. Every
+        operation is forwarded to the RegistryState in the coordinator, so
+        duplicate logins and /lookup are consistent over all workers; the
+        Person of each user served by this worker is kept here.
+
+        Args:
+            state: proxy of the RegistryState.
+            worker (int): number of this worker.
+        """
+        self.state = state
+        self.worker = worker
+        self.local = {} # username -> Person served by this worker
+        self.lock = Lock()
+        self.seqno, _ = state.changes_since(-1)
+        # Called with (username, online) for changes of all workers, by sync()
+        self.on_change = None
+
+    def credential(self, username: str):
+        return self.state.credential(username)
+
+    def is_registered(self, username: str):
+        return self.state.is_registered(username)
+
+    def register(self, username: str, credential: str, person: Person):
+        if not self.state.register(username, credential, person.listen_addr, self.worker):
+            return False
+        with self.lock:
+            self.local[username] = person
+        return True
+
+    def login(self, username: str, credential: str, person: Person):
+        if not self.state.login(username, credential, person.listen_addr, self.worker):
+            return False
+        with self.lock:
+            self.local[username] = person
+        return True
+
+    def logout(self, username: str):
+        """Logs out username, if served by this worker.
+        """
+        with self.lock:
+            if self.local.pop(username, None) is None:
+                return False
+        return self.state.logout(username)
+
+    def get_active(self, username: str):
+        """
+        Returns:
+            Person: the logged in user username; a Person without a connection
+                    if served by another worker. None if not logged in.
+        """
+        person = self.local.get(username)
+        if person is None:
+            listen_addr = self.state.get_active(username)
+            if listen_addr:
+                person = stand_in(username, listen_addr)
+        return person
+
+    def active(self):
+        """
+        Returns:
+            list: Person of every logged in user, of all workers.
+        """
+        return [self.local.get(username) or stand_in(username, listen_addr)
+                for username, listen_addr in self.state.active()]
+
+    def sync(self):
+        """Reports the logins and logouts on all workers since the last call
+        to on_change.
+
+        Returns:
+            bool: False if this worker fell too far behind and changes were
+                  lost (presence must be sent in full again).
+        """
+        self.seqno, changes = self.state.changes_since(self.seqno)
+        if changes is None:
+            return False
+        if self.on_change:
+            for username, online in changes:
+                self.on_change(username, online)
+        return True
+
+    def close(self):
+        pass
@@ -0,0 +1,22 @@
+from channels import ChannelIndex
+from person import Person
+
+
+def test_channels():
+    index = ChannelIndex()
+    alice, bob = Person(None), Person(None)
+
+    ### Membership
+    assert index.join("#a", alice) and index.join("#a", bob)
+    assert not index.join("#a", alice)
+    assert set(index.members("#a")) == {alice, bob}
+    assert index.members("#a") is index.members("#a") # snapshot is reused
+    assert index.members("#nobody") == ()
+
+    ### Leaving
+    assert index.leave("#a", bob) and not index.leave("#a", bob)
+    assert index.members("#a") == (alice,)
+    index.join("#b", alice)
+    index.leave_all(alice)
+    assert index.members("#a") == () and index.members("#b") == ()
+    assert not index.channels and not index.joined
@@ -0,0 +1,85 @@
+from concurrent.futures.process import BrokenProcessPool
+import time
+
+import pytest
+
+from credentials import CredentialService, hash_password, verify_password
+
+
+def test_verify_password():
+    credential = hash_password("pua")
+    assert credential.startswith("scrypt$") and "pua" not in credential
+    assert verify_password("pua", credential)
+    assert not verify_password("pub", credential)
+
+    ### Plaintext passwords registered before hashing
+    assert verify_password("pua", "pua")
+    assert not verify_password("pub", "pua")
+
+
+def test_credential_service():
+    service = CredentialService(workers=1, cache_size=1)
+    try:
+        credential = service.hash("pua").result()
+        assert service.verify("bob", "pua", credential).result() == credential
+        assert service.verify("bob", "pub", credential).result() is None
+        assert service.verify("bob", "pua", None).result() is None
+
+        ### Cached verification only holds for the credential it was made for
+        assert "bob" in service.cache
+        assert service.verify("bob", "pua", hash_password("other")).result() is None
+    finally:
+        service.close()
+
+
+def test_credential_service_queues_jobs():
+    service = CredentialService(workers=1, cache_size=1)
+    try:
+        ### Jobs beyond max_running are queued rather than waited for
+        start = time.monotonic()
+        jobs = [service.submit(time.sleep, 0.1) for _ in range(service.max_running + 1)]
+        assert time.monotonic() - start < 0.1
+        assert len(service.waiting) == 1
+        assert [job.result() for job in jobs] == [None] * len(jobs)
+        assert service.running == 0 and not service.waiting
+    finally:
+        service.close()
+
+
+def wait_until(predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def kill_workers(service: CredentialService):
+    for process in list(service.pool._processes.values()):
+        process.kill()
+
+
+def test_credential_service_replaces_broken_pool():
+    service = CredentialService(workers=1, cache_size=1)
+    try:
+        ### Jobs in the pool as a worker dies fail; later ones run in a new pool
+        job = service.submit(time.sleep, 10)
+        broken = service.pool
+        assert wait_until(lambda: broken._processes)
+        kill_workers(service)
+        with pytest.raises(BrokenProcessPool):
+            job.result(timeout=5)
+        assert service.pool is not broken
+        credential = service.hash("pua").result(timeout=5)
+        assert service.verify("bob", "pua", credential).result(timeout=5) == credential
+
+        ### Also when it is found broken on submit
+        broken = service.pool
+        kill_workers(service)
+        assert wait_until(lambda: broken._broken)
+        assert service.hash("pua").result(timeout=5).startswith("scrypt$")
+        assert service.pool is not broken
+        assert service.running == 0
+    finally:
+        service.close()
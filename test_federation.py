@@ -0,0 +1,40 @@
+from collections import Counter
+
+from federation import HashRing, Federation, parse_node
+
+
+NODES = [("localhost", 7700 + i) for i in range(4)]
+USERNAMES = [f"user{i}" for i in range(4000)]
+
+
+def test_hash_ring():
+    ring = HashRing(NODES)
+
+    ### Every node gets a share of the usernames
+    shares = Counter(ring.owner(username) for username in USERNAMES)
+    assert set(shares) == set(NODES)
+    assert min(shares.values()) > len(USERNAMES) / len(NODES) / 2
+
+    ### Adding a node only moves usernames to it
+    new_node = ("localhost", 7704)
+    grown = HashRing(NODES + [new_node])
+    moved = [username for username in USERNAMES if grown.owner(username) != ring.owner(username)]
+    assert all(grown.owner(username) == new_node for username in moved)
+    assert len(moved) < len(USERNAMES) / 3
+
+
+def test_federation():
+    assert parse_node("localhost:7701") == ("localhost", 7701)
+    federations = [Federation(node, NODES, 10, 1) for node in NODES]
+    for username in USERNAMES[:100]:
+        owners = [federation for federation in federations if federation.is_local(username)]
+        assert len(owners) == 1 and owners[0].node == federations[0].owner(username)
+    assert all(node not in federation.links for federation, node in zip(federations, NODES))
+
+
+def test_node_lookup_peers():
+    federation = Federation(NODES[0], NODES, 10, 1)
+    assert federation.is_peer("127.0.0.1")
+    assert not federation.is_peer("192.0.2.1")
+    # A node alone has no peers
+    assert not Federation(NODES[0], NODES[:1], 10, 1).is_peer("127.0.0.1")
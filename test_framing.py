@@ -0,0 +1,106 @@
+from socket import socketpair
+from threading import Thread
+
+from common.command import parse_command
+import pytest
+
+import common.global_constants as GC
+from common.framing import (FrameDecoder, LengthPrefixDecoder, CompressedDecoder, COMPRESS_MIN,
+                            encode_frame, encode_length_frame, encode_compressed_frame)
+from common.messenger import Messenger
+
+
+def test_frame_decoder():
+    decoder = FrameDecoder()
+
+    ### Several frames in one chunk
+    assert decoder.feed(b"/lookup\0/logout\0/clo") == ["/lookup", "/logout"]
+    assert decoder.pending() == b"/clo"
+
+    ### Frame completed by a later chunk
+    assert decoder.feed(b"se\0") == ["/close"]
+    assert decoder.pending() == b""
+
+    ### Multi-byte character split across chunks
+    data = encode_frame("bob: blåbærgrød")
+    split = data.index("å".encode()) + 1
+    assert decoder.feed(data[:split]) == []
+    assert decoder.feed(data[split:]) == ["bob: blåbærgrød"]
+
+    ### Empty frame
+    assert decoder.feed(b"\0") == [""]
+
+
+def test_messenger_pipelined():
+    a, b = socketpair()
+    with a, b:
+        messenger = Messenger()
+        a.sendall(encode_frame("first") + encode_frame("second") + encode_frame("x" * 5000))
+        assert messenger.receive_msg(b) == "first"
+        assert messenger.receive_msg(b) == "second"
+        assert messenger.receive_msg(b) == "x" * 5000
+
+        a.close()
+        assert messenger.receive_msg(b) == ""
+
+
+def test_length_prefix_decoder():
+    decoder = LengthPrefixDecoder(size=8)
+
+    ### Payload may contain END_MARKER
+    data = encode_length_frame("a\0b") + encode_length_frame("")
+    assert decoder.feed(data) == ["a\0b", ""]
+
+    ### Header and payload split; frame larger than the buffer
+    data = encode_length_frame("ø" * 100)
+    assert decoder.feed(data[:2]) == []
+    assert decoder.feed(data[2:51]) == []
+    assert decoder.feed(data[51:]) == ["ø" * 100]
+    assert len(decoder.buffer) == 8
+
+
+def test_compressed_decoder():
+    decoder = CompressedDecoder(size=8)
+    listing = "\n".join([GC.LOOKUP_PAGE(1, 1, 500)] + [f"user{i} 127.0.0.1 {5000 + i}" for i in range(500)])
+
+    ### Large frames are compressed, small ones are not
+    small = encode_compressed_frame("x" * (COMPRESS_MIN - 1))
+    large = encode_compressed_frame(listing)
+    assert small == encode_length_frame("x" * (COMPRESS_MIN - 1))
+    assert len(large) < len(listing) // 4
+    data = small + large + encode_compressed_frame("ø" * 1000)
+    assert decoder.feed(data[:5]) == []
+    assert decoder.feed(data[5:]) == ["x" * (COMPRESS_MIN - 1), listing, "ø" * 1000]
+
+    ### Decoders without compression take the flag for an oversize length
+    with pytest.raises(ValueError):
+        LengthPrefixDecoder().feed(large)
+
+
+def test_hello_negotiation():
+    a, b = socketpair()
+    with a, b:
+        client, server = Messenger(), Messenger()
+        server_done = Thread(target=lambda: server.answer_hello(b, parse_command(server.receive_msg(b))[1]))
+        server_done.start()
+        assert client.hello(a)
+        server_done.join()
+
+        client.send_msg(a, "/msg bob null\0byte")
+        assert server.receive_msg(b) == "/msg bob null\0byte"
+        server.send_msg(b, "x" * 5000)
+        assert client.receive_msg(a) == "x" * 5000
+
+
+def test_hello_fallback():
+    a, b = socketpair()
+    with a, b:
+        ### A peer that does not compress answers with plain length prefixed framing
+        client, server = Messenger(), Messenger()
+        server_done = Thread(target=lambda: server.receive_msg(b) and server.answer_hello(b, [GC.FRAMING_LENGTH]))
+        server_done.start()
+        assert client.hello(a)
+        server_done.join()
+        assert client.stream(a).framing == GC.FRAMING_LENGTH
+        client.send_msg(a, "y" * 5000)
+        assert server.receive_msg(b) == "y" * 5000
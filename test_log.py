@@ -0,0 +1,29 @@
+import logging
+
+from common.log import SamplingFilter, ContextFilter, set_connection
+from person import Person
+
+
+def record(msg: str, level: int = logging.WARNING):
+    return logging.LogRecord("test", level, __file__, 0, msg, (), None)
+
+
+def test_log():
+    ### Repeated warnings are sampled per message
+    sampler = SamplingFilter(interval=60, burst=2)
+    assert [sampler.filter(record("a %s")) for _ in range(4)] == [True, True, False, False]
+    assert sampler.filter(record("b %s"))
+    assert all(sampler.filter(record("a %s", logging.INFO)) for _ in range(4))
+
+    ### The dropped count is reported with the next window
+    sampler.interval = 0
+    first = record("a %s")
+    assert sampler.filter(first) and first.suppressed == 2
+
+    ### Records carry the connection they were logged for
+    person = Person(None)
+    set_connection(("127.0.0.1", 5000), person)
+    person.set_login("bob", ("127.0.0.1", 5001))
+    tagged = record("hi")
+    ContextFilter().filter(tagged)
+    assert tagged.conn == "127.0.0.1:5000" and tagged.user == "bob"
@@ -0,0 +1,77 @@
+from socket import socketpair
+from threading import Thread
+
+import pytest
+
+from client import Client, User_info
+from common.command import parse_command
+from common.messenger import Messenger
+from person import Person
+from server import Server
+import common.global_constants as GC
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # Small pages, so a few users span several reply frames
+    monkeypatch.setattr(GC, "LOOKUP_PAGE_SIZE", 3)
+    server = Server("localhost", 0, 16)
+    for i in range(7):
+        person = Person(None)
+        person.set_login(f"user{i}", ("127.0.0.1", 5000 + i))
+        server.users.register(person.username, "pw", person)
+    yield server
+    server.listen_socket.close()
+    server.credentials.close()
+
+
+def test_lookup_replies(server):
+    ### All users, GC.LOOKUP_PAGE_SIZE per frame
+    replies = server.lookup_replies("")
+    assert [reply.split("\n")[0] for reply in replies] == [GC.LOOKUP_PAGE(1, 3, 7), GC.LOOKUP_PAGE(2, 3, 7),
+                                                           GC.LOOKUP_PAGE(3, 3, 7)]
+    lines = [line for reply in replies for line in reply.split("\n")[1:]]
+    assert sorted(lines) == [f"user{i} 127.0.0.1 {5000 + i}" for i in range(7)]
+
+    ### One user, and one that is not online
+    assert server.lookup_replies("user4") == [GC.LOOKUP_PAGE(1, 1, 1) + "\nuser4 127.0.0.1 5004"]
+    assert server.lookup_replies("nobody") == [GC.LOOKUP_PAGE(1, 1, 0)]
+
+
+def test_client_lookup_users(server):
+    a, b = socketpair()
+    client = Client()
+    client.name_server.close()
+    client.name_server = a
+    Thread(target=client.read_name_server, args=(a, client.replies), daemon=True).start()
+    name_server = Messenger()
+
+    def answer():
+        _, args = parse_command(name_server.receive_msg(b))
+        name_server.send_msgs(b, server.lookup_replies(args[0] if args else ""))
+
+    try:
+        ### Pages are read until the last one
+        answering = Thread(target=answer)
+        answering.start()
+        users = client.lookup_users("")
+        answering.join()
+        assert users == {f"user{i}": User_info(True, "127.0.0.1", 5000 + i) for i in range(7)}
+        assert client.peer_cache.get("user6") == User_info(True, "127.0.0.1", 5006)
+
+        ### A single user
+        answering = Thread(target=answer)
+        answering.start()
+        assert client.lookup_users("user2") == {"user2": User_info(True, "127.0.0.1", 5002)}
+        answering.join()
+
+        ### A user that is not online is dropped from the peer cache
+        server.users.logout("user6")
+        answering = Thread(target=answer)
+        answering.start()
+        assert client.lookup_users("user6") == {}
+        answering.join()
+        assert client.peer_cache.get("user6") is None
+    finally:
+        a.close()
+        b.close()
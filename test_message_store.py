@@ -0,0 +1,40 @@
+from message_store import MessageStore
+
+
+def test_message_store():
+    store = MessageStore(capacity=3, max_bytes=10, max_senders=2)
+
+    ### Ring buffer keeps the newest messages
+    for body in ["a", "b", "c", "d"]:
+        assert store.add("bob", body)
+    messages, dropped = store.take("bob")
+    assert list(messages) == ["b", "c", "d"] and dropped == 1
+    messages, dropped = store.take("bob")
+    assert not messages and dropped == 0
+
+    ### Byte limit
+    store.add("bob", "123456")
+    store.add("bob", "7890ab")
+    messages, dropped = store.take("bob")
+    assert list(messages) == ["7890ab"] and dropped == 1
+    assert not store.add("bob", "x" * 11)
+
+    ### Beyond the sender limit, the sender that wrote least recently is evicted
+    assert store.add("alice", "hi") and store.add("bob", "yo")
+    assert store.add("eve", "hey")
+    assert store.unread_senders() == ["bob", "eve"]
+    assert store.known("bob") and store.known("eve") and not store.known("alice")
+    assert store.dropped == 3 and store.overflowed == 1
+
+
+def test_message_store_frees_senders():
+    store = MessageStore(capacity=3, max_bytes=10, max_senders=3)
+    for sender in ["fake1", "fake2", "fake3"]:
+        assert store.add(sender, "spam")
+        store.take(sender)
+
+    ### Senders whose messages were read take no slot
+    assert not store.buffers
+    assert store.add("alice", "hi")
+    messages, dropped = store.take("alice")
+    assert list(messages) == ["hi"] and dropped == 0
@@ -0,0 +1,30 @@
+from common.metrics import Metrics, TimedLock
+
+
+def test_metrics():
+    metrics = Metrics()
+
+    ### Counters with labels share a family
+    metrics.counter("logins_total", "Logins", outcome="success").inc()
+    metrics.counter("logins_total", "Logins", outcome="success").inc(2)
+    metrics.counter("logins_total", "Logins", outcome="failure").inc()
+
+    ### Histograms render cumulative buckets
+    latency = metrics.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in [0.05, 0.5, 0.5, 5.0]:
+        latency.observe(value)
+
+    ### Timed locks count every acquire
+    lock = TimedLock(metrics.histogram("wait_seconds", "Waits"), metrics.counter("acquires_total", "Acquires"))
+    with lock:
+        pass
+
+    lines = metrics.render().splitlines()
+    assert "# TYPE logins_total counter" in lines
+    assert 'logins_total{outcome="success"} 3' in lines
+    assert 'logins_total{outcome="failure"} 1' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_count 4" in lines
+    assert "acquires_total 1" in lines and "wait_seconds_count 0" in lines
@@ -0,0 +1,49 @@
+import os
+
+from offline_store import OfflineStore
+
+
+def test_offline_store(tmp_path):
+    directory = str(tmp_path / "offline")
+    store = OfflineStore(directory, memory_threshold=10, max_bytes=40, batch_size=2)
+
+    ### Frames spill to disk and are delivered in order, in batches
+    for frame in ["one", "two", "three", "four", "five"]:
+        assert store.store("bob", frame)
+    assert list(store.take("bob")) == [["one", "two"], ["three", "four"], ["five"]]
+    assert list(store.take("bob")) == []
+
+    ### Byte limit
+    assert store.store("bob", "x" * 30)
+    assert not store.store("bob", "y" * 11)
+
+    ### Spilled frames survive a restart
+    store = OfflineStore(directory, memory_threshold=10, max_bytes=40, batch_size=2)
+    assert list(store.take("bob")) == [["x" * 30]]
+
+
+def test_offline_store_interrupted(tmp_path):
+    directory = str(tmp_path / "offline")
+    store = OfflineStore(directory, memory_threshold=10, max_bytes=100, batch_size=2)
+
+    ### Batches not delivered are held again, before frames stored meanwhile
+    for frame in ["one", "two", "three", "four", "five"]:
+        store.store("bob", frame)
+    batches = store.take("bob")
+    assert next(batches) == ["one", "two"]
+    store.store("bob", "six")
+    assert next(batches) == ["three", "four"]
+    batches.close() # the recipient disconnected
+    assert list(store.take("bob")) == [["three", "four"], ["five", "six"]]
+    assert os.listdir(directory) == []
+
+    ### A delivery cut short by a crash is held again on restart
+    for frame in ["a" * 6, "b" * 6]:
+        store.store("carol", frame)
+    segment = store.segment_path("carol")
+    os.replace(segment, segment + ".deliver")
+    store.queues.clear()
+    for frame in ["c" * 6, "d" * 6]:
+        store.store("carol", frame)
+    store = OfflineStore(directory, memory_threshold=10, max_bytes=100, batch_size=2)
+    assert list(store.take("carol")) == [["a" * 6, "b" * 6], ["c" * 6, "d" * 6]]
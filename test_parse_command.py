@@ -93,6 +93,29 @@ def test_parse_command():
     print("   %s: %s command" %(res, command))
 
 
+    command = "msg"
+    arg0 = "nickname"
+    arg1 = "  spaces   are kept "
+    cmd, args = parse_command(f"/{command} {arg0} {arg1}")
+
+    res = (cmd == commands.MSG and len(args) == 2)
+    res = res and (args[0] == arg0 and args[1] == arg1.lstrip())
+
+    print("   %s: %s command(text kept)" %(res, command))
+
+
+    ### SAY
+    command = "say"
+    arg0 = "#channel"
+    arg1 = "hello channel"
+    cmd, args = parse_command(f"/{command} {arg0} {arg1}")
+
+    res = (cmd == commands.SAY and len(args) == 2)
+    res = res and (args[0] == arg0 and args[1] == arg1)
+
+    print("   %s: %s command" %(res, command))
+
+
     ### SHOW
     command = "show"
     cmd, args = parse_command(f"/{command}")
@@ -0,0 +1,27 @@
+import time
+
+from peer_cache import PeerCache
+
+
+def test_peer_cache(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = PeerCache(capacity=2, ttl=10)
+
+    ### Entries are used until their ttl is over
+    cache.put("alice", ("127.0.0.1", 1))
+    now[0] += 9
+    assert cache.get("alice") == ("127.0.0.1", 1)
+    now[0] += 2
+    assert cache.get("alice") is None and "alice" not in cache.entries
+
+    ### The least recently used entry is evicted beyond capacity
+    cache.put("alice", ("127.0.0.1", 1))
+    cache.put("bob", ("127.0.0.1", 2))
+    cache.get("alice")
+    cache.put("carol", ("127.0.0.1", 3))
+    assert list(cache.entries) == ["alice", "carol"]
+    assert cache.get("bob") is None
+
+    cache.invalidate("alice")
+    assert cache.get("alice") is None and cache.get("carol") == ("127.0.0.1", 3)
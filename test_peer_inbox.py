@@ -0,0 +1,32 @@
+from socket import create_connection
+from queue import Queue
+
+from common.framing import encode_frame
+from peer_inbox import PeerInbox
+
+
+def test_peer_inbox_limits():
+    received = Queue()
+    inbox = PeerInbox(("localhost", 0), received.put, 8, max_connections=2, idle_timeout=0.5)
+    inbox.start()
+    addr = inbox.listen_socket.getsockname()
+    try:
+        peers = []
+        for n in range(3):
+            s = create_connection(addr)
+            s.settimeout(5)
+            s.sendall(encode_frame(f"alice: {n}"))
+            assert received.get(timeout=5) == f"alice: {n}"
+            peers.append(s)
+        first, second, third = peers
+
+        ### Beyond max_connections the least recently active one is closed
+        assert first.recv(1) == b""
+        assert len(inbox.connections) == 2
+
+        ### Connections that stay silent are closed
+        assert second.recv(1) == b""
+        for s in (first, second, third):
+            s.close()
+    finally:
+        inbox.stop()
@@ -0,0 +1,49 @@
+from socket import create_server, MSG_WAITALL
+import time
+
+from peer_pool import PeerPool
+
+
+def test_peer_pool(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    listeners = [create_server(("localhost", 0)) for _ in range(2)]
+    for listener in listeners:
+        listener.settimeout(5)
+    addr, other_addr = (listener.getsockname() for listener in listeners)
+    pool = PeerPool(capacity=1, idle_timeout=10)
+    accepted = []
+    try:
+        ### Consecutive messages to a peer share one connection
+        pool.send(addr, b"one")
+        pool.send(addr, b"two")
+        peer, _ = listeners[0].accept()
+        accepted.append(peer)
+        peer.settimeout(5)
+        assert peer.recv(6, MSG_WAITALL) == b"onetwo"
+
+        ### A connection closed by the peer is not reused
+        peer.close()
+        pool.send(addr, b"three")
+        peer, _ = listeners[0].accept()
+        accepted.append(peer)
+        peer.settimeout(5)
+        assert peer.recv(5) == b"three"
+
+        ### Idle connections are closed
+        now[0] += 11
+        pool.send(addr, b"four")
+        assert peer.recv(1) == b""
+        peer, _ = listeners[0].accept()
+        accepted.append(peer)
+        peer.settimeout(5)
+        assert peer.recv(4) == b"four"
+
+        ### Beyond capacity the least recently used connection is closed
+        pool.send(other_addr, b"five")
+        assert peer.recv(1) == b""
+        assert list(pool.connections) == [other_addr]
+    finally:
+        pool.close()
+        for s in accepted + listeners:
+            s.close()
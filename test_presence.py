@@ -0,0 +1,37 @@
+from person import Person
+from presence import PresenceHub
+from user_registry import UserRegistry
+
+
+def test_presence():
+    hub = PresenceHub()
+    alice, bob = Person(None), Person(None)
+
+    ### Changes are only kept while someone subscribed
+    hub.changed("carol", True)
+    assert hub.subscribe(alice) and not hub.subscribe(alice)
+    assert hub.take() == ({}, (), [alice])
+
+    ### Changes are coalesced; new subscribers get none of them
+    hub.changed("carol", True)
+    hub.changed("dave", True)
+    hub.changed("carol", False)
+    hub.subscribe(bob)
+    assert hub.take() == ({"carol": False, "dave": True}, (alice,), [bob])
+
+    hub.unsubscribe(alice)
+    hub.changed("dave", False)
+    assert hub.take() == ({"dave": False}, (bob,), [])
+
+
+def test_changes_reported_under_shard_lock():
+    registry = UserRegistry(4)
+    reported = []
+    # A change recorded after the shard lock is released could be overtaken
+    # by a later change of the same username
+    registry.on_change = lambda username, online: reported.append(
+        (username, online, registry.shard(username).lock.locked()))
+    registry.register("alice", "pw", Person(None))
+    registry.logout("alice")
+    registry.login("alice", "pw", Person(None))
+    assert reported == [("alice", True, True), ("alice", False, True), ("alice", True, True)]
@@ -0,0 +1,26 @@
+from rate_limit import TokenBucket, KeyedBuckets
+
+
+def test_token_bucket():
+    bucket = TokenBucket(2, 3, now=0)
+
+    ### The burst is allowed at once, then rate per second
+    assert [bucket.take(now=0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.take(now=0.5)
+    assert not bucket.take(now=0.6)
+
+    ### Tokens never pile up beyond burst
+    assert [bucket.take(now=100) for _ in range(4)] == [True, True, True, False]
+
+
+def test_keyed_buckets():
+    buckets = KeyedBuckets(1, 2, capacity=2)
+    assert buckets.take("alice", now=0) and buckets.take("alice", now=0)
+    assert not buckets.take("alice", now=0)
+    # Other keys have their own bucket
+    assert buckets.take("bob", now=0)
+
+    ### The least recently used bucket is dropped beyond capacity
+    buckets.take("carol", now=0)
+    assert list(buckets.buckets) == ["bob", "carol"]
+    assert buckets.take("alice", now=0)
@@ -0,0 +1,95 @@
+from socket import socketpair
+from threading import Thread, Event
+
+import pytest
+
+from common.messenger import Messenger
+from federation import Federation
+from person import Person
+from relay import RelayQueue
+from server import Server
+from write_queue import WriteQueue
+import common.global_constants as GC
+
+
+def test_relay_queue():
+    batches = []
+    entered, release = Event(), Event()
+    def deliver(batch):
+        batches.append(batch)
+        entered.set()
+        release.wait(5)
+    queue = RelayQueue(2, deliver)
+
+    ### The sender finding the queue idle delivers; others only queue
+    first = Thread(target=queue.push, args=(b"a",))
+    first.start()
+    assert entered.wait(5)
+    assert queue.push(b"b") and queue.push(b"c")
+    assert not queue.push(b"d") # full
+    release.set()
+    first.join()
+    assert batches == [[b"a"], [b"b", b"c"]]
+    assert not queue.delivering and queue.relayed == 3 and queue.rejected == 1
+
+
+def test_relay_queue_deliver_fails():
+    failing = [True]
+    batches = []
+    def deliver(batch):
+        if failing.pop():
+            raise OSError("connection lost")
+        batches.append(batch)
+    queue = RelayQueue(2, deliver)
+
+    ### A failed delivery does not leave the queue marked as delivering
+    with pytest.raises(OSError):
+        queue.push(b"a")
+    failing.append(False)
+    assert queue.push(b"b")
+    assert batches == [[b"b"]]
+
+
+def login(server: Server, username: str, connection=None):
+    person = Person(connection)
+    server.prepare_login(person, [username, "pw", "127.0.0.1", "1"])
+    server.users.register(username, "pw", person)
+    return person
+
+
+def test_msg_command(tmp_path):
+    server = Server("localhost", 0, 16, relay=True, offline_dir=str(tmp_path))
+    a, b = socketpair()
+    alice = login(server, "alice")
+    bob = login(server, "bob", a)
+    bob.out = WriteQueue(a, high=1 << 16, low=1 << 12)
+    try:
+        ### Queued on the recipient's connection
+        assert server.msg_command(alice, ["bob", "hi"]) == ([GC.RELAY_QUEUED], True, True)
+        assert Messenger().receive_msg(b) == GC.DELIVER("alice", "hi")
+
+        ### Recipient's relay queue full
+        bob.relay = RelayQueue(0, bob.relay.deliver)
+        assert server.msg_command(alice, ["bob", "hi"]) == ([GC.RELAY_FULL("bob")], True, True)
+
+        ### Recipient connected to another server process
+        login(server, "carol")
+        assert server.msg_command(alice, ["carol", "hi"]) == ([GC.RELAY_REMOTE("carol")], True, True)
+
+        ### Recipient offline: held if registered
+        server.users.logout("carol")
+        assert server.msg_command(alice, ["carol", "hi"]) == ([GC.RELAY_STORED("carol")], True, True)
+        assert list(server.offline.take("carol")) == [[GC.DELIVER("alice", "hi")]]
+        assert server.msg_command(alice, ["nobody", "hi"]) == ([GC.LOOKUP_FAILED("nobody")], True, True)
+
+        ### Recipient served by another federated name server
+        nodes = [("localhost", 1), ("localhost", 2)]
+        server.federation = Federation(nodes[0], nodes, 10, 1)
+        remote = next(f"user{i}" for i in range(100) if not server.federation.is_local(f"user{i}"))
+        assert server.msg_command(alice, [remote, "hi"]) == ([GC.RELAY_REMOTE(remote)], True, True)
+    finally:
+        bob.out.close()
+        a.close()
+        b.close()
+        server.listen_socket.close()
+        server.credentials.close()
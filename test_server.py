@@ -0,0 +1,240 @@
+from contextlib import contextmanager
+from errno import EMFILE, ECONNABORTED
+from socket import create_connection, socketpair, SHUT_RDWR, SOL_SOCKET, SO_SNDBUF
+from threading import Thread, Event
+import asyncio
+import os
+import time
+
+import pytest
+
+from common.messenger import Messenger
+from person import Person
+from server import Server, AsyncServer, serve_threaded
+from write_queue import WriteQueue
+import common.global_constants as GC
+import server as server_module
+import user_log
+
+
+def wait_until(predicate, timeout: float = 5):
+    """
+    Returns:
+        bool: Whether predicate() became true within timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@contextmanager
+def serving(mode: str, **kwargs):
+    """Serves a name server on a free port in this process.
+
+    Yields:
+        Server: the server, listening.
+    """
+    if mode == "async":
+        server = AsyncServer("localhost", 0, 16, **kwargs)
+        tasks = []
+        started = Event()
+        async def serve():
+            tasks.append((asyncio.get_running_loop(), asyncio.current_task()))
+            started.set()
+            try:
+                await server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+        # asyncio.run() cancels the handlers left when serve_forever is cancelled
+        thread = Thread(target=asyncio.run, args=(serve(),), daemon=True)
+        thread.start()
+        started.wait()
+    else:
+        server = Server("localhost", 0, 16, **kwargs)
+        thread = Thread(target=serve_threaded, args=(server,), daemon=True)
+        thread.start()
+    try:
+        yield server
+    finally:
+        # Lets the handlers see their clients close
+        wait_until(lambda: server.connections_open.value == 0)
+        if mode == "async":
+            loop, task = tasks[0]
+            loop.call_soon_threadsafe(task.cancel)
+        else:
+            # Makes accept() fail, which ends serve_threaded
+            server.listen_socket.shutdown(SHUT_RDWR)
+            server.listen_socket.close()
+        thread.join(5)
+        server.credentials.close()
+        server.users.close()
+
+
+def connect(server: Server):
+    """
+    Returns:
+        (Messenger, socket): a client connection to server, with a timeout.
+    """
+    s = create_connection(server.listen_socket.getsockname())
+    s.settimeout(5)
+    return Messenger(), s
+
+
+def test_register_waits_off_event_loop(tmp_path, monkeypatch):
+    synced = Event()
+    fsync = os.fsync
+    monkeypatch.setattr(user_log.os, "fsync", lambda fd: synced.wait(10) and fsync(fd))
+    with serving("async", registry_path=str(tmp_path / "users.log")) as server:
+        (m, a), (_, b) = connect(server), connect(server)
+        with a, b:
+            m.send_msg(a, "/register alice pw 127.0.0.1 1")
+            assert wait_until(lambda: server.users.log.appended == 1)
+
+            ### Other connections are served while the registration waits for the disk
+            b.settimeout(2)
+            m.send_msg(b, "/ping")
+            assert m.receive_msg(b) == GC.PONG
+
+            synced.set()
+            assert m.receive_msg(a) == GC.REGISTER_SUCCESS
+
+
+@pytest.mark.parametrize("mode", ["thread", "async"])
+def test_node_lookup_refused_unfederated(mode):
+    with serving(mode) as server:
+        (m, a), (_, b) = connect(server), connect(server)
+        with a, b:
+            m.send_msg(a, "/register alice pw 127.0.0.1 1")
+            assert m.receive_msg(a) == GC.REGISTER_SUCCESS
+
+            ### Users online are not listed to anonymous connections
+            m.send_msg(b, GC.NODE_LOOKUP_COMMAND)
+            assert m.receive_msg(b) == GC.LOGIN_INV_COMMAND
+
+
+def test_relay_never_waits_for_recipient(tmp_path):
+    server = Server("localhost", 0, 16, relay=True, offline_dir=str(tmp_path))
+    a, b = socketpair()
+    a.setsockopt(SOL_SOCKET, SO_SNDBUF, 4096)
+    bob = Person(a)
+    bob.set_login("bob", ("127.0.0.1", 2))
+    bob.out = WriteQueue(a, high=1 << 12, low=1 << 10)
+    try:
+        server.users.register("bob", "pw", bob)
+        for i in range(100):
+            server.offline.store("bob", GC.DELIVER("alice", str(i) * 1000))
+
+        ### A frame stored as bob logs in is delivered with the backlog, by
+        ### a delivery of bob's own
+        start = time.monotonic()
+        assert server.store_offline("bob", GC.DELIVER("alice", "hi")) == GC.RELAY_STORED("bob")
+        assert time.monotonic() - start < 1
+        m = Messenger()
+        frames = [m.receive_msg(b) for _ in range(101)]
+        assert frames[0] == GC.DELIVER("alice", "0" * 1000) and frames[-1] == GC.DELIVER("alice", "hi")
+
+        ### Frames for a client that is gone do not count as slow
+        bob.out.close()
+        assert not server.deliver(bob, [b"late"])
+        assert server.slow_client_events["disconnect"].value == 0
+    finally:
+        bob.out.close()
+        a.close()
+        b.close()
+        server.listen_socket.close()
+        server.credentials.close()
+
+
+@pytest.mark.parametrize("mode", ["thread", "async"])
+def test_session(mode):
+    with serving(mode) as server:
+        m, s = connect(server)
+        with s:
+            assert m.hello(s)
+            m.send_msg(s, "/register alice pw 127.0.0.1 5000")
+            assert m.receive_msg(s) == GC.REGISTER_SUCCESS
+            m.send_msg(s, "/lookup")
+            assert m.receive_msg(s) == GC.LOOKUP_PAGE(1, 1, 1) + "\nalice 127.0.0.1 5000"
+            m.send_msg(s, "/logout")
+            assert m.receive_msg(s) == GC.LOGOUT_SUCCESS
+            assert server.users.active() == []
+
+            ### Logging in again on the same connection, then closing it
+            m.send_msg(s, "/login alice pw 127.0.0.1 5001")
+            assert m.receive_msg(s) == GC.LOGIN_SUCCESS
+            m.send_msg(s, "/close")
+            assert m.receive_msg(s) == ""
+        assert wait_until(lambda: server.connections_open.value == 0)
+        assert server.users.active() == []
+
+
+@pytest.mark.parametrize("mode", ["thread", "async"])
+def test_login_survives_dead_hash_worker(mode, monkeypatch):
+    monkeypatch.setattr(server_module, "HASH_WORKERS", 1)
+    with serving(mode) as server:
+        m, s = connect(server)
+        with s:
+            m.send_msg(s, "/register alice pw 127.0.0.1 5000")
+            assert m.receive_msg(s) == GC.REGISTER_SUCCESS
+            m.send_msg(s, "/logout")
+            assert m.receive_msg(s) == GC.LOGOUT_SUCCESS
+
+            ### A /login in the pool as its worker dies fails, but is answered
+            pool = server.credentials.pool
+            server.credentials.submit(time.sleep, 10)
+            m.send_msg(s, "/login alice pw 127.0.0.1 5000")
+            assert wait_until(lambda: len(pool._pending_work_items) == 2)
+            for process in list(pool._processes.values()):
+                process.kill()
+            assert m.receive_msg(s) == GC.LOGIN_FAILURE
+
+            ### The next one is checked by new workers
+            m.send_msg(s, "/login alice pw 127.0.0.1 5000")
+            assert m.receive_msg(s) == GC.LOGIN_SUCCESS
+            assert server.credentials.pool is not pool
+
+
+class FlakySocket:
+    def __init__(self, listen_socket, errors: list):
+        """Wraps listen_socket; accept() fails with errors (errno) first.
+        """
+        self.listen_socket = listen_socket
+        self.errors = errors
+
+    def accept(self):
+        if self.errors:
+            error = self.errors.pop(0)
+            raise OSError(error, os.strerror(error))
+        return self.listen_socket.accept()
+
+    def __getattr__(self, name):
+        return getattr(self.listen_socket, name)
+
+
+def test_accept_errors_do_not_stop_serving(monkeypatch):
+    monkeypatch.setattr(server_module, "ACCEPT_BACKOFF", 0.01)
+    server = Server("localhost", 0, 16)
+    listen_socket = server.listen_socket
+    server.listen_socket = FlakySocket(listen_socket, [EMFILE, ECONNABORTED])
+    thread = Thread(target=serve_threaded, args=(server,), daemon=True)
+    thread.start()
+    try:
+        ### Connections are accepted after transient errors
+        m, s = connect(server)
+        with s:
+            m.send_msg(s, "/ping")
+            assert m.receive_msg(s) == GC.PONG
+        assert not server.listen_socket.errors
+        assert wait_until(lambda: server.connections_open.value == 0)
+
+        ### Until the listen socket is shut down
+        listen_socket.shutdown(SHUT_RDWR)
+        thread.join(5)
+        assert not thread.is_alive()
+    finally:
+        listen_socket.close()
+        server.credentials.close()
+        server.users.close()
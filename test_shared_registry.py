@@ -0,0 +1,47 @@
+from person import Person
+from shared_registry import RegistryState, SharedUserRegistry
+import shared_registry
+
+
+def person(username, port):
+    p = Person(None)
+    p.set_login(username, ("127.0.0.1", port))
+    return p
+
+
+def test_shared_registry():
+    # The coordinator's state is used directly instead of through a proxy
+    state = RegistryState(4, "")
+    first, second = SharedUserRegistry(state, 0), SharedUserRegistry(state, 1)
+    changes = []
+    second.on_change = lambda username, online: changes.append((username, online))
+
+    ### Logins are consistent over workers
+    alice = person("alice", 9001)
+    assert first.register("alice", "cred", alice)
+    assert not second.login("alice", "cred", person("alice", 9002))
+    assert first.get_active("alice") is alice
+    stand_in = second.get_active("alice")
+    assert stand_in.connection is None and stand_in.listen_addr == ("127.0.0.1", 9001)
+    assert [p.username for p in second.active()] == ["alice"]
+
+    ### Changes of all workers are reported by sync()
+    assert second.register("bob", "cred", person("bob", 9003))
+    assert not second.logout("alice")
+    assert first.logout("alice")
+    assert second.sync()
+    assert changes == [("alice", True), ("bob", True), ("alice", False)]
+
+    ### An exited worker's users are logged out
+    assert state.drop_worker(1) == 1
+    assert first.get_active("bob") is None
+
+
+def test_shared_registry_lost_changes(monkeypatch):
+    state = RegistryState(4, "")
+    monkeypatch.setattr(state, "changes", shared_registry.deque(maxlen=2))
+    worker = SharedUserRegistry(state, 0)
+    for name in ("a", "b", "c"):
+        worker.register(name, "cred", person(name, 9000))
+    assert not worker.sync()
+    assert worker.sync()
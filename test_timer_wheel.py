@@ -0,0 +1,35 @@
+import random
+
+from timer_wheel import TimerWheel
+
+
+def test_timer_wheel():
+    wheel = TimerWheel(1.0, slots=4, levels=3, now=0)
+    random.seed(1)
+    # Delays within level 0, on higher levels and beyond the wheel (64 ticks)
+    delays = {key: random.randint(1, 100) for key in range(300)}
+    for key, delay in delays.items():
+        wheel.schedule(key, delay)
+    wheel.schedule("cancelled", 5)
+    wheel.cancel("cancelled")
+    wheel.schedule("moved", 3)
+    wheel.schedule("moved", 50)
+
+    ### Every timer expires at exactly its tick
+    for now in range(1, 101):
+        expired = wheel.advance(now)
+        expected = {key for key, delay in delays.items() if delay == now}
+        if now == 50:
+            expected.add("moved")
+        assert set(expired) == expected, now
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_late_advance():
+    wheel = TimerWheel(0.5, now=10)
+    wheel.schedule("a", 0.2)
+    wheel.schedule("b", 30)
+    assert wheel.advance(10.4) == []
+    assert wheel.advance(10.5) == ["a"]
+    # Ticks missed are caught up on
+    assert wheel.advance(1000) == ["b"]
@@ -0,0 +1,45 @@
+import time
+
+from person import Person
+from user_log import UserLog
+from user_registry import UserRegistry
+
+
+def wait_for_compaction(log: UserLog):
+    for _ in range(100):
+        if not log.compacting:
+            return
+        time.sleep(0.01)
+
+
+def test_user_log(tmp_path):
+    path = str(tmp_path / "users.log")
+
+    ### Registered users survive a restart
+    log = UserLog(path, compact_records=3)
+    registry = UserRegistry(4, log)
+    for i in range(5):
+        assert registry.register(f"user{i}", f"passw{i}", Person(None))
+    assert not registry.register("user1", "other", Person(None))
+    wait_for_compaction(log)
+    registry.close()
+
+    ### Torn last record is dropped
+    with open(path, "ab") as f:
+        f.write(b"half")
+
+    log = UserLog(path, compact_records=3)
+    registry = UserRegistry(4, log)
+    assert log.snapshot is not None
+    for i in range(5):
+        assert registry.is_registered(f"user{i}")
+        assert registry.login(f"user{i}", f"passw{i}", Person(None))
+    assert not registry.is_registered("half")
+    assert not registry.is_registered("user")
+    assert registry.register("half", "passw", Person(None))
+    registry.close()
+
+    log = UserLog(path)
+    log.load()
+    assert log.get("half") == "passw"
+    log.close()
@@ -0,0 +1,45 @@
+from socket import socketpair, SOL_SOCKET, SO_SNDBUF, SO_RCVBUF
+from threading import Thread
+
+from write_queue import WriteQueue
+
+
+def receive(s, n):
+    data = bytearray()
+    while len(data) < n:
+        data += s.recv(n - len(data))
+    return bytes(data)
+
+
+def test_write_queue():
+    a, b = socketpair()
+    a.setsockopt(SOL_SOCKET, SO_SNDBUF, 4096)
+    b.setsockopt(SOL_SOCKET, SO_RCVBUF, 4096)
+    queue = WriteQueue(a, high=1 << 16, low=1 << 12)
+
+    ### Pushes never wait for a reader that is not reading; past the high
+    ### watermark they are refused
+    frames = [bytes([i % 256]) * 1000 for i in range(200)]
+    accepted = []
+    for frame in frames:
+        if not queue.push([frame]):
+            break
+        accepted.append(frame)
+    assert 64 <= len(accepted) < len(frames)
+    assert queue.drainer is not None
+
+    ### A blocking push waits until the reader caught up, and all bytes
+    ### arrive in order
+    sent = b"".join(accepted) + b"last"
+    pusher = Thread(target=queue.push, args=([b"last"], True))
+    pusher.start()
+    assert receive(b, len(sent)) == sent
+    pusher.join()
+
+    ### Closing stops a drain thread waiting for the reader
+    while queue.push([b"x" * 1000]):
+        pass
+    queue.close()
+    assert queue.drainer is None and not queue.push([b"y"], True)
+    a.close()
+    b.close()
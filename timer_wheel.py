@@ -0,0 +1,98 @@
+from threading import Lock
+import math
+import time
+
+
+WHEEL_SLOTS = 64 # buckets per level
+WHEEL_LEVELS = 3 # with 1 s ticks, timers of up to 64 ** 3 s (~3 days)
+
+
+class TimerWheel:
+    def __init__(self, tick: float, slots: int = WHEEL_SLOTS, levels: int = WHEEL_LEVELS, now: float = None):
+        """Hierarchical timer wheel: timers are kept in buckets of tick
+        seconds (level 0), slots * tick seconds (level 1), and so on. Level 0
+        holds the timers due within slots ticks; a bucket of a higher level is
+        moved down a level when the wheel reaches it. Scheduling and
+        cancelling cost O(1), and every tick only looks at the bucket(s) due,
+        never at all timers.
+
+        Args:
+            tick (float): resolution in seconds.
+            now (float): time.monotonic() the wheel starts at.
+        """
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.span = slots ** levels # ticks the wheel can hold a timer for
+        # level -> bucket -> {key: tick the timer is due}
+        self.wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self.where = {} # key -> bucket (dict) holding its timer
+        self.ticks = int((time.monotonic() if now is None else now) / tick)
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.where)
+
+    def insert(self, key, due: int):
+        delta = min(due - self.ticks, self.span - 1)
+        level = 0
+        while delta >= self.slots ** (level + 1):
+            level += 1
+        # Timers further ahead than the wheel holds are moved down early and
+        # inserted again
+        index = ((self.ticks + delta) // self.slots ** level) % self.slots
+        bucket = self.wheels[level][index]
+        bucket[key] = due
+        self.where[key] = bucket
+
+    def remove(self, key):
+        bucket = self.where.pop(key, None)
+        if bucket is not None:
+            del bucket[key]
+
+    def schedule(self, key, delay: float):
+        """Makes key expire after delay seconds (at least one tick),
+        replacing its timer if it has one.
+        """
+        with self.lock:
+            self.remove(key)
+            self.insert(key, self.ticks + max(1, math.ceil(delay / self.tick)))
+
+    def cancel(self, key):
+        with self.lock:
+            self.remove(key)
+
+    def step(self, expired: list):
+        """Advances the wheel one tick, appending the keys that expired to expired.
+        """
+        self.ticks += 1
+        for level in range(self.levels - 1, 0, -1):
+            size = self.slots ** level
+            if self.ticks % size == 0:
+                bucket = self.wheels[level][(self.ticks // size) % self.slots]
+                moved = list(bucket.items())
+                bucket.clear()
+                for key, due in moved:
+                    self.insert(key, due)
+        bucket = self.wheels[0][self.ticks % self.slots]
+        for key, due in list(bucket.items()):
+            if due <= self.ticks:
+                del bucket[key]
+                del self.where[key]
+                expired.append(key)
+
+    def advance(self, now: float = None):
+        """Moves the wheel to time now.
+
+        Args:
+            now (float): time.monotonic(), unless given.
+
+        Returns:
+            list: keys whose timers expired, in order of expiry.
+        """
+        target = int((time.monotonic() if now is None else now) / self.tick)
+        expired = []
+        with self.lock:
+            while self.ticks < target:
+                self.step(expired)
+        return expired
@@ -0,0 +1,219 @@
+from threading import Thread, Condition
+import mmap
+import os
+
+import common.global_constants as GC
+
+
+class UserLog:
+    def __init__(self, path: str, compact_records: int = 100000):
+        """Durable store of registered users (username -> credential).
+
+        Records are "username<TAB>credential" lines. New records are appended to
+        the log at path and fsync'ed by a background thread: every append waits
+        for the fsync that covers it, and all appends made while an fsync runs
+        share the next one. When the log holds compact_records records it is
+        merged, in the background, into a snapshot file sorted by username.
+        The snapshot is memory-mapped and binary searched, so startup only
+        reads the (short) log.
+
+        Args:
+            path (str): log file; created if missing.
+            compact_records (int): log size (in records) that triggers compaction.
+        """
+        self.path = path
+        self.old_path = path + ".old" # log being compacted
+        self.snapshot_path = path + ".snapshot"
+        self.compact_records = compact_records
+
+        self.cond = Condition()
+        self.recent = {} # records in the log
+        self.compacting = {} # records being merged into the snapshot
+        self.snapshot = None # mmap of the snapshot file
+        self.appended = 0 # records written
+        self.synced = 0 # records known to be on disk
+        self.running = True
+
+        self.file = None
+        self.thread = None
+        self.compactor = None # Thread of the last compaction
+
+    def read_log(self, path: str):
+        """Reads a log file, dropping a torn last record.
+
+        Returns:
+            (dict, int): (username -> credential, bytes of complete records)
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}, 0
+        valid = data.rfind(b"\n") + 1
+        fields = data[:valid].decode(GC.ENCODING).replace("\n", "\t").split("\t")
+        fields.pop() # empty string after the last newline
+        return dict(zip(fields[::2], fields[1::2])), valid
+
+    def map_snapshot(self):
+        """
+        Returns:
+            mmap: the snapshot file, read only. None if there is none (or it is empty).
+        """
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def load(self):
+        """Maps the snapshot, reads the log and opens it for appending. Must be
+        called once, before any other method.
+        """
+        self.snapshot = self.map_snapshot()
+        # A compaction may have been interrupted; its records come first
+        self.compacting, _ = self.read_log(self.old_path)
+        self.recent, valid = self.read_log(self.path)
+
+        self.file = open(self.path, "ab")
+        if valid < self.file.tell():
+            # Crashed in the middle of a record
+            self.file.truncate(valid)
+            self.file.seek(valid)
+
+        self.thread = Thread(target=self.sync_loop, daemon=True)
+        self.thread.start()
+        if self.compacting:
+            self.compactor = Thread(target=self.compact, daemon=True)
+            self.compactor.start()
+
+    def search_snapshot(self, snapshot: mmap.mmap, username: str):
+        """Binary searches the sorted snapshot for username.
+
+        Returns:
+            str: credential of username. None if not found.
+        """
+        key = username.encode(GC.ENCODING)
+        lo, hi = 0, len(snapshot) # both always at the start of a line
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = snapshot.rfind(b"\n", lo, mid) + 1 or lo
+            end = snapshot.find(b"\n", start)
+            name, _, credential = snapshot[start:end].partition(b"\t")
+            if name == key:
+                return credential.decode(GC.ENCODING)
+            elif name < key:
+                lo = end + 1
+            else:
+                hi = start
+        return None
+
+    def get(self, username: str):
+        """
+        Returns:
+            str: the credential of username. None if not registered.
+        """
+        credential = self.recent.get(username) or self.compacting.get(username)
+        if credential is None and self.snapshot is not None:
+            credential = self.search_snapshot(self.snapshot, username)
+        return credential
+
+    def append(self, username: str, credential: str):
+        """Appends a record and waits until it is on disk.
+        """
+        with self.cond:
+            self.file.write(f"{username}\t{credential}\n".encode(GC.ENCODING))
+            self.recent[username] = credential
+            self.appended += 1
+            seqno = self.appended
+            self.cond.notify_all()
+            while self.synced < seqno and self.running:
+                self.cond.wait()
+
+    def sync_loop(self):
+        """fsyncs appended records in batches, and starts compactions, until close().
+        """
+        with self.cond:
+            while self.running:
+                if self.synced == self.appended:
+                    self.cond.wait()
+                    continue
+                self.file.flush()
+                batch_end = self.appended
+                # Appends go on while fsync runs, and form the next batch
+                self.cond.release()
+                try:
+                    os.fsync(self.file.fileno())
+                finally:
+                    self.cond.acquire()
+                self.synced = batch_end
+                self.cond.notify_all()
+                if len(self.recent) >= self.compact_records and not self.compacting:
+                    self.rotate()
+                    self.compactor = Thread(target=self.compact, daemon=True)
+                    self.compactor.start()
+
+    def sync(self):
+        """Makes all appended records durable. Must be called with self.cond held.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.synced = self.appended
+        self.cond.notify_all()
+
+    def rotate(self):
+        """Moves the log aside for compaction and starts a new one. Must be
+        called with self.cond held.
+        """
+        self.sync()
+        self.file.close()
+        os.replace(self.path, self.old_path)
+        self.file = open(self.path, "ab")
+        self.compacting, self.recent = self.recent, {}
+
+    def compact(self):
+        """Merges the moved aside log into a new snapshot, and replaces the old
+        snapshot with it. Records of the log take precedence.
+        """
+        tmp_path = self.snapshot_path + ".tmp"
+        records = sorted((username.encode(GC.ENCODING), credential.encode(GC.ENCODING))
+                         for username, credential in self.compacting.items())
+        with open(tmp_path, "wb") as out:
+            old = open(self.snapshot_path, "rb") if self.snapshot is not None else []
+            i = 0
+            for line in old:
+                name = line[:line.index(b"\t")]
+                while i < len(records) and records[i][0] < name:
+                    out.write(b"%s\t%s\n" % records[i])
+                    i += 1
+                if i < len(records) and records[i][0] == name:
+                    continue # superseded
+                out.write(line)
+            for record in records[i:]:
+                out.write(b"%s\t%s\n" % record)
+            if old:
+                old.close()
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        snapshot = self.map_snapshot()
+        with self.cond:
+            # The old mapping is closed when its last reader drops it
+            self.snapshot = snapshot
+            self.compacting = {}
+            if os.path.exists(self.old_path):
+                os.remove(self.old_path)
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join()
+        # A log opened after this one must not compact the same records at once
+        if self.compactor:
+            self.compactor.join()
+        with self.cond:
+            if self.file and not self.file.closed:
+                self.sync()
+                self.file.close()
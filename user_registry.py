@@ -0,0 +1,159 @@
+from threading import Lock
+
+from person import Person
+from user_log import UserLog
+
+
+class Shard:
+    def __init__(self, lock):
+        """Registered and active users whose usernames hash to this shard,
+        guarded by one lock. With a UserLog, registered_users only holds
+        registrations not yet written to the log.
+
+        Args:
+            lock: a Lock, or any lock usable in a with statement.
+        """
+        self.lock = lock
+        self.registered_users = {} # username -> credential
+        self.active_users = {} # username -> Person
+
+
+class UserRegistry:
+    def __init__(self, shards: int = 16, log: UserLog = None, lock_factory=Lock):
+        """Registered and active users of the name server, sharded by username.
+        Every operation only locks the shard of its username, so logins of
+        different users rarely wait for each other.
+
+        Args:
+            shards (int): number of shards (1 gives a single global lock).
+            log (UserLog): if given, registered users are loaded from and
+                           persisted to it.
+            lock_factory (Callable): makes the lock of a shard (e.g. a
+                                     common.metrics.TimedLock to measure waits).
+        """
+        self.shards = [Shard(lock_factory()) for _ in range(shards)]
+        self.log = log
+        # Called with (username, online) on every login and logout, with the
+        # shard lock of username held, so changes of a username are reported
+        # in the order they are made. Must not take registry locks.
+        self.on_change = None
+        if log:
+            log.load()
+
+    def shard(self, username: str):
+        """
+        Returns:
+            Shard: the shard username belongs to.
+        """
+        return self.shards[hash(username) % len(self.shards)]
+
+    def stored_credential(self, shard: Shard, username: str):
+        """Must be called with shard.lock held.
+
+        Returns:
+            str: credential of username. None if username is not registered.
+        """
+        credential = shard.registered_users.get(username)
+        if credential is None and self.log:
+            credential = self.log.get(username)
+        return credential
+
+    def credential(self, username: str):
+        """
+        Returns:
+            str: stored credential of username. None if username is not registered.
+        """
+        shard = self.shard(username)
+        with shard.lock:
+            return self.stored_credential(shard, username)
+
+    def register(self, username: str, credential: str, person: Person):
+        """Registers username and logs person in as username.
+
+        Returns:
+            bool: False if username is already registered.
+        """
+        shard = self.shard(username)
+        with shard.lock:
+            if self.stored_credential(shard, username) is not None:
+                return False
+            shard.registered_users[username] = credential
+            shard.active_users[username] = person
+            self.changed(username, True)
+        if self.log:
+            # Outside the shard lock, as it waits for the disk
+            self.log.append(username, credential)
+            with shard.lock:
+                # The log has it now
+                del shard.registered_users[username]
+        return True
+
+    def login(self, username: str, credential: str, person: Person):
+        """Logs person in as username if credential still is the stored
+        credential of username (verified by the caller) and username is not
+        already logged in.
+
+        Returns:
+            bool: Whether person is now logged in.
+        """
+        shard = self.shard(username)
+        with shard.lock:
+            if self.stored_credential(shard, username) != credential or username in shard.active_users:
+                return False
+            shard.active_users[username] = person
+            self.changed(username, True)
+        return True
+
+    def logout(self, username: str):
+        """
+        Returns:
+            bool: False if username was not logged in.
+        """
+        shard = self.shard(username)
+        with shard.lock:
+            if shard.active_users.pop(username, None) is None:
+                return False
+            self.changed(username, False)
+        return True
+
+    def changed(self, username: str, online: bool):
+        if self.on_change:
+            self.on_change(username, online)
+
+    def sync(self):
+        """Reports changes made elsewhere to on_change; a local registry has none.
+
+        Returns:
+            bool: False if changes were lost (see SharedUserRegistry.sync).
+        """
+        return True
+
+    def get_active(self, username: str):
+        """
+        Returns:
+            Person: the logged in user username. None if not logged in.
+        """
+        shard = self.shard(username)
+        with shard.lock:
+            return shard.active_users.get(username)
+
+    def is_registered(self, username: str):
+        shard = self.shard(username)
+        with shard.lock:
+            return self.stored_credential(shard, username) is not None
+
+    def active(self):
+        """Snapshot of all logged in users, taken one shard at a time.
+
+        Returns:
+            list: Person of every logged in user.
+        """
+        users = []
+        for shard in self.shards:
+            with shard.lock:
+                users.extend(shard.active_users.values())
+        return users
+
+    def close(self):
+        if self.log:
+            self.log.close()
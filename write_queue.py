@@ -0,0 +1,129 @@
+from socket import socket, MSG_DONTWAIT, SHUT_WR
+from collections import deque
+from itertools import islice
+from threading import Condition, Thread
+
+
+IOV_MAX = 1024 # buffers per sendmsg() (the limit of Linux)
+
+
+class WriteQueue:
+    def __init__(self, sock: socket, high: int, low: int):
+        """Outbound bytes of one connection, sent in order by whichever
+        thread queues them, without waiting for the peer.
+
+        Queued buffers are written with sendmsg(), many at a time and without
+        joining them, and without blocking: what the socket does not take is
+        left to a drain thread, started only while the connection is backed
+        up. Past high queued bytes the queue pushes back: pushes that may
+        block (the replies of the connection's own handler) wait until no more
+        than low bytes are queued, the others are refused.
+
+        Args:
+            sock (socket): the connection.
+            high (int): high watermark, in bytes.
+            low (int): low watermark, in bytes.
+        """
+        self.sock = sock
+        self.high = high
+        self.low = low
+        self.buffers = deque() # bytes (or memoryview of the unsent rest)
+        self.queued = 0 # bytes in buffers
+        self.cond = Condition()
+        self.closed = False
+        self.drainer = None # Thread, while it sends
+
+    def push(self, buffers: list, block: bool = False):
+        """Queues buffers to be sent after everything queued before.
+
+        Args:
+            buffers (list): bytes to send, in order.
+            block (bool): Whether to wait (see WriteQueue) rather than refuse
+                          buffers when the queue is past its high watermark.
+
+        Returns:
+            bool: False if buffers were refused or the connection is closed.
+        """
+        with self.cond:
+            if self.closed or (not block and self.queued > self.high):
+                return False
+            self.buffers.extend(buffers)
+            self.queued += sum(map(len, buffers))
+            if self.drainer is None:
+                self.send()
+            if self.queued > self.high:
+                while block and self.queued > self.low and not self.closed:
+                    self.cond.wait()
+            return not self.closed
+
+    def consume(self, n: int):
+        """Drops the first n bytes of the buffers (they were sent).
+        Must be called with self.cond held.
+        """
+        self.queued -= n
+        while n:
+            first = self.buffers[0]
+            if len(first) <= n:
+                n -= len(first)
+                self.buffers.popleft()
+            else:
+                self.buffers[0] = memoryview(first)[n:]
+                n = 0
+        if self.queued <= self.low:
+            self.cond.notify_all()
+
+    def fail(self):
+        """Gives up on the connection. Must be called with self.cond held.
+        """
+        self.closed = True
+        self.buffers.clear()
+        self.queued = 0
+        self.cond.notify_all()
+
+    def send(self):
+        """Sends what the socket takes without blocking, and starts the drain
+        thread for the rest. Must be called with self.cond held.
+        """
+        try:
+            while self.buffers:
+                self.consume(self.sock.sendmsg(list(islice(self.buffers, IOV_MAX)), [], MSG_DONTWAIT))
+        except BlockingIOError:
+            self.drainer = Thread(target=self.drain, daemon=True)
+            self.drainer.start()
+        except OSError:
+            self.fail()
+
+    def drain(self):
+        """Sends the queued buffers, waiting for the peer, until none are left.
+        """
+        while True:
+            with self.cond:
+                if self.closed or not self.buffers:
+                    self.drainer = None
+                    return
+                batch = list(islice(self.buffers, IOV_MAX))
+            try:
+                n = self.sock.sendmsg(batch)
+            except OSError:
+                with self.cond:
+                    self.fail()
+                    self.drainer = None
+                return
+            with self.cond:
+                if not self.closed:
+                    self.consume(n)
+
+    def close(self):
+        """Drops the unsent bytes and stops the drain thread. Must be called
+        before the socket is closed.
+        """
+        with self.cond:
+            self.fail()
+            drainer = self.drainer
+        if drainer:
+            try:
+                # Makes a sendmsg() waiting for the peer return
+                self.sock.shutdown(SHUT_WR)
+            except OSError:
+                pass
+            drainer.join()